@@ -0,0 +1,73 @@
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .protocol_settings import registry_map_entry
+
+
+class change_filter:
+    ''' per device / variable change detection between read and bridge write; values that moved less than their deadband are dropped, until max_silence passes '''
+
+    deadband : float = 0
+    ''' default deadband; 0 = forward any change '''
+
+    deadband_percent : bool = False
+    ''' default deadband is a percentage of the last forwarded value '''
+
+    max_silence : float = 0
+    ''' seconds; forward a value at least this often, even if unchanged. 0 = never '''
+
+    deadbands : dict[str, tuple[float, bool]]
+    ''' (deadband, is percent) per variable name, from the registry map "deadband" column '''
+
+    last : dict[tuple[str, str], tuple[object, float]]
+    ''' (last forwarded value, monotonic time) per (device, variable name) '''
+
+    def __init__(self, deadband : str = "", max_silence : float = 0, entries : list["registry_map_entry"] = None):
+        self.deadband, self.deadband_percent = self.parse_deadband(deadband) if deadband else (0, False)
+        if self.deadband < 0:
+            self.deadband = 0
+
+        self.max_silence = max_silence
+        self.deadbands = {}
+        self.last = {}
+
+        for entry in entries or []:
+            if entry.deadband >= 0:
+                self.deadbands[entry.variable_name] = (entry.deadband, entry.deadband_percent)
+
+    @staticmethod
+    def parse_deadband(value : str) -> tuple[float, bool]:
+        ''' "0.5" => (0.5, False), "2%" => (2, True); raises ValueError '''
+        value = value.strip()
+        if value.endswith("%"):
+            return (float(value[:-1]), True)
+        return (float(value), False)
+
+    def filter(self, device : str, info : dict[str, str]) -> dict[str, str]:
+        ''' returns the values of info that should be forwarded '''
+        now = time.monotonic()
+        max_silence = self.max_silence if self.max_silence > 0 else float("inf")
+        default = (self.deadband, self.deadband_percent)
+
+        changed = {}
+        for name, value in info.items():
+            key = (device, name)
+            previous = self.last.get(key)
+            if previous is not None and now - previous[1] < max_silence:
+                old = previous[0]
+                if value == old:
+                    continue
+
+                deadband, percent = self.deadbands.get(name, default)
+                if deadband > 0 and isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                    if percent:
+                        deadband = abs(old) * deadband / 100
+
+                    if abs(value - old) <= deadband:
+                        continue
+
+            changed[name] = value
+            self.last[key] = (value, now)
+
+        return changed
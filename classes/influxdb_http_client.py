@@ -0,0 +1,189 @@
+import base64
+import gzip
+import http.client
+import json
+import math
+import urllib.parse
+
+
+class influxdb_http_client:
+    '''
+    writes points to influxdb as line protocol over a keep-alive http connection, without the influxdb package.
+    supports the v1 /write and the v2 /api/v2/write endpoints.
+    implements the parts of influxdb.InfluxDBClient that influxdb_out uses; write_points takes the same point dicts
+    '''
+
+    MEASUREMENT_ESCAPE = str.maketrans({",": "\\,", " ": "\\ "})
+    KEY_ESCAPE = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ "})
+    ''' tag keys, tag values and field keys '''
+    STRING_ESCAPE = str.maketrans({'"': '\\"', "\\": "\\\\"})
+    ''' field string values '''
+
+    host : str
+    port : int
+    database : str
+    username : str
+    password : str
+    timeout : float = 10
+    gzip : bool = False
+    version : int = 1
+    ''' 1 = /write, 2 = /api/v2/write '''
+    org : str = ""
+    bucket : str = ""
+    token : str = ""
+    ssl : bool = False
+
+    connection : http.client.HTTPConnection = None
+
+    series : dict[tuple, str]
+    ''' (measurement, tags) => escaped "measurement,tag=value" prefix; tags rarely change, so most points reuse one '''
+
+    keys : dict[str, str]
+    ''' field name => escaped "name=" '''
+
+    def __init__(self, host : str, port : int, database : str = "", username : str = None, password : str = None, timeout : float = timeout,
+                 gzip : bool = gzip, version : int = version, org : str = org, bucket : str = bucket, token : str = token, ssl : bool = ssl):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.gzip = gzip
+        self.version = version
+        self.org = org
+        self.bucket = bucket or database
+        self.token = token
+        self.ssl = ssl
+        self.series = {}
+        self.keys = {}
+
+        self.headers = {"Content-Type" : "text/plain; charset=utf-8"}
+        if self.version == 2:
+            self.headers["Authorization"] = "Token " + self.token
+            self.write_path = "/api/v2/write?" + urllib.parse.urlencode({"org" : self.org, "bucket" : self.bucket, "precision" : "ns"})
+        else:
+            if self.username:
+                credentials = base64.b64encode(f"{self.username}:{self.password or ''}".encode("utf-8")).decode("ascii")
+                self.headers["Authorization"] = "Basic " + credentials
+            self.write_path = "/write?" + urllib.parse.urlencode({"db" : self.database, "precision" : "ns"})
+
+        if self.gzip:
+            self.headers["Content-Encoding"] = "gzip"
+
+    #region line protocol
+    def get_series(self, measurement : str, tags : dict[str, str]) -> str:
+        key = (measurement, tuple(tags.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = measurement.translate(self.MEASUREMENT_ESCAPE)
+            for name, value in sorted(tags.items()):
+                if value is None or value == "": #empty tag values are rejected by influxdb
+                    continue
+                series += "," + str(name).translate(self.KEY_ESCAPE) + "=" + str(value).translate(self.KEY_ESCAPE)
+
+            if len(self.series) > 1000: #tags that change every point; dont grow forever
+                self.series.clear()
+                self.keys.clear()
+            self.series[key] = series
+
+        return series
+
+    def encode_field(self, value) -> str:
+        ''' returns None for values that can't be written, ie: nan '''
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, int):
+            return str(value) + "i"
+        if isinstance(value, float):
+            return repr(value) if math.isfinite(value) else None
+        if value is None:
+            return None
+        return '"' + str(value).translate(self.STRING_ESCAPE) + '"'
+
+    def encode_point(self, point : dict) -> str:
+        ''' one line of line protocol; None if the point has no fields '''
+        keys = self.keys
+        fields = []
+        for name, value in point["fields"].items():
+            key = keys.get(name)
+            if key is None:
+                key = keys[name] = str(name).translate(self.KEY_ESCAPE) + "="
+
+            if type(value) is float: #most fields; skip encode_field
+                if value - value == 0: #not nan or inf
+                    fields.append(key + repr(value))
+                continue
+
+            value = self.encode_field(value)
+            if value is not None:
+                fields.append(key + value)
+
+        if not fields:
+            return None
+
+        line = self.get_series(point["measurement"], point.get("tags") or {}) + " " + ",".join(fields)
+        if point.get("time") is not None:
+            line += " " + str(int(point["time"]))
+        return line
+
+    def encode_points(self, points : list[dict]) -> bytes:
+        lines = [line for line in map(self.encode_point, points) if line is not None]
+        return "\n".join(lines).encode("utf-8")
+    #endregion
+
+    def request(self, method : str, path : str, body : bytes = None, headers : dict[str, str] = None) -> tuple[int, bytes]:
+        ''' returns (status, body); reconnects once if the kept-alive connection was closed '''
+        for attempt in range(2):
+            if self.connection is None:
+                connection_type = http.client.HTTPSConnection if self.ssl else http.client.HTTPConnection
+                self.connection = connection_type(self.host, self.port, timeout=self.timeout)
+
+            try:
+                self.connection.request(method, path, body=body, headers=headers or {})
+                response = self.connection.getresponse()
+                return (response.status, response.read())
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+    def query(self, query : str, method : str = "GET") -> dict:
+        ''' v1 /query '''
+        path = "/query?" + urllib.parse.urlencode({"q" : query})
+        headers = {key : value for key, value in self.headers.items() if key == "Authorization"}
+        status, body = self.request(method, path, headers=headers)
+        if status >= 300:
+            raise RuntimeError("InfluxDB query failed (" + str(status) + "): " + body.decode("utf-8", "replace"))
+        return json.loads(body) if body else {}
+
+    def ping(self):
+        status, body = self.request("GET", "/ping")
+        if status >= 300:
+            raise RuntimeError("InfluxDB ping failed (" + str(status) + "): " + body.decode("utf-8", "replace"))
+
+    def get_list_database(self) -> list[dict[str, str]]:
+        result = self.query("SHOW DATABASES")
+        series = result.get("results", [{}])[0].get("series", [])
+        return [{"name" : values[0]} for values in series[0].get("values", [])] if series else []
+
+    def create_database(self, name : str):
+        self.query('CREATE DATABASE "' + name.replace('"', '\\"') + '"', method="POST")
+
+    def write_points(self, points : list[dict]) -> bool:
+        body = self.encode_points(points)
+        if not body:
+            return True
+
+        if self.gzip:
+            body = gzip.compress(body, compresslevel=5)
+
+        status, response = self.request("POST", self.write_path, body=body, headers=self.headers)
+        if status >= 300:
+            raise RuntimeError("InfluxDB write failed (" + str(status) + "): " + response.decode("utf-8", "replace"))
+        return True
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -1,18 +1,32 @@
 import ast
+import bisect
 import csv
 import glob
+import hashlib
 import itertools
 import json
 import logging
+import operator
 import os
+import pickle
 import re
+import sys
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from enum import Enum
-from typing import TYPE_CHECKING, Union
+from typing import TYPE_CHECKING, Callable, Union
 
 from defs.common import strtoint
 
+from .change_filter import change_filter
+from .registry_image import registry_image
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 if TYPE_CHECKING:
     from configparser import SectionProxy
 
@@ -181,7 +195,18 @@ class Registry_Type(Enum):
     HOLDING = 0x03
     INPUT = 0x04
 
-@dataclass
+def slots_dataclass(cls):
+    ''' @dataclass(slots=True), also on python 3.9; the class is rebuilt with __slots__ like 3.10+ does '''
+    if sys.version_info >= (3, 10):
+        return dataclass(slots=True)(cls)
+
+    cls = dataclass(cls)
+    names = tuple(field.name for field in fields(cls))
+    namespace = {key : value for key, value in cls.__dict__.items() if key not in names and key not in ("__dict__", "__weakref__")}
+    namespace["__slots__"] = names #defaults are in the generated __init__; class attributes would conflict with the slots
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+@slots_dataclass #no per entry __dict__; entries are most of a protocol's memory
 class registry_map_entry:
     registry_type : Registry_Type
     register : int
@@ -194,9 +219,11 @@ class registry_map_entry:
     unit : str
     unit_mod : float
     concatenate : bool
-    concatenate_registers : list[int]
+    concatenate_registers : tuple[int, ...]
+    ''' shared by every entry of the range; do not modify '''
 
-    values : list
+    values : tuple
+    ''' shared by entries with the same values; do not modify '''
     value_regex : str = ""
 
     value_min : int = 0
@@ -219,11 +246,17 @@ class registry_map_entry:
     ''' how often to read register in ms'''
 
     next_read_timestamp : int = 0
-    ''' unix timestamp in ms '''
+    ''' unix timestamp in ms; only when calculate_registry_ranges is not given a per transport schedule '''
 
     write_mode : WriteMode = WriteMode.READ
     ''' enable disable reading/writing '''
 
+    deadband : float = -1
+    ''' change filter; minimum change to forward the value. -1 = transport default '''
+
+    deadband_percent : bool = False
+    ''' deadband is a percentage of the last forwarded value '''
+
     def __str__(self):
         return self.variable_name
 
@@ -254,7 +287,26 @@ class protocol_settings:
     registry_map_size : dict[Registry_Type, int] = {}
     registry_map_ranges : dict[Registry_Type, list[tuple]] = {}
 
+    registry_map_names : dict[Registry_Type, dict[str, registry_map_entry]]
+    ''' variable_name => first entry with that name, per registry map '''
+
+    registry_map_documented_names : dict[Registry_Type, dict[str, registry_map_entry]]
+    ''' documented_name => first entry with that name, per registry map '''
+
+    registry_map_registers : dict[Registry_Type, dict[int, list[registry_map_entry]]]
+    ''' register => entries on that register, per registry map; several for bit / byte entries and concatenated ranges share a name '''
+
     codes : dict[str, str]
+
+    code_tables : dict[str, dict[str, str]]
+    ''' name => codes; codes[name + "_codes"] without the string concatenation. built once codes are loaded '''
+
+    reverse_code_tables : dict[str, dict[str, str]]
+    ''' name => { stripped lower case value : code }; translates written values back to codes '''
+
+    multibit_flags : dict[str, tuple[tuple[int, str], ...]]
+    ''' name => (bit mask, value) for every multi bit flag code, ie: "b0&b3" '''
+
     settings : dict[str, str]
     ''' default settings provided by protocol json '''
 
@@ -262,6 +314,50 @@ class protocol_settings:
 
     byteorder : str = "big"
 
+    max_batch_size : int = 45
+    ''' max registers per read; see manual, says max batch is 45 '''
+
+    max_batch_gap : int = -1
+    ''' max unmapped registers a read may span to merge two ranges; -1 = up to max_batch_size '''
+
+    decoders : dict[int, Callable[[dict[int, int]], object]]
+    ''' compiled ushort decoder per registry_map_entry, keyed by id(entry); only for entries owned by registry_map '''
+
+    decoder_plans : dict[int, list[tuple]]
+    ''' compiled decode plan per registry map, keyed by id(registry_map[registry_type]) '''
+
+    vectorized_decoding : bool = False
+    ''' decode plain numeric entries with numpy; requires numpy '''
+
+    vectorized_plans : dict[int, tuple]
+    ''' (vectorized groups, scalar plan) per registry map, keyed by id(registry_map[registry_type]) '''
+
+    protocol_cache : bool = False
+    ''' cache the parsed codes, settings and registry maps; startup loads one file instead of parsing every csv. opt in, only for transports '''
+
+    protocol_cache_path : str = "protocol_cache"
+    ''' folder for the protocol cache; one pickle per protocol and read_interval '''
+
+    protocol_files : dict[str, tuple]
+    ''' path => (mtime_ns, size, sha256) of every file the protocol was loaded from, or None if it did not exist. the cache is invalid once any change '''
+
+    PROTOCOL_CACHE_VERSION : int = 2
+    ''' bump when the cached format changes '''
+
+    code_digest : str = ""
+    ''' sha256 of this module, which defines every pickled class; part of the cache key, so code changes invalidate the cache '''
+
+    shared : dict[tuple, "protocol_settings"] = {}
+    ''' interned instances, see protocol_settings.get; keyed by protocol, settings_dir and SHARED_SETTINGS '''
+
+    shared_lock : threading.Lock = threading.Lock()
+
+    interned_values : dict[tuple, tuple] = {}
+    ''' one registry_map_entry.values tuple per distinct values, for all protocols; like sys.intern for strings '''
+
+    SHARED_SETTINGS : tuple[str] = ("read_interval", "batch_max_gap", "vectorized_decoding", "protocol_cache", "protocol_cache_path")
+    ''' transport settings that change how a protocol is loaded; transports only share protocol settings if these match '''
+
     _log : logging.Logger = None
 
 
@@ -275,6 +371,14 @@ class protocol_settings:
         self.protocol = protocol
         self.settings_dir = settings_dir
         self.transport_settings = transport_settings
+        self.protocol_files = {}
+
+        self.protocol_cache = self.transport_settings is not None and self.transport_settings.getboolean("protocol_cache", self.protocol_cache)
+        if self.protocol_cache:
+            self.protocol_cache_path = self.transport_settings.get("protocol_cache_path", self.protocol_cache_path)
+            self.track_protocol_file(__file__) #parsing changes with the code
+            self.track_protocol_file("variable_mask.txt")
+            self.track_protocol_file("variable_screen.txt")
 
         #load variable mask
         self.variable_mask = []
@@ -296,7 +400,12 @@ class protocol_settings:
 
                     self.variable_screen.append(line.strip().lower())
 
-        self.load__json() #load first, so priority to json codes
+        cache : dict = self.load_protocol_cache() if self.protocol_cache else None
+        if cache is not None:
+            self.codes = cache["codes"]
+            self.settings = cache["settings"]
+        else:
+            self.load__json() #load first, so priority to json codes
 
         if "transport" in self.settings:
             self.transport = self.settings["transport"]
@@ -308,8 +417,68 @@ class protocol_settings:
         if "byteorder" in self.settings: #handle byte order for ints n stuff
             self.byteorder = self.settings["byteorder"]
 
+        if "batch_size" in self.settings:
+            try:
+                self.max_batch_size = int(self.settings["batch_size"])
+            except ValueError:
+                pass
+
+        if "batch_max_gap" in self.settings:
+            try:
+                self.max_batch_gap = int(self.settings["batch_max_gap"])
+            except ValueError:
+                pass
+
+        if self.transport_settings is not None:
+            self.max_batch_gap = self.transport_settings.getint("batch_max_gap", self.max_batch_gap)
+            self.vectorized_decoding = self.transport_settings.getboolean("vectorized_decoding", self.vectorized_decoding)
+
+        if self.vectorized_decoding and numpy is None:
+            self._log.warning("vectorized_decoding requires numpy; pip install numpy. using default decoding")
+            self.vectorized_decoding = False
+
+        if self.max_batch_gap < 0:
+            self.max_batch_gap = self.max_batch_size
+
+        #per instance; compiled plans are keyed by id of these maps
+        self.registry_map = {}
+        self.registry_map_size = {}
+        self.registry_map_ranges = {}
+        self.registry_map_names = {}
+        self.registry_map_documented_names = {}
+        self.registry_map_registers = {}
+
+        self.decoders = {}
+        self.decoder_plans = {}
+        self.vectorized_plans = {}
+
         for registry_type in Registry_Type:
-            self.load_registry_map(registry_type)
+            if cache is None:
+                self.load_registry_map(registry_type)
+            elif registry_type in cache["registry_map"]:
+                self.registry_map[registry_type] = cache["registry_map"][registry_type]
+
+        self.compile_codes() #after the registry maps; csv values can add codes
+        for registry_type in self.registry_map: #after the codes; decoders resolve their code table once
+            self.compile_registry_map(registry_type)
+
+        if self.protocol_cache and cache is None:
+            self.save_protocol_cache()
+
+    @classmethod
+    def get(cls, protocol : str, transport_settings : "SectionProxy" = None, settings_dir : str = "protocols") -> "protocol_settings":
+        ''' shared protocol settings; transports with the same protocol share one parsed registry map and codes.
+        the shared instance must not be modified; per transport read timing is passed to calculate_registry_ranges as a schedule '''
+        key = (protocol, os.path.abspath(settings_dir), transport_settings is not None)
+        if transport_settings is not None:
+            key += tuple(transport_settings.get(name, "").strip().lower() for name in cls.SHARED_SETTINGS)
+
+        with cls.shared_lock:
+            instance = cls.shared.get(key)
+            if instance is None:
+                instance = cls.shared[key] = cls(protocol, transport_settings=transport_settings, settings_dir=settings_dir)
+
+        return instance
 
     def get_registry_map(self, registry_type : Registry_Type = Registry_Type.ZERO) -> list[registry_map_entry]:
         return self.registry_map[registry_type]
@@ -327,26 +496,68 @@ class protocol_settings:
         return self.get_registry_entry(name, registry_type=Registry_Type.INPUT)
 
     def get_registry_entry(self, name : str, registry_type : Registry_Type) -> registry_map_entry:
-
+        ''' by documented name '''
         name = name.strip().lower().replace(" ", "_") #clean name
-        for item in self.registry_map[registry_type]:
-            if item.documented_name == name:
-                return item
+        return self.registry_map_documented_names.get(registry_type, {}).get(name)
+
+    def get_registry_entry_by_variable(self, variable_name : str, registry_type : Registry_Type) -> registry_map_entry:
+        ''' by variable name; as is, names are not cleaned '''
+        return self.registry_map_names.get(registry_type, {}).get(variable_name)
 
-        return None
+    def get_registry_entries_by_register(self, start : int, end : int, registry_type : Registry_Type) -> list[registry_map_entry]:
+        ''' entries on registers start to end, inclusive '''
+        registers = self.registry_map_registers.get(registry_type, {})
+        return [entry for register in range(start, end + 1) for entry in registers.get(register, ())]
     
+    def compile_codes(self):
+        ''' forward and reverse code tables and multi bit flag masks; codes are read on every decode and write '''
+        self.code_tables = {}
+        self.reverse_code_tables = {}
+        self.multibit_flags = {}
+
+        for key, codes in self.codes.items():
+            if not key.endswith("_codes") or not isinstance(codes, dict):
+                continue
+
+            name = key[:-len("_codes")]
+            self.code_tables[name] = codes
+
+            reverse : dict[str, str] = {}
+            for code, value in codes.items():
+                reverse.setdefault(str(value).strip().lower(), code) #first code wins, as the old linear search did
+            self.reverse_code_tables[name] = reverse
+
+            multibit : list[tuple[int, str]] = []
+            for code, value in codes.items():
+                if "&" not in code:
+                    continue
+
+                bits = [bit.strip().lower() for bit in code.split("&")]
+                if not all(bit[:1] == "b" and bit[1:].isdigit() for bit in bits):
+                    self._log.warning("Invalid multibit flag : " + code + " in " + key)
+                    continue
+
+                mask : int = 0
+                for bit in bits:
+                    mask |= 1 << int(bit[1:])
+                multibit.append((mask, value))
+
+            if multibit:
+                self.multibit_flags[name] = tuple(multibit)
+
+    def get_codes(self, entry : registry_map_entry) -> dict[str, str]:
+        ''' the entry's codes; None if it has none '''
+        return self.code_tables.get(entry.documented_name)
+
     def get_code_by_value(self, entry : registry_map_entry, value : str, fallback=None) -> str:
-        ''' case insensitive '''
-        
-        value = value.strip().lower()
-
-        if entry.variable_name+"_codes" in self.codes:
-            codes = self.codes[entry.variable_name+"_codes"]
-            for code, val in codes.items():
-                if value == val.lower():
-                    return code
-                
-        return fallback
+        ''' case insensitive; codes by documented name like decoding, or by variable name '''
+        reverse = self.reverse_code_tables.get(entry.documented_name)
+        if reverse is None:
+            reverse = self.reverse_code_tables.get(entry.variable_name)
+            if reverse is None:
+                return fallback
+
+        return reverse.get(value.strip().lower(), fallback)
 
     def load__json(self, file : str = "", settings_dir : str = ""):
         if not settings_dir:
@@ -419,6 +630,7 @@ class protocol_settings:
 
         #assuming path ends with .csv
         override_path = path[:-4] + ".override.csv"
+        self.track_protocol_file(override_path)
 
         if os.path.exists(override_path):
             self._log.info("loading override file: " + override_path)
@@ -670,6 +882,16 @@ class protocol_settings:
                 else:
                     read_command = row["read command"].encode("utf-8")
 
+            #region deadband
+            deadband : float = -1
+            deadband_percent : bool = False
+            if "deadband" in row and row["deadband"]:
+                try:
+                    deadband, deadband_percent = change_filter.parse_deadband(row["deadband"])
+                except ValueError:
+                    self._log.warning("Invalid deadband : " + str(row["deadband"]) + " reg: " + str(row["register"]) + " path: " + str(path))
+            #endregion deadband
+
             writeMode : WriteMode = WriteMode.READ
             if "writable" in row:
                 writeMode = WriteMode.fromString(row["writable"])
@@ -677,6 +899,14 @@ class protocol_settings:
             if "write" in row:
                 writeMode = WriteMode.fromString(row["write"])
 
+            #interned / shared; the same names, units and values repeat across entries and devices
+            variable_name = sys.intern(variable_name)
+            documented_name = sys.intern(row["documented name"])
+            unit_symbol = sys.intern(str(unit_symbol))
+            concatenate_registers = tuple(concatenate_registers)
+            values = tuple(values)
+            values = self.interned_values.setdefault(values, values)
+
             for i in r:
                 item = registry_map_entry(
                                             registry_type = registry_type,
@@ -684,8 +914,8 @@ class protocol_settings:
                                             register_bit=register_bit,
                                             register_byte= register_byte,
                                             variable_name= variable_name,
-                                            documented_name = row["documented name"],
-                                            unit= str(unit_symbol),
+                                            documented_name = documented_name,
+                                            unit= unit_symbol,
                                             unit_mod= unit_multiplier,
                                             data_type= data_type,
                                             data_type_size = data_type_len,
@@ -698,7 +928,9 @@ class protocol_settings:
                                             value_regex=value_regex,
                                             read_command = read_command,
                                             read_interval=read_interval,
-                                            write_mode=writeMode
+                                            write_mode=writeMode,
+                                            deadband=deadband,
+                                            deadband_percent=deadband_percent
                                         )
                 registry_map.append(item)
 
@@ -764,9 +996,9 @@ class protocol_settings:
 
 
                         if combined_item.documented_name == combined_item.variable_name:
-                            combined_item.variable_name = combined_item.variable_name[:-2].strip()
+                            combined_item.variable_name = sys.intern(combined_item.variable_name[:-2].strip())
 
-                        combined_item.documented_name = combined_item.documented_name[:-2].strip()
+                        combined_item.documented_name = sys.intern(combined_item.documented_name[:-2].strip())
 
                         if not combined_item.unit: #fix inconsistsent documentation
                             combined_item.unit = registry_map[index].unit
@@ -796,46 +1028,72 @@ class protocol_settings:
 
             return registry_map
 
-    def calculate_registry_ranges(self, map : list[registry_map_entry], max_register : int, init : bool = False, timestamp: int = 0) -> list[tuple]:
+    def calculate_registry_ranges(self, map : list[registry_map_entry], max_register : int, init : bool = False, timestamp: int = 0, holes : set[int] = None, schedule : dict[int, int] = None) -> list[tuple]:
 
-        ''' read optimization; calculate which ranges to read'''
-        max_batch_size = 45 #see manual; says max batch is 45
+        ''' read optimization; calculate which ranges to read. merges registers into as few reads as possible, without exceeding max_batch_size or spanning gaps larger than max_batch_gap
+        holes are registers the device rejects; ranges never cover them, entries using them are skipped
+        schedule is the transport's next read timestamp per entry, keyed by id(entry); without one, entry.next_read_timestamp is used'''
 
-        if "batch_size" in self.settings:
-            try:
-                max_batch_size = int(self.settings["batch_size"])
-            except ValueError:
-                pass
+        sorted_holes : list[int] = sorted(holes) if holes else []
 
-        start = -max_batch_size
-        ranges : list[tuple] = []
+        def has_hole(first : int, last : int) -> bool:
+            i = bisect.bisect_left(sorted_holes, first)
+            return i < len(sorted_holes) and sorted_holes[i] <= last
 
         if timestamp > 0:
             timestamp_ms = timestamp*1000
         else:
             timestamp_ms = int(time.time() * 1000)
 
-        while (start := start+max_batch_size) <= max_register:
-
-            registers : list[int] = [] #use a list, im too lazy to write logic
+        #(first, last) register of every entry due for reading
+        spans : list[tuple[int, int]] = []
+        for register in map:
+            if register.write_mode == WriteMode.READDISABLED: ##register is disabled; skip
+                continue
+            if register.write_mode == WriteMode.WRITEONLY: ##Write Only; skip
+                continue
 
-            end = start+max_batch_size
-            for register in map:
-                if register.register >= start and register.register < end:
-                    if register.write_mode == WriteMode.READDISABLED: ##register is disabled; skip
+            #we are assuming calc registry ranges is being called EVERY READ.
+            if not init: #init; add but do not update timestamp; can maybe rename init to no timestamp at this point
+                if schedule is not None: #per transport; protocol settings are shared
+                    if schedule.get(id(register), 0) >= timestamp_ms:
                         continue
-                    if register.write_mode == WriteMode.WRITEONLY: ##Write Only; skip
+                    schedule[id(register)] = timestamp_ms + register.read_interval
+                else:
+                    if register.next_read_timestamp >= timestamp_ms:
                         continue
+                    register.next_read_timestamp = timestamp_ms + register.read_interval
+
+            last = register.register
+            if register.data_type == Data_Type.UINT or register.data_type == Data_Type.INT: #32 bit; uses the next register too
+                last = last + 1
+
+            if sorted_holes and has_hole(register.register, last): #device rejects this register
+                continue
+
+            spans.append((register.register, last))
+
+        spans.sort()
+
+        ranges : list[tuple] = []
+        start : int = None
+        end : int = None
+
+        #greedy from the lowest register; extending the current range whenever possible gives the fewest reads
+        for first, last in spans:
+            if start is not None:
+                new_end = last if last > end else end
+                if new_end - start < self.max_batch_size and first - end - 1 <= self.max_batch_gap and not (sorted_holes and has_hole(end + 1, first - 1)):
+                    end = new_end
+                    continue
 
-                    #we are assuming calc registry ranges is being called EVERY READ.
-                    if init: #add but do not update timestamp; can maybe rename init to no timestamp at this point
-                        registers.append(register.register)
-                    elif register.next_read_timestamp < timestamp_ms:
-                        register.next_read_timestamp = timestamp_ms + register.read_interval
-                        registers.append(register.register)
+                ranges.append((start, end-start+1)) ## APPENDING A TUPLE!
 
-            if registers: #not empty
-                ranges.append((min(registers), max(registers)-min(registers)+1)) ## APPENDING A TUPLE!
+            start = first
+            end = last
+
+        if start is not None:
+            ranges.append((start, end-start+1))
 
         return ranges
 
@@ -844,19 +1102,122 @@ class protocol_settings:
 
         path = base_dir + "/" + file
         if os.path.exists(path):
+            self.track_protocol_file(path)
             return path
 
         suffix = file.split("_", 1)[0]
 
         path = base_dir + "/" + suffix +"/" + file
         if os.path.exists(path):
+            self.track_protocol_file(base_dir + "/" + file)
+            self.track_protocol_file(path)
             return path
 
         #find file by name, recurisvely. last resort
         search_pattern = os.path.join(base_dir, "**", file)
         matches = glob.glob(search_pattern, recursive=True)
+
+        #files found by the recursive search are tracked, new ones are not; only the usual locations
+        self.track_protocol_file(base_dir + "/" + file)
+        self.track_protocol_file(base_dir + "/" + suffix +"/" + file)
+        if matches:
+            self.track_protocol_file(matches[0])
+
         return matches[0] if matches else None
 
+    #region protocol cache
+    def track_protocol_file(self, path : str):
+        ''' record the signature of a file the protocol is loaded from; or None for a path that would be loaded if it existed '''
+        if not self.protocol_cache or path in self.protocol_files:
+            return
+
+        try:
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            self.protocol_files[path] = None
+            return
+
+        self.protocol_files[path] = (stat.st_mtime_ns, stat.st_size, digest)
+
+    def get_protocol_cache_file(self) -> str:
+        ''' one cache per protocol, protocol folder and transport read_interval; the parsed read intervals depend on it '''
+        read_interval = self.transport_settings.get("read_interval", "") if self.transport_settings is not None else ""
+        if not protocol_settings.code_digest:
+            with open(__file__, "rb") as f:
+                protocol_settings.code_digest = hashlib.sha256(f.read()).hexdigest()
+
+        key = repr((self.PROTOCOL_CACHE_VERSION, self.code_digest, sys.version_info[:2], os.path.abspath(self.settings_dir), read_interval))
+        name = re.sub(r"[^a-zA-Z0-9_.-]", "_", self.protocol)
+        return os.path.join(self.protocol_cache_path, name + "." + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16] + ".pickle")
+
+    def is_protocol_cache_valid(self, files : dict[str, tuple]) -> bool:
+        ''' files are compared by mtime and size first; only changed ones are hashed '''
+        for path, signature in files.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if signature is None:
+                    continue
+                return False
+
+            if signature is None: #new file
+                return False
+
+            if (stat.st_mtime_ns, stat.st_size) == signature[:2]:
+                continue
+
+            with open(path, "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() != signature[2]:
+                    return False
+
+        return True
+
+    def load_protocol_cache(self) -> dict:
+        ''' returns the cached codes, settings and registry maps; None if there is no valid cache '''
+        file = self.get_protocol_cache_file()
+        if not os.path.isfile(file):
+            return None
+
+        try:
+            with open(file, "rb") as f:
+                cache = pickle.load(f)  # noqa: S301 - written by save_protocol_cache
+
+            valid = cache.get("version") == self.PROTOCOL_CACHE_VERSION and self.is_protocol_cache_valid(cache["files"])
+        except Exception as e:
+            self._log.error("failed to load protocol cache " + file + ": " + str(e))
+            return None
+
+        if not valid:
+            self._log.info("protocol cache " + file + " is out of date")
+            return None
+
+        self._log.info("loaded protocol " + self.protocol + " from cache " + file)
+        self.protocol_files = cache["files"]
+        return cache
+
+    def save_protocol_cache(self):
+        file = self.get_protocol_cache_file()
+        cache = {
+            "version" : self.PROTOCOL_CACHE_VERSION,
+            "files" : self.protocol_files,
+            "codes" : self.codes,
+            "settings" : self.settings,
+            "registry_map" : self.registry_map,
+        }
+
+        try:
+            os.makedirs(self.protocol_cache_path, exist_ok=True)
+            with open(file + ".tmp", "wb") as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(file + ".tmp", file)
+        except OSError as e: #read only install, ie: docker; run without a cache
+            self._log.info("protocol cache not saved, " + file + ": " + str(e))
+        except Exception as e:
+            self._log.error("failed to save protocol cache " + file + ": " + str(e))
+    #endregion protocol cache
+
 
     def load_registry_map(self, registry_type : Registry_Type, file : str = "", settings_dir : str = ""):
         if not settings_dir:
@@ -874,8 +1235,10 @@ class protocol_settings:
         if not path:
             return
 
-        self.registry_map[registry_type] = self.load__registry(path, registry_type)
+        self.registry_map[registry_type] = self.load__registry(path, registry_type) #compiled once every map's codes are loaded
 
+    def compile_registry_map(self, registry_type : Registry_Type):
+        ''' size, ranges and decoders of a loaded registry map; decoders are keyed by id, so are never cached '''
         size : int = 0
 
         #get max register size
@@ -886,6 +1249,28 @@ class protocol_settings:
         self.registry_map_size[registry_type] = size
         self.registry_map_ranges[registry_type] = self.calculate_registry_ranges(self.registry_map[registry_type], self.registry_map_size[registry_type], init=True)
 
+        #lookup indexes; built after overrides, masks and high / low merging, so they match the final map
+        names : dict[str, registry_map_entry] = {}
+        documented_names : dict[str, registry_map_entry] = {}
+        registers : dict[int, list[registry_map_entry]] = {}
+        for entry in self.registry_map[registry_type]:
+            names.setdefault(entry.variable_name, entry)
+            documented_names.setdefault(entry.documented_name, entry)
+            registers.setdefault(entry.register, []).append(entry)
+
+        self.registry_map_names[registry_type] = names
+        self.registry_map_documented_names[registry_type] = documented_names
+        self.registry_map_registers[registry_type] = registers
+
+        #compile decoders once; process_registery runs every read
+        for entry in self.registry_map[registry_type]:
+            self.decoders[id(entry)] = self.compile_register_ushort(entry)
+
+        self.decoder_plans[id(self.registry_map[registry_type])] = self.compile_registry_plan(self.registry_map[registry_type])
+
+        if self.vectorized_decoding:
+            self.vectorized_plans[id(self.registry_map[registry_type])] = self.compile_vectorized_plan(self.registry_map[registry_type])
+
     def process_register_bytes(self, registry : dict[int,bytes], entry : registry_map_entry):
         ''' process bytes into data'''
 
@@ -925,30 +1310,25 @@ class protocol_settings:
             #handle custom sizes, less than 1 register
             end_bit = flag_size + start_bit
 
-            if entry.documented_name+"_codes" in self.codes:
-                code_key : str = entry.documented_name+"_codes"
+            flag_codes = self.get_codes(entry)
+            if flag_codes is not None:
                 flags : list[str] = []
-                flag_indexes : list[str] = []
+                set_bits : int = 0
                 for i in range(start_bit, end_bit):  # Iterate over each bit position (0 to 15)
                     byte = i // 8
                     bit = i % 8
                     val = register[byte]
                     # Check if the i-th bit is set
                     if (val >> bit) & 1:
+                        set_bits |= 1 << i
                         flag_index = "b"+str(i)
-                        flag_indexes.append(flag_index)
-                        if flag_index in self.codes[code_key]:
-                            flags.append(self.codes[code_key][flag_index])
+                        if flag_index in flag_codes:
+                            flags.append(flag_codes[flag_index])
 
-                #check multibit flags
-                multibit_flags = [key for key in self.codes if "&" in key]
-
-                if multibit_flags: #if multibit flags are found
-                    flag_indexes_set : set[str] = set(flag_indexes)
-                    for multibit_flag in multibit_flags:
-                        bits = multibit_flag.split("&")  # Split key into 'bits'
-                        if all(bit in flag_indexes_set for bit in bits): # Check if all bits are present in the flag_indexes_set
-                            flags.append(self.codes[code_key][multibit_flag])
+                #multibit flags; every bit of the mask is set
+                for mask, flag in self.multibit_flags.get(entry.documented_name, ()):
+                    if set_bits & mask == mask:
+                        flags.append(flag)
 
                 value = ",".join(flags)
             else:
@@ -1009,20 +1389,20 @@ class protocol_settings:
             try:
                 value = register.decode("utf-8") #convert bytes to ascii
             except UnicodeDecodeError as e:
-                self._log.error("UnicodeDecodeError:", e)
+                self._log.error("UnicodeDecodeError: " + str(e))
 
         #apply unit mod
         if entry.unit_mod != float(1):
             value = value * entry.unit_mod
 
         #apply codes
-        if (entry.data_type != Data_Type._16BIT_FLAGS and
-            entry.documented_name+"_codes" in self.codes):
+        value_codes = self.get_codes(entry) if entry.data_type != Data_Type._16BIT_FLAGS else None
+        if value_codes is not None:
             try:
                 cleanval = str(int(value))
 
-                if cleanval in self.codes[entry.documented_name+"_codes"]:
-                    value = self.codes[entry.documented_name+"_codes"][cleanval]
+                if cleanval in value_codes:
+                    value = value_codes[cleanval]
             except Exception:
                 #do nothing; try is for intval
                 value = value
@@ -1031,135 +1411,153 @@ class protocol_settings:
 
 
     def process_register_ushort(self, registry : dict[int, int], entry : registry_map_entry ):
-        ''' process ushort type registry into data'''
+        ''' process ushort type registry into data; runs the entry's compiled decoder, so there is one ushort decoder '''
+        decoder = self.decoders.get(id(entry))
+        if decoder is None: #entry not in a compiled registry map
+            decoder = self.compile_register_ushort(entry)
+        return decoder(registry)
+
+    def compile_register_ushort(self, entry : registry_map_entry) -> Callable[[dict[int, int]], object]:
+        ''' returns the ushort decoder for this entry; data type, byte order, unit_mod and codes are resolved once '''
 
         byte_order : str = self.byteorder
         if entry.data_byteorder:
             byte_order = entry.data_byteorder
 
-        if entry.data_type == Data_Type.UINT: #read uint
-            if entry.register + 1 not in registry:
-                return
+        register : int = entry.register
+        next_register : int = register + 1
+        data_type : Data_Type = entry.data_type
 
-            value = float((registry[entry.register] << 16) + registry[entry.register + 1])
-        elif entry.data_type == Data_Type.SHORT: #read signed short
-            val = registry[entry.register]
+        decode : Callable[[dict[int, int]], object]
+        unit_mod_applied : bool = False
 
-            # Convert the combined unsigned value to a signed integer if necessary
-            if val & (1 << 15):  # Check if the sign bit (bit 31) is set
-                # Perform two's complement conversion to get the signed integer
-                value = val - (1 << 16)
-            else:
-                value = val
-            value = -value
-        elif entry.data_type == Data_Type.INT: #read int
-            if entry.register + 1 not in registry:
-                return
+        if data_type == Data_Type.UINT:
+            def decode(registry : dict[int, int]):
+                if next_register not in registry:
+                    return None
+                return float((registry[register] << 16) + registry[next_register])
 
-            combined_value_unsigned = (registry[entry.register] << 16) + registry[entry.register + 1]
+        elif data_type == Data_Type.SHORT:
+            def decode(registry : dict[int, int]):
+                val = registry[register]
+                return -(val - 0x10000 if val & 0x8000 else val)
 
-            # Convert the combined unsigned value to a signed integer if necessary
-            if combined_value_unsigned & (1 << 31):  # Check if the sign bit (bit 31) is set
-                # Perform two's complement conversion to get the signed integer
-                value = combined_value_unsigned - (1 << 32)
-            else:
-                value = combined_value_unsigned
-            value = -value
-            #value = struct.unpack('<h', bytes([min(max(registry[item.register], 0), 255), min(max(registry[item.register+1], 0), 255)]))[0]
-            #value = int.from_bytes(bytes([registry[item.register], registry[item.register + 1]]), byteorder='little', signed=True)
-        elif entry.data_type == Data_Type._16BIT_FLAGS or entry.data_type == Data_Type._8BIT_FLAGS or entry.data_type == Data_Type._32BIT_FLAGS:
+        elif data_type == Data_Type.INT:
+            def decode(registry : dict[int, int]):
+                if next_register not in registry:
+                    return None
+                val = (registry[register] << 16) + registry[next_register]
+                return -(val - 0x100000000 if val & 0x80000000 else val)
 
-            #16 bit flags
-            start_bit : int = 0
-            end_bit : int = 16 #default 16 bit
-            flag_size : int = Data_Type.getSize(entry.data_type)
+        elif data_type == Data_Type._16BIT_FLAGS or data_type == Data_Type._8BIT_FLAGS or data_type == Data_Type._32BIT_FLAGS:
+            start_bit : int = entry.register_bit if entry.register_bit > 0 else 0
+            end_bit : int = Data_Type.getSize(data_type) + start_bit
 
-            if entry.register_bit > 0: #handle custom bit offset
-                start_bit = entry.register_bit
-
-            #handle custom sizes, less than 1 register
-            end_bit = flag_size + start_bit
+            if entry.concatenate: #compensate for the offset of this register in a multi register value
+                end_bit = end_bit - ((register - entry.concatenate_registers[0]) * 16)
 
-            offset : int = 0
-            #calculate current offset for mutliregiter values, were assuming concatenate registers is in order, 0 being the first / lowest
-            #offset should always be >= 0
-            if entry.concatenate:
-                offset : int = entry.register - entry.concatenate_registers[0]
+            bits : range = range(start_bit, 16 if end_bit >= 16 else end_bit) if end_bit > 0 else range(0)
 
-            #compensate for current offset
-            end_bit = end_bit - (offset * 16)
+            flag_codes = self.get_codes(entry)
+            if flag_codes is not None:
+                #(bit, code) for every bit that has a code
+                coded_bits : tuple[tuple[int, str], ...] = tuple((i, flag_codes["b"+str(i-start_bit)]) for i in bits if "b"+str(i-start_bit) in flag_codes)
 
-            val = registry[entry.register]
+                def decode(registry : dict[int, int]):
+                    val = registry[register]
+                    return ",".join([code for i, code in coded_bits if (val >> i) & 1])
+            else:
+                def decode(registry : dict[int, int]):
+                    val = registry[register]
+                    return "".join(["1" if (val >> i) & 1 else "0" for i in bits])
 
-            if entry.documented_name+"_codes" in self.codes:
-                flags : list[str] = []
-                offset : int = 0
+        elif data_type.value > 200 or data_type == Data_Type.BYTE: #bit types
+            bit_mask : int = (1 << Data_Type.getSize(data_type)) - 1
+            bit_index : int = entry.register_bit
 
-                if end_bit > 0:
-                    end : int = 16 if end_bit >= 16 else end_bit
-                    for i in range(start_bit, end):  # Iterate over each bit position (0 to 15)
-                        # Check if the i-th bit is set
-                        if (val >> i) & 1:
-                            flag_index = "b"+str(i+offset-start_bit)
-                            if flag_index in self.codes[entry.documented_name+"_codes"]:
-                                flags.append(self.codes[entry.documented_name+"_codes"][flag_index])
+            def decode(registry : dict[int, int]):
+                return (registry[register] >> bit_index) & bit_mask
 
+        elif data_type == Data_Type.HEX:
+            def decode(registry : dict[int, int]):
+                return registry[register].to_bytes(2, byteorder=byte_order).hex()
 
-                value = ",".join(flags)
+        elif data_type == Data_Type.ASCII:
+            def decode(registry : dict[int, int]):
+                value = registry[register].to_bytes(2, byteorder=byte_order)
+                try:
+                    return value.decode("utf-8")
+                except UnicodeDecodeError as e:
+                    self._log.error("UnicodeDecodeError: " + str(e))
+                    return value
+
+        else: #default, Data_Type.USHORT; most common, so unit_mod is folded in
+            unit_mod : float = entry.unit_mod
+            if unit_mod != float(1):
+                def decode(registry : dict[int, int]):
+                    return float(registry[register]) * unit_mod
             else:
-                flags : list[str] = []
-                if end_bit > 0:
-                    end : int = 16 if end_bit >= 16 else end_bit
-                    for i in range(start_bit, end):  # Iterate over each bit position (0 to 15)
-                        # Check if the i-th bit is set
-                        if (val >> i) & 1:
-                            flags.append("1")
-                        else:
-                            flags.append("0")
-
-                value = "".join(flags)
+                def decode(registry : dict[int, int]):
+                    return float(registry[register])
 
-        elif entry.data_type.value > 200 or entry.data_type == Data_Type.BYTE: #bit types
-                bit_size = Data_Type.getSize(entry.data_type)
-                bit_mask = (1 << bit_size) - 1  # Create a mask for extracting X bits
-                bit_index = entry.register_bit
-                value = (registry[entry.register] >> bit_index) & bit_mask
-        elif entry.data_type == Data_Type.HEX:
-                value = registry[entry.register].to_bytes((16 + 7) // 8, byteorder=byte_order) #convert to ushort to bytes
-                value = value.hex() #convert bytes to hex
-        elif entry.data_type == Data_Type.ASCII:
-            value = registry[entry.register].to_bytes((16 + 7) // 8, byteorder=byte_order) #convert to ushort to bytes
-            try:
-                value = value.decode("utf-8") #convert bytes to ascii
-            except UnicodeDecodeError as e:
-                self._log.error("UnicodeDecodeError:", e)
+            unit_mod_applied = True
 
-        else: #default, Data_Type.USHORT
-            value = float(registry[entry.register])
+        if entry.unit_mod != float(1) and not unit_mod_applied:
+            unit_mod : float = entry.unit_mod
+            scaled_decode = decode
 
-        if entry.unit_mod != float(1):
-            value = value * entry.unit_mod
+            def decode(registry : dict[int, int]):
+                value = scaled_decode(registry)
+                if value is None: #32 bit value, missing second register
+                    return None
+                return value * unit_mod
 
-        #move this to transport level
-        #if  isinstance(value, float) and self.max_precision > -1:
-        #   value = round(value, self.max_precision)
+        value_codes : dict[str, str] = self.get_codes(entry) if data_type != Data_Type._16BIT_FLAGS else None
+        if value_codes is not None:
+            coded_decode = decode
 
-        if (entry.data_type != Data_Type._16BIT_FLAGS and
-            entry.documented_name+"_codes" in self.codes):
-            try:
-                cleanval = str(int(value))
+            def decode(registry : dict[int, int]):
+                value = coded_decode(registry)
+                if value is None:
+                    return None
+                try:
+                    cleanval = str(int(value))
+                    if cleanval in value_codes:
+                        return value_codes[cleanval]
+                except (ValueError, TypeError):
+                    pass #try is for intval; keep the raw value
+                return value
+
+        return decode
+
+    def compile_registry_plan(self, map : list[registry_map_entry]) -> list[tuple]:
+        ''' decode plan for process_registery; (register, variable_name, decoder, concatenate_registers or None, is ascii) per entry '''
+        plan : list[tuple] = []
+        for entry in map:
+            decoder = self.decoders.get(id(entry))
+            if decoder is None:
+                decoder = self.compile_register_ushort(entry)
 
-                if cleanval in self.codes[entry.documented_name+"_codes"]:
-                    value = self.codes[entry.documented_name+"_codes"][cleanval]
-            except Exception:
-                #do nothing; try is for intval
-                value = value
+            concatenate_registers = tuple(entry.concatenate_registers) if entry.concatenate else None
+            plan.append((entry.register, entry.variable_name, decoder, concatenate_registers, entry.data_type == Data_Type.ASCII))
 
-        return value
+        return plan
 
-    def process_registery(self, registry : Union[dict[int, int], dict[int, bytes]] , map : list[registry_map_entry]) -> dict[str,str]:
+    def process_registery(self, registry : Union[dict[int, int], dict[int, bytes], registry_image] , map : list[registry_map_entry]) -> dict[str,str]:
         '''process registry into appropriate datatypes and names -- maybe add func for single entry later?'''
 
+        if not registry:
+            return {}
+
+        if isinstance(registry, registry_image) or not isinstance(next(iter(registry.values())), bytes): #ushort registry; use the compiled plan
+            if id(map) in self.vectorized_plans:
+                return self.process_registery_vectorized(registry, *self.vectorized_plans[id(map)])
+
+            plan = self.decoder_plans.get(id(map))
+            if plan is None:
+                plan = self.compile_registry_plan(map)
+            return self.process_registery_plan(registry, plan)
+
         concatenate_registry : dict = {}
         info = {}
         for entry in map:
@@ -1200,10 +1598,164 @@ class protocol_settings:
 
         return info
 
+    def process_registery_plan(self, registry : Union[dict[int, int], registry_image], plan : list[tuple]) -> dict[str,str]:
+        ''' process_registery for ushort registries, using a plan from compile_registry_plan '''
+
+        #skip entries that were not read
+        plan = [step for step in plan if step[0] in registry]
+
+        concatenate_registry : dict = {}
+        info = {}
+        for register, variable_name, decode, concatenate_registers, is_ascii in plan:
+            value = decode(registry)
+
+            if concatenate_registers is None:
+                info[variable_name] = value
+                continue
+
+            concatenate_registry[register] = value
+            for key in concatenate_registers:
+                if key not in concatenate_registry:
+                    break
+            else:
+                concatenated_value = "".join([str(concatenate_registry.pop(key)) for key in concatenate_registers])
+
+                #replace null characters with spaces and trim
+                if is_ascii:
+                    concatenated_value = concatenated_value.replace("\x00", " ").strip()
+
+                info[variable_name] = concatenated_value
+
+        return info
+
+    def compile_vectorized_plan(self, map : list[registry_map_entry]) -> tuple:
+        ''' splits map into numpy decoded groups and a scalar plan for the rest.
+        only USHORT / SHORT / UINT / INT entries without codes, concatenation or bit offset, with a unique variable name are vectorized '''
+
+        name_counts : dict[str, int] = {}
+        for entry in map:
+            name_counts[entry.variable_name] = name_counts.get(entry.variable_name, 0) + 1
+
+        vector_types = (Data_Type.USHORT, Data_Type.SHORT, Data_Type.UINT, Data_Type.INT)
+        grouped : dict[tuple[Data_Type, bool], list[registry_map_entry]] = {}
+        scalar : list[registry_map_entry] = []
+        for entry in map:
+            if (entry.data_type in vector_types
+                and not entry.concatenate
+                and entry.register_bit == 0
+                and name_counts[entry.variable_name] == 1
+                and self.get_codes(entry) is None):
+                grouped.setdefault((entry.data_type, entry.unit_mod != float(1)), []).append(entry)
+            else:
+                scalar.append(entry)
+
+        def gather(registers : list[int]) -> Callable[[dict[int, int]], tuple]:
+            ''' c speed dict gather; raises KeyError if a register is missing '''
+            if len(registers) == 1:
+                return lambda registry : (registry[registers[0]],)
+            return operator.itemgetter(*registers)
+
+        size : int = 0
+        #(data type, scaled, registers, unit_mods, variable names, gather, gather next register)
+        groups : list[tuple] = []
+        for (data_type, scaled), entries in grouped.items():
+            registers = [entry.register for entry in entries]
+            next_gather = None
+            if data_type == Data_Type.UINT or data_type == Data_Type.INT:
+                next_gather = gather([register + 1 for register in registers])
+
+            groups.append((data_type, scaled,
+                           numpy.array(registers, dtype=numpy.intp),
+                           numpy.array([entry.unit_mod for entry in entries], dtype=numpy.float64),
+                           [entry.variable_name for entry in entries],
+                           gather(registers), next_gather))
+            size = max(size, max(registers) + 2)
+
+        return (groups, size, self.compile_registry_plan(scalar))
+
+    @staticmethod
+    def decode_vectorized(data_type : Data_Type, scaled : bool, unit_mods : "numpy.ndarray", values : "numpy.ndarray", next_values : "numpy.ndarray" = None) -> "numpy.ndarray":
+        ''' numpy equivalent of compile_register_ushort for USHORT / SHORT / UINT / INT '''
+        values = values.astype(numpy.int64, copy=False)
+        if next_values is not None: #32 bit
+            values = (values << 16) + next_values.astype(numpy.int64, copy=False)
+
+        if data_type == Data_Type.SHORT:
+            values = -numpy.where(values & 0x8000, values - 0x10000, values)
+        elif data_type == Data_Type.INT:
+            values = -numpy.where(values & 0x80000000, values - 0x100000000, values)
+        else: #unsigned types are floats
+            values = values.astype(numpy.float64)
+
+        if scaled:
+            values = values * unit_mods
+
+        return values
+
+    def process_registery_vectorized(self, registry : Union[dict[int, int], registry_image], groups : list[tuple], size : int, plan : list[tuple]) -> dict[str,str]:
+        ''' process_registery with numpy; same values as the scalar path, key order may differ '''
+
+        info = {}
+        lookup : Callable[["numpy.ndarray"], tuple] = None #registers => (values, present)
+        if isinstance(registry, registry_image): #zero copy views of the read ranges
+            segments = [(start, numpy.frombuffer(buffer, dtype=numpy.uint16)) for start, buffer in registry.segments()]
+
+            def lookup(registers : "numpy.ndarray") -> tuple:
+                values = numpy.zeros(len(registers), dtype=numpy.uint16)
+                present = numpy.zeros(len(registers), dtype=bool)
+                for start, view in segments:
+                    offsets = registers - start
+                    inside = (offsets >= 0) & (offsets < len(view))
+                    values[inside] = view[offsets[inside]]
+                    present |= inside
+                return values, present
+        else:
+            try: #fast path, every register was read
+                for data_type, scaled, registers, unit_mods, names, gather, next_gather in groups:
+                    values = numpy.array(gather(registry), dtype=numpy.int64)
+                    next_values = numpy.array(next_gather(registry), dtype=numpy.int64) if next_gather else None
+                    info.update(zip(names, self.decode_vectorized(data_type, scaled, unit_mods, values, next_values).tolist()))
+
+            except KeyError: #partial registry; dense register image + presence mask
+                info = {}
+                keys = numpy.fromiter(registry.keys(), dtype=numpy.intp, count=len(registry))
+                values = numpy.fromiter(registry.values(), dtype=numpy.int64, count=len(registry))
+                in_range = (keys >= 0) & (keys < size)
+                image = numpy.zeros(size, dtype=numpy.int64)
+                present = numpy.zeros(size, dtype=bool)
+                image[keys[in_range]] = values[in_range]
+                present[keys[in_range]] = True
+
+                def lookup(registers : "numpy.ndarray") -> tuple:
+                    return image[registers], present[registers]
+
+        if lookup is not None:
+            for data_type, scaled, registers, unit_mods, names, gather, next_gather in groups:
+                values, found = lookup(registers)
+                if next_gather:
+                    next_values, next_found = lookup(registers + 1)
+                    result = self.decode_vectorized(data_type, scaled, unit_mods, values, next_values)
+                    complete = found & next_found
+                else:
+                    result = self.decode_vectorized(data_type, scaled, unit_mods, values)
+                    complete = found
+
+                if complete.all():
+                    info.update(zip(names, result.tolist()))
+                    continue
+
+                for name, value, is_found, is_complete in zip(names, result.tolist(), found.tolist(), complete.tolist()):
+                    if is_found:
+                        info[name] = value if is_complete else None #32 bit value, missing second register
+
+        info.update(self.process_registery_plan(registry, plan))
+        return info
+
     def validate_registry_entry(self, entry : registry_map_entry, val) -> int:
             #if code, validate first.
-            if entry.documented_name+"_codes" in self.codes:
-                if val in self.codes[entry.documented_name+"_codes"]:
+            codes = self.get_codes(entry)
+            if codes is not None:
+                if val in codes:
                     return 1
                 else:
                     return 0
@@ -0,0 +1,118 @@
+import heapq
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from .transports.transport_base import transport_base
+
+
+class read_scheduler:
+    ''' deadline based read scheduler; sleeps until the next transport read is due, or until a write is queued '''
+
+    transports : list["transport_base"]
+    ''' transports owned by this scheduler; index is used as heap key '''
+
+    on_read : Callable[["transport_base", dict[str, str]], None] = None
+    ''' callback, called with the results of every non-empty read '''
+
+    running : bool = False
+
+    _deadlines : list[tuple[float, int]]
+    ''' heap of (monotonic deadline, transport index) '''
+
+    _writes : deque
+    ''' pending (to_transport, data, from_transport) writes '''
+
+    _wake : threading.Event
+    ''' set to interrupt the wait for the next deadline '''
+
+    _log : logging.Logger = None
+
+    def __init__(self, on_read : Callable[["transport_base", dict[str, str]], None] = None):
+        self._log = logging.getLogger(__name__)
+        self.on_read = on_read
+        self.transports = []
+        self._deadlines = []
+        self._writes = deque()
+        self._wake = threading.Event()
+
+    def add(self, transport : "transport_base"):
+        ''' add transport; transports with a read_interval are read immediately, then every read_interval seconds '''
+        self.transports.append(transport)
+        if transport.read_interval > 0:
+            heapq.heappush(self._deadlines, (time.monotonic(), len(self.transports) - 1))
+
+    def queue_write(self, to_transport : "transport_base", data : dict[str, str], from_transport : "transport_base"):
+        ''' thread safe; write is performed by the scheduler loop, between reads '''
+        self._writes.append((to_transport, data, from_transport))
+        self._wake.set()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.process_writes()
+            timeout = self.run_due()
+
+            if self._writes: #write queued during reads
+                continue
+
+            if self._wake.wait(timeout):
+                self._wake.clear()
+
+    def process_writes(self):
+        while self._writes:
+            to_transport, data, from_transport = self._writes.popleft()
+            try:
+                to_transport.write_data(data, from_transport)
+            except Exception as err:
+                traceback.print_exc()
+                self._log.error(err)
+
+    def run_due(self) -> float:
+        ''' reads every transport that is due; returns seconds until the next deadline, None if nothing is scheduled '''
+        while self._deadlines:
+            deadline, index = self._deadlines[0]
+            now = time.monotonic()
+            if deadline > now:
+                return deadline - now
+
+            heapq.heappop(self._deadlines)
+            transport = self.transports[index]
+            self.read(transport)
+
+            #keep cadence from the deadline, not from when the read finished; skip missed slots instead of bursting
+            deadline = deadline + transport.read_interval
+            now = time.monotonic()
+            if deadline <= now:
+                deadline = now + transport.read_interval
+
+            heapq.heappush(self._deadlines, (deadline, index))
+
+            if self._writes: #let pending writes in between reads
+                return 0
+
+        return None
+
+    def read(self, transport : "transport_base"):
+        try:
+            transport.last_read_time = time.time()
+            #preform read
+            if not transport.connected:
+                transport.connect() #reconnect
+                return
+
+            info = transport.read_data()
+            if info and self.on_read:
+                self.on_read(transport, info)
+
+        except Exception as err:
+            traceback.print_exc()
+            self._log.error(err)
@@ -0,0 +1,109 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterator
+
+
+class registry_image:
+    '''
+    ushort register image; one array('H') per contiguous range that was read, so memory follows the registers read, not the highest address.
+    reads like a dict[int, int] registry ( in, [], get, keys, values, items, len ); ranges are copied in with a single slice,
+    and registers are read by offset into their range's array. indexing an unread register raises KeyError, like a dict.
+    '''
+
+    starts : list[int]
+    ''' first register of every range; sorted '''
+
+    buffers : list[array]
+    ''' registers of every range; buffers[i] starts at register starts[i] '''
+
+    def __init__(self):
+        self.starts = []
+        self.buffers = []
+
+    def set_range(self, start : int, registers : list[int]):
+        ''' copy a contiguous range of registers, ie: a pymodbus response, into the image. ranges that overlap or touch are merged '''
+        if not len(registers):
+            return
+
+        end = start + len(registers)
+        starts = self.starts
+        buffers = self.buffers
+
+        #ranges overlapping or touching start ~ end
+        first = bisect_left(starts, start)
+        if first > 0 and starts[first - 1] + len(buffers[first - 1]) >= start:
+            first = first - 1
+        last = bisect_right(starts, end)
+
+        if first == last: #new range
+            starts.insert(first, start)
+            buffers.insert(first, array("H", registers))
+            return
+
+        if last - first == 1 and starts[first] <= start: #within or appended to one range
+            buffer = buffers[first]
+            offset = start - starts[first]
+            if offset == len(buffer):
+                buffer.extend(registers)
+            else:
+                buffer[offset:offset + len(registers)] = array("H", registers)
+            return
+
+        merged_start = min(start, starts[first])
+        merged_end = max(end, starts[last - 1] + len(buffers[last - 1]))
+        merged = array("H", bytes(2 * (merged_end - merged_start)))
+        for index in range(first, last):
+            offset = starts[index] - merged_start
+            merged[offset:offset + len(buffers[index])] = buffers[index]
+        merged[start - merged_start:end - merged_start] = array("H", registers)
+
+        starts[first:last] = [merged_start]
+        buffers[first:last] = [merged]
+
+    def set(self, register : int, value : int):
+        self.set_range(register, [value])
+
+    def segments(self) -> Iterator[tuple[int, array]]:
+        ''' (start, buffer) for every range; buffers support the buffer protocol, ie: numpy.frombuffer '''
+        return zip(self.starts, self.buffers)
+
+    def __getitem__(self, register : int) -> int:
+        index = bisect_right(self.starts, register) - 1
+        if index >= 0:
+            offset = register - self.starts[index]
+            buffer = self.buffers[index]
+            if offset < len(buffer):
+                return buffer[offset]
+        raise KeyError(register)
+
+    def __contains__(self, register : int) -> bool:
+        index = bisect_right(self.starts, register) - 1
+        return index >= 0 and register - self.starts[index] < len(self.buffers[index])
+
+    def get(self, register : int, default : int = None) -> int:
+        try:
+            return self[register]
+        except KeyError:
+            return default
+
+    def keys(self) -> Iterator[int]:
+        return (register for start, buffer in self.segments() for register in range(start, start + len(buffer)))
+
+    def values(self) -> Iterator[int]:
+        return (value for buffer in self.buffers for value in buffer)
+
+    def items(self) -> Iterator[tuple[int, int]]:
+        return ((start + offset, value) for start, buffer in self.segments() for offset, value in enumerate(buffer))
+
+    def __iter__(self) -> Iterator[int]:
+        return self.keys()
+
+    def __len__(self) -> int:
+        ''' number of registers read '''
+        return sum(len(buffer) for buffer in self.buffers)
+
+    def __bool__(self) -> bool:
+        return bool(self.starts)
+
+    def __repr__(self) -> str:
+        return "registry_image(" + repr(dict(self.items())) + ")"
@@ -255,19 +255,18 @@ class canbus(transport_base):
 
         return info
 
+    async def async_read_data(self) -> dict[str, str]:
+        ''' reads from the cache filled by the bus thread; does not block '''
+        return self.read_data()
+
     def read_variable(self, variable_name : str, registry_type : Registry_Type, entry : registry_map_entry = None):
         ''' read's variable from cache'''
         ##clean for convinecne
         if variable_name:
             variable_name = variable_name.strip().lower().replace(" ", "_")
 
-        registry_map = self.protocolSettings.get_registry_map(registry_type)
-
         if entry is None:
-            for e in registry_map:
-                if e.variable_name == variable_name:
-                    entry = e
-                    break
+            entry = self.protocolSettings.get_registry_entry_by_variable(variable_name, registry_type)
 
         if entry:
             #no concat for canbus or concat on todo
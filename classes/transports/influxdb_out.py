@@ -1,19 +1,23 @@
-import logging
 import os
 import pickle
 import time
 from configparser import SectionProxy
 
-from influxdb import InfluxDBClient
+try:
+    from influxdb import InfluxDBClient
+except ImportError:
+    InfluxDBClient = None
 
 from defs.common import strtobool
 
+from ..influxdb_http_client import influxdb_http_client
 from ..protocol_settings import Registry_Type
+from ..write_ahead_log import write_ahead_log
 from .transport_base import transport_base
 
 
 class influxdb_out(transport_base):
-    ''' InfluxDB v1 output transport that writes data to an InfluxDB server '''
+    ''' InfluxDB v1 / v2 output transport that writes data to an InfluxDB server '''
     host: str = "localhost"
     port: int = 8086
     database: str = "solar"
@@ -25,6 +29,7 @@ class influxdb_out(transport_base):
     batch_size: int = 100
     batch_timeout: float = 10.0
     force_float: bool = True  # Force all numeric fields to be floats to avoid InfluxDB type conflicts
+    tag_variables: set = None  # Variables written as tags instead of fields
     
     # Connection monitoring settings
     reconnect_attempts: int = 5
@@ -40,11 +45,26 @@ class influxdb_out(transport_base):
     persistent_storage_path: str = "influxdb_backlog"
     max_backlog_size: int = 10000  # Maximum number of points to store
     max_backlog_age: int = 86400  # 24 hours in seconds
+    backlog_segment_size: int = 4 * 1024 * 1024  # Start a new backlog segment file after this many bytes
+    backlog_segment_age: float = 3600.0  # Start a new backlog segment file after this many seconds
+    backlog_fsync_interval: float = 5.0  # Seconds between fsyncs of the backlog; 0 = every point
+    backlog_replay_chunk_size: int = 1000  # Backlog points per write when replaying
+    backlog_replay_interval: float = 0.0  # Seconds between replayed chunks; 0 = replay everything at once
+    gzip: bool = False  # Compress writes to InfluxDB
+    
+    # Writer settings
+    writer: str = "client"  # client = influxdb package, http = built in line protocol writer
+    influxdb_version: int = 1  # 2 writes to /api/v2/write with org, bucket and token; always uses the http writer
+    org: str = ""
+    bucket: str = ""  # Defaults to database
+    token: str = ""
+    ssl: bool = False
     
     # Periodic reconnection settings
     periodic_reconnect_interval: float = 14400.0  # 4 hours in seconds
     
     client = None
+    schemas: dict = None  # Source transport name => variable name => (is tag, converter)
     batch_points = []
     last_batch_time = 0
     last_connection_check = 0
@@ -54,8 +74,9 @@ class influxdb_out(transport_base):
     last_periodic_reconnect_attempt = 0
     
     # Persistent storage
-    backlog_file = None
-    backlog_points = []
+    backlog_path = None
+    backlog: write_ahead_log = None
+    last_backlog_replay = 0
 
     def __init__(self, settings: SectionProxy):
         self.host = settings.get("host", fallback=self.host)
@@ -69,6 +90,8 @@ class influxdb_out(transport_base):
         self.batch_size = settings.getint("batch_size", fallback=self.batch_size)
         self.batch_timeout = settings.getfloat("batch_timeout", fallback=self.batch_timeout)
         self.force_float = strtobool(settings.get("force_float", fallback=self.force_float))
+        self.tag_variables = {name.strip() for name in settings.get("tag_variables", fallback="").split(",") if name.strip()}
+        self.schemas = {}
         
         # Connection monitoring settings
         self.reconnect_attempts = settings.getint("reconnect_attempts", fallback=self.reconnect_attempts)
@@ -84,6 +107,24 @@ class influxdb_out(transport_base):
         self.persistent_storage_path = settings.get("persistent_storage_path", fallback=self.persistent_storage_path)
         self.max_backlog_size = settings.getint("max_backlog_size", fallback=self.max_backlog_size)
         self.max_backlog_age = settings.getint("max_backlog_age", fallback=self.max_backlog_age)
+        self.backlog_segment_size = settings.getint("backlog_segment_size", fallback=self.backlog_segment_size)
+        self.backlog_segment_age = settings.getfloat("backlog_segment_age", fallback=self.backlog_segment_age)
+        self.backlog_fsync_interval = settings.getfloat("backlog_fsync_interval", fallback=self.backlog_fsync_interval)
+        self.backlog_replay_chunk_size = max(1, settings.getint("backlog_replay_chunk_size", fallback=self.backlog_replay_chunk_size))
+        self.backlog_replay_interval = settings.getfloat("backlog_replay_interval", fallback=self.backlog_replay_interval)
+        self.gzip = strtobool(settings.get("gzip", fallback=self.gzip))
+        
+        # Writer settings
+        self.writer = settings.get("writer", fallback=self.writer).strip().lower()
+        self.influxdb_version = settings.getint("influxdb_version", fallback=self.influxdb_version)
+        self.org = settings.get("org", fallback=self.org)
+        self.bucket = settings.get("bucket", fallback=self.database)
+        self.token = settings.get("token", fallback=self.token)
+        self.ssl = strtobool(settings.get("ssl", fallback=self.ssl))
+        if self.influxdb_version == 2:
+            self.writer = "http"
+        if self.writer not in ("client", "http"):
+            raise ValueError("Unknown influxdb writer: " + self.writer)
         
         # Periodic reconnection settings
         self.periodic_reconnect_interval = settings.getfloat("periodic_reconnect_interval", fallback=self.periodic_reconnect_interval)
@@ -98,62 +139,58 @@ class influxdb_out(transport_base):
     def _init_persistent_storage(self):
         """Initialize persistent storage for data backlog"""
         try:
-            # Create storage directory if it doesn't exist
-            if not os.path.exists(self.persistent_storage_path):
-                os.makedirs(self.persistent_storage_path)
-            
-            # Create backlog file path
-            self.backlog_file = os.path.join(
+            # Backlog folder holding the write ahead log segments
+            self.backlog_path = os.path.join(
                 self.persistent_storage_path, 
-                f"influxdb_backlog_{self.transport_name}.pkl"
+                f"influxdb_backlog_{self.transport_name}"
             )
             
             # Load existing backlog
             self._load_backlog()
             
-            self._log.info(f"Persistent storage initialized: {self.backlog_file}")
-            self._log.info(f"Loaded {len(self.backlog_points)} points from backlog")
+            self._log.info(f"Persistent storage initialized: {self.backlog_path}")
+            self._log.info(f"Loaded {len(self.backlog)} points from backlog")
             
         except Exception as e:
             self._log.error(f"Failed to initialize persistent storage: {e}")
             self.enable_persistent_storage = False
 
     def _load_backlog(self):
-        """Load backlog points from persistent storage"""
-        if not self.backlog_file or not os.path.exists(self.backlog_file):
-            self.backlog_points = []
+        """Open the backlog write ahead log, migrating a pickle backlog from older versions"""
+        self.backlog = write_ahead_log(
+            self.backlog_path,
+            segment_size=self.backlog_segment_size,
+            segment_age=self.backlog_segment_age,
+            fsync_interval=self.backlog_fsync_interval
+        )
+        
+        self._migrate_backlog(self.backlog_path + ".pkl")
+        
+        # Clean old points based on age; whole segments at a time, replay skips the rest
+        expired = self.backlog.expire(self.max_backlog_age)
+        if expired:
+            self._log.info(f"Cleaned {expired} old points from backlog")
+
+    def _migrate_backlog(self, pickle_file):
+        """Move points from a pickle backlog file into the write ahead log"""
+        if not os.path.exists(pickle_file):
             return
         
         try:
-            with open(self.backlog_file, 'rb') as f:
-                self.backlog_points = pickle.load(f)
+            with open(pickle_file, 'rb') as f:
+                points = pickle.load(f)  # noqa: S301 - file written by older versions of this transport
             
-            # Clean old points based on age
             current_time = time.time()
-            original_count = len(self.backlog_points)
-            self.backlog_points = [
-                point for point in self.backlog_points 
-                if current_time - point.get('_backlog_time', 0) < self.max_backlog_age
-            ]
+            for point in points:
+                if current_time - point.get('_backlog_time', 0) < self.max_backlog_age:
+                    self.backlog.append(point)
+            self.backlog.sync()
+            
+            os.remove(pickle_file)
+            self._log.info(f"Migrated {len(points)} points from {pickle_file}")
             
-            if len(self.backlog_points) < original_count:
-                self._log.info(f"Cleaned {original_count - len(self.backlog_points)} old points from backlog")
-                self._save_backlog()
-                
-        except Exception as e:
-            self._log.error(f"Failed to load backlog: {e}")
-            self.backlog_points = []
-
-    def _save_backlog(self):
-        """Save backlog points to persistent storage"""
-        if not self.backlog_file or not self.enable_persistent_storage:
-            return
-        
-        try:
-            with open(self.backlog_file, 'wb') as f:
-                pickle.dump(self.backlog_points, f)
         except Exception as e:
-            self._log.error(f"Failed to save backlog: {e}")
+            self._log.error(f"Failed to migrate backlog: {e}")
 
     def _add_to_backlog(self, point):
         """Add a point to the backlog"""
@@ -163,41 +200,91 @@ class influxdb_out(transport_base):
         # Add timestamp for age tracking
         point['_backlog_time'] = time.time()
         
-        self.backlog_points.append(point)
+        self.backlog.append(point)
         
-        # Limit backlog size
-        if len(self.backlog_points) > self.max_backlog_size:
-            removed = self.backlog_points.pop(0)  # Remove oldest point
-            self._log.warning(f"Backlog full, removed oldest point: {removed.get('measurement', 'unknown')}")
+        # Limit backlog size; drop a tenth at a time, so the cursor isnt rewritten for every point
+        if len(self.backlog) > self.max_backlog_size:
+            overflow = len(self.backlog) - self.max_backlog_size + self.max_backlog_size // 10
+            self.backlog.skip(overflow)
+            self._log.warning(f"Backlog full, removed {overflow} oldest points")
         
-        self._save_backlog()
-        self._log.debug(f"Added point to backlog. Backlog size: {len(self.backlog_points)}")
+        self._log.debug(f"Added point to backlog. Backlog size: {len(self.backlog)}")
 
     def _flush_backlog(self):
-        """Flush backlog points to InfluxDB"""
-        if not self.backlog_points or not self.connected:
+        """Replay backlog points to InfluxDB in chunks, advancing the backlog cursor after each chunk"""
+        if self.backlog is None or not len(self.backlog) or not self.connected:
             return
         
-        self._log.info(f"Flushing {len(self.backlog_points)} backlog points to InfluxDB")
+        # Rate limit; one chunk per interval, sent alongside live writes
+        current_time = time.time()
+        if current_time - self.last_backlog_replay < self.backlog_replay_interval:
+            return
         
-        try:
-            # Remove internal timestamp before sending to InfluxDB
-            points_to_send = []
-            for point in self.backlog_points:
-                point_copy = point.copy()
-                point_copy.pop('_backlog_time', None)  # Remove internal timestamp
-                points_to_send.append(point_copy)
-            
-            self.client.write_points(points_to_send)
-            self._log.info(f"Successfully wrote {len(points_to_send)} backlog points to InfluxDB")
-            
-            # Clear backlog after successful write
-            self.backlog_points = []
-            self._save_backlog()
+        self._log.info(f"Replaying {len(self.backlog)} backlog points to InfluxDB")
+        
+        replayed = 0
+        while len(self.backlog):
+            try:
+                points, read, position = self.backlog.read(self.backlog_replay_chunk_size)
+                if not read:
+                    break
+                
+                # Remove internal timestamp before sending to InfluxDB, skipping points past max_backlog_age
+                current_time = time.time()
+                points_to_send = []
+                for point in points:
+                    if current_time - point.pop('_backlog_time', 0) < self.max_backlog_age:
+                        points_to_send.append(point)
+                
+                if points_to_send:
+                    self.client.write_points(points_to_send)
+                
+                # Advance the backlog cursor after each successful chunk
+                self.backlog.ack(read, position)
+                replayed += len(points_to_send)
+                self._log.debug(f"Replayed {len(points_to_send)} backlog points, {len(self.backlog)} remaining")
+                
+            except Exception as e:
+                self._log.error(f"Failed to replay backlog to InfluxDB: {e}")
+                # Cursor is only advanced for written chunks - will resume from there later
+                break
             
-        except Exception as e:
-            self._log.error(f"Failed to flush backlog to InfluxDB: {e}")
-            # Don't clear backlog on failure - will retry later
+            self.last_backlog_replay = time.time()
+            if self.backlog_replay_interval > 0:
+                break
+        
+        self._log.info(f"Successfully wrote {replayed} backlog points to InfluxDB, {len(self.backlog)} remaining")
+
+    def _create_client(self):
+        """Create the InfluxDB client for the configured writer"""
+        if self.writer == "http":
+            return influxdb_http_client(
+                host=self.host,
+                port=self.port,
+                database=self.database,
+                username=self.username if self.username else None,
+                password=self.password if self.password else None,
+                timeout=self.connection_timeout,
+                gzip=self.gzip,
+                version=self.influxdb_version,
+                org=self.org,
+                bucket=self.bucket,
+                token=self.token,
+                ssl=self.ssl
+            )
+        
+        if InfluxDBClient is None:
+            raise ImportError("influxdb")
+        
+        return InfluxDBClient(
+            host=self.host,
+            port=self.port,
+            username=self.username if self.username else None,
+            password=self.password if self.password else None,
+            database=self.database,
+            timeout=self.connection_timeout,
+            gzip=self.gzip
+        )
 
     def connect(self):
         """Initialize the InfluxDB client connection"""
@@ -206,23 +293,17 @@ class influxdb_out(transport_base):
         try:
             
             # Create InfluxDB client with timeout settings
-            self.client = InfluxDBClient(
-                host=self.host,
-                port=self.port,
-                username=self.username if self.username else None,
-                password=self.password if self.password else None,
-                database=self.database,
-                timeout=self.connection_timeout
-            )
+            self.client = self._create_client()
             
             # Test connection
             self.client.ping()
             
-            # Create database if it doesn't exist
-            databases = self.client.get_list_database()
-            if not any(db['name'] == self.database for db in databases):
-                self._log.info(f"Creating database: {self.database}")
-                self.client.create_database(self.database)
+            # Create database if it doesn't exist; v2 buckets are created in InfluxDB
+            if self.influxdb_version == 1:
+                databases = self.client.get_list_database()
+                if not any(db['name'] == self.database for db in databases):
+                    self._log.info(f"Creating database: {self.database}")
+                    self.client.create_database(self.database)
             
             self.connected = True
             self.last_connection_check = time.time()
@@ -234,7 +315,7 @@ class influxdb_out(transport_base):
                 self._flush_backlog()
             
         except ImportError:
-            self._log.error("InfluxDB client not installed. Please install with: pip install influxdb")
+            self._log.error("InfluxDB client not installed. Please install with: pip install influxdb, or set writer = http")
             self.connected = False
         except Exception as e:
             self._log.error(f"Failed to connect to InfluxDB: {e}")
@@ -297,15 +378,7 @@ class influxdb_out(transport_base):
                         pass
                 
                 # Create new client
-                from influxdb import InfluxDBClient
-                self.client = InfluxDBClient(
-                    host=self.host,
-                    port=self.port,
-                    username=self.username if self.username else None,
-                    password=self.password if self.password else None,
-                    database=self.database,
-                    timeout=self.connection_timeout
-                )
+                self.client = self._create_client()
                 
                 # Test connection
                 self.client.ping()
@@ -383,73 +456,6 @@ class influxdb_out(transport_base):
 
     def _process_and_write_data(self, data: dict[str, str], from_transport: transport_base):
         """Process data and write to InfluxDB when connected"""
-        # Prepare tags for InfluxDB
-        tags = {}
-        
-        # Add device information as tags if enabled
-        if self.include_device_info:
-            tags.update({
-                "device_identifier": from_transport.device_identifier,
-                "device_name": from_transport.device_name,
-                "device_manufacturer": from_transport.device_manufacturer,
-                "device_model": from_transport.device_model,
-                "device_serial_number": from_transport.device_serial_number,
-                "transport": from_transport.transport_name
-            })
-            self._log.debug(f"Tags: {tags}")
-        
-        # Prepare fields (the actual data values)
-        fields = {}
-        for key, value in data.items():
-            # Check if we should force float formatting based on protocol settings
-            should_force_float = False
-            unit_mod_found = None
-            
-            # Try to get registry entry from protocol settings to check unit_mod
-            if hasattr(from_transport, 'protocolSettings') and from_transport.protocolSettings:
-                # Check both input and holding registries
-                for registry_type in [Registry_Type.INPUT, Registry_Type.HOLDING]:
-                    registry_map = from_transport.protocolSettings.get_registry_map(registry_type)
-                    for entry in registry_map:
-                        # Match by variable_name (which is lowercase)
-                        if entry.variable_name.lower() == key.lower():
-                            unit_mod_found = entry.unit_mod
-                            # If unit_mod is not 1.0, this value should be treated as float
-                            if entry.unit_mod != 1.0:
-                                should_force_float = True
-                                self._log.debug(f"Variable {key} has unit_mod {entry.unit_mod}, forcing float format")
-                            break
-                    if should_force_float:
-                        break
-            
-            # Try to convert to numeric values for InfluxDB
-            try:
-                # Try to convert to float first
-                float_val = float(value)
-                
-                # Always use float for InfluxDB to avoid type conflicts
-                # InfluxDB is strict about field types - once a field is created as integer,
-                # it must always be integer. Using float avoids this issue.
-                if self.force_float:
-                    fields[key] = float_val
-                else:
-                    # Only use integer if it's actually an integer and we're not forcing floats
-                    if float_val.is_integer():
-                        fields[key] = int(float_val)
-                    else:
-                        fields[key] = float_val
-                
-                # Log data type conversion for debugging
-                if self._log.isEnabledFor(logging.DEBUG):
-                    original_type = type(value).__name__
-                    final_type = type(fields[key]).__name__
-                    self._log.debug(f"Field {key}: {value} ({original_type}) -> {fields[key]} ({final_type}) [unit_mod: {unit_mod_found}]")
-                
-            except (ValueError, TypeError):
-                # If conversion fails, store as string
-                fields[key] = str(value)
-                self._log.debug(f"Field {key}: {value} -> string (conversion failed)")
-        
         # Create InfluxDB point
         point = self._create_influxdb_point(data, from_transport)
         
@@ -464,6 +470,47 @@ class influxdb_out(transport_base):
             self._log.debug(f"Flushing batch: size={len(self.batch_points)}, timeout={current_time - self.last_batch_time:.1f}s")
             self._flush_batch()
 
+    @staticmethod
+    def _to_float(value):
+        """Field value as float; strings that aren't numbers are kept as strings"""
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            return str(value)
+
+    @staticmethod
+    def _to_number(value):
+        """Field value as int if it is a whole number, otherwise float; strings that aren't numbers are kept as strings"""
+        try:
+            float_val = float(value)
+        except (ValueError, TypeError):
+            return str(value)
+        return int(float_val) if float_val.is_integer() else float_val
+
+    def _get_field_schema(self, name: str, unit_mod: float = 1.0):
+        """(is tag, converter) for a variable"""
+        if name in self.tag_variables:
+            return (True, str)
+
+        # Always use float for InfluxDB to avoid type conflicts
+        # InfluxDB is strict about field types - once a field is created as integer,
+        # it must always be integer. Scaled values are always floats for the same reason.
+        if self.force_float or unit_mod != 1.0:
+            return (False, self._to_float)
+
+        return (False, self._to_number)
+
+    def _build_schema(self, from_transport: transport_base) -> dict:
+        """Map variable names of the source transport's protocol to (is tag, converter)"""
+        schema = {}
+        if getattr(from_transport, 'protocolSettings', None):
+            # Check both input and holding registries
+            for registry_type in [Registry_Type.INPUT, Registry_Type.HOLDING]:
+                for entry in from_transport.protocolSettings.get_registry_map(registry_type):
+                    if entry.variable_name not in schema:
+                        schema[entry.variable_name] = self._get_field_schema(entry.variable_name, entry.unit_mod)
+        return schema
+
     def _create_influxdb_point(self, data: dict[str, str], from_transport: transport_base):
         """Create an InfluxDB point from data"""
         # Prepare tags for InfluxDB
@@ -480,47 +527,23 @@ class influxdb_out(transport_base):
                 "transport": from_transport.transport_name
             })
         
+        schema = self.schemas.get(from_transport.transport_name)
+        if schema is None:
+            schema = self.schemas[from_transport.transport_name] = self._build_schema(from_transport)
+
         # Prepare fields (the actual data values)
         fields = {}
         for key, value in data.items():
-            # Check if we should force float formatting based on protocol settings
-            should_force_float = False
-            unit_mod_found = None
-            
-            # Try to get registry entry from protocol settings to check unit_mod
-            if hasattr(from_transport, 'protocolSettings') and from_transport.protocolSettings:
-                # Check both input and holding registries
-                for registry_type in [Registry_Type.INPUT, Registry_Type.HOLDING]:
-                    registry_map = from_transport.protocolSettings.get_registry_map(registry_type)
-                    for entry in registry_map:
-                        # Match by variable_name (which is lowercase)
-                        if entry.variable_name.lower() == key.lower():
-                            unit_mod_found = entry.unit_mod
-                            # If unit_mod is not 1.0, this value should be treated as float
-                            if entry.unit_mod != 1.0:
-                                should_force_float = True
-                            break
-                    if should_force_float:
-                        break
+            field_schema = schema.get(key)
+            if field_schema is None:
+                # Not in the protocol; cache it anyway
+                field_schema = schema[key] = self._get_field_schema(key)
             
-            # Try to convert to numeric values for InfluxDB
-            try:
-                # Try to convert to float first
-                float_val = float(value)
-                
-                # Always use float for InfluxDB to avoid type conflicts
-                if self.force_float:
-                    fields[key] = float_val
-                else:
-                    # Only use integer if it's actually an integer and we're not forcing floats
-                    if float_val.is_integer():
-                        fields[key] = int(float_val)
-                    else:
-                        fields[key] = float_val
-                
-            except (ValueError, TypeError):
-                # If conversion fails, store as string
-                fields[key] = str(value)
+            is_tag, convert = field_schema
+            if is_tag:
+                tags[key] = convert(value)
+            else:
+                fields[key] = convert(value)
         
         # Create InfluxDB point
         point = {
@@ -554,6 +577,10 @@ class influxdb_out(transport_base):
             self._log.info(f"Wrote {len(self.batch_points)} points to InfluxDB")
             self.batch_points = []
             self.last_batch_time = time.time()
+            
+            # Continue a rate limited backlog replay
+            if self.enable_persistent_storage:
+                self._flush_backlog()
         except Exception as e:
             self._log.error(f"Failed to write batch to InfluxDB: {e}")
             # Don't immediately mark as disconnected, try to reconnect first
@@ -579,8 +606,8 @@ class influxdb_out(transport_base):
                 self.connected = False
 
     def init_bridge(self, from_transport: transport_base):
-        """Initialize bridge - not needed for InfluxDB output"""
-        pass
+        """Build the field schema for the source transport"""
+        self.schemas[from_transport.transport_name] = self._build_schema(from_transport)
 
     def __del__(self):
         """Cleanup on destruction - flush any remaining points"""
@@ -590,4 +617,6 @@ class influxdb_out(transport_base):
             try:
                 self.client.close()
             except Exception:
-                pass 
\ No newline at end of file
+                pass
+        if self.backlog is not None:
+            self.backlog.close() 
\ No newline at end of file
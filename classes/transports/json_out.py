@@ -1,8 +1,20 @@
+import atexit
+import gzip
 import json
+import os
+import queue
+import shutil
 import sys
+import threading
+import time
 from configparser import SectionProxy
 from typing import TextIO
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from defs.common import strtobool
 
 from ..protocol_settings import Registry_Type, WriteMode, registry_map_entry
@@ -17,7 +29,19 @@ class json_out(transport_base):
     include_timestamp: bool = True
     include_device_info: bool = True
     
+    # NDJSON file mode
+    ndjson: bool = False  # One compact record per line, written by a background thread
+    buffer_size: int = 65536  # Bytes buffered before writing
+    flush_interval: float = 10.0  # Max seconds a record stays buffered
+    rotate_size: int = 0  # Rotate the file after this many bytes; 0 = never
+    rotate_interval: float = 0  # Rotate the file after this many seconds; 0 = never
+    compression: str = ""  # Compress rotated files; gzip or zstd
+
     file_handle: TextIO = None
+    write_queue: queue.SimpleQueue = None
+    writer_thread: threading.Thread = None
+    file_size: int = 0
+    file_time: float = 0
 
     def __init__(self, settings: SectionProxy):
         self.output_file = settings.get("output_file", fallback=self.output_file)
@@ -26,6 +50,18 @@ class json_out(transport_base):
         self.include_timestamp = strtobool(settings.get("include_timestamp", fallback=self.include_timestamp))
         self.include_device_info = strtobool(settings.get("include_device_info", fallback=self.include_device_info))
         
+        # NDJSON file mode
+        self.ndjson = strtobool(settings.get("ndjson", fallback=self.ndjson))
+        self.buffer_size = settings.getint("buffer_size", fallback=self.buffer_size)
+        self.flush_interval = max(0.1, settings.getfloat("flush_interval", fallback=self.flush_interval))  # 0 would busy-spin the writer
+        self.rotate_size = settings.getint("rotate_size", fallback=self.rotate_size)
+        self.rotate_interval = settings.getfloat("rotate_interval", fallback=self.rotate_interval)
+        self.compression = settings.get("compression", fallback=self.compression).strip().lower()
+        if self.compression not in ("", "none", "gzip", "zstd"):
+            raise ValueError("Unknown json_out compression: " + self.compression)
+        if self.compression == "zstd" and zstandard is None:
+            raise ValueError("compression = zstd requires zstandard; pip install zstandard")
+
         self.write_enabled = True  # JSON output is always write-enabled
         super().__init__(settings)
 
@@ -35,6 +71,18 @@ class json_out(transport_base):
         
         if self.output_file.lower() == "stdout":
             self.file_handle = sys.stdout
+        elif self.ndjson:
+            try:
+                self.open_file("ab" if self.append_mode else "wb")
+            except Exception as e:
+                self._log.error(f"Failed to open output file {self.output_file}: {e}")
+                self.connected = False
+                return
+
+            self.write_queue = queue.SimpleQueue()
+            self.writer_thread = threading.Thread(target=self.writer_loop, name="json_out-writer[" + self.transport_name + "]", daemon=True)
+            self.writer_thread.start()
+            atexit.register(self.close)
         else:
             try:
                 mode = "a" if self.append_mode else "w"
@@ -52,8 +100,8 @@ class json_out(transport_base):
         if not self.write_enabled or not self.connected:
             return
 
-        self._log.info(f"write data from [{from_transport.transport_name}] to json_out transport")
-        self._log.info(data)
+        self._log.debug(f"write data from [{from_transport.transport_name}] to json_out transport")
+        self._log.debug(data)
 
         # Prepare the JSON output structure
         output_data = {}
@@ -71,17 +119,23 @@ class json_out(transport_base):
         
         # Add timestamp if enabled
         if self.include_timestamp:
-            import time
             output_data["timestamp"] = time.time()
         
         # Add the actual data
-        output_data["data"] = data
+        output_data["data"] = dict(data)  # Bridged data is a read only mapping; json needs a dict
         
+        # NDJSON files are serialized and written by the writer thread
+        if self.write_queue is not None:
+            self.write_queue.put(output_data)
+            return
+
         # Convert to JSON
-        if self.pretty_print:
-            json_string = json.dumps(output_data, indent=2, ensure_ascii=False)
+        if self.ndjson:
+            json_string = json.dumps(output_data, ensure_ascii=False, separators=(",", ":"), default=str)
+        elif self.pretty_print:
+            json_string = json.dumps(output_data, indent=2, ensure_ascii=False, default=str)
         else:
-            json_string = json.dumps(output_data, ensure_ascii=False)
+            json_string = json.dumps(output_data, ensure_ascii=False, default=str)
         
         # Write to file
         try:
@@ -96,13 +150,105 @@ class json_out(transport_base):
             self._log.error(f"Failed to write to output: {e}")
             self.connected = False
 
+    def open_file(self, mode: str = "ab"):
+        """Open the NDJSON output file"""
+        self.file_handle = open(self.output_file, mode)
+        self.file_size = self.file_handle.tell()
+        self.file_time = time.time()
+
+    def writer_loop(self):
+        """Background writer for NDJSON files; buffers records and writes them in one go"""
+        buffer = []
+        buffered = 0
+        last_flush = time.monotonic()
+        stop = False
+        while not stop:
+            try:
+                record = self.write_queue.get(timeout=max(0, self.flush_interval - (time.monotonic() - last_flush)))
+            except queue.Empty:
+                record = None
+            else:
+                if record is None:  # close()
+                    stop = True
+                else:
+                    try:
+                        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8") + b"\n"
+                        buffer.append(line)
+                        buffered += len(line)
+                    except Exception as e:  # drop the record; keep the writer alive
+                        self._log.error(f"Failed to serialize record: {e}")
+
+            if stop or buffered >= self.buffer_size or time.monotonic() - last_flush >= self.flush_interval:
+                try:
+                    if buffer:
+                        self.file_handle.write(b"".join(buffer))
+                        self.file_handle.flush()
+                        self.file_size += buffered
+
+                    if self.rotate_due():
+                        self.rotate()
+                except Exception as e:
+                    self._log.error(f"Failed to write to output: {e}")
+
+                buffer = []
+                buffered = 0
+                last_flush = time.monotonic()
+
+        self.file_handle.close()
+
+    def rotate_due(self) -> bool:
+        if self.rotate_size > 0 and self.file_size >= self.rotate_size:
+            return True
+        return self.rotate_interval > 0 and self.file_size > 0 and time.time() - self.file_time >= self.rotate_interval
+
+    def rotate(self):
+        """Move the output file aside, compress it, and start a new one"""
+        self.file_handle.close()
+
+        name, ext = os.path.splitext(self.output_file)
+        rotated = name + "." + time.strftime("%Y%m%d-%H%M%S") + ext
+        count = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz") or os.path.exists(rotated + ".zst"):
+            rotated = name + "." + time.strftime("%Y%m%d-%H%M%S") + "-" + str(count) + ext
+            count += 1
+
+        try:
+            os.replace(self.output_file, rotated)
+        finally:
+            self.open_file("ab")  # keep writing, even if the file could not be moved aside
+        self._log.info(f"Rotated {self.output_file} to {rotated}")
+
+        if self.compression in ("gzip", "zstd"):
+            self.compress(rotated)
+
+    def compress(self, file: str):
+        """Compress a rotated file, then remove the original"""
+        try:
+            if self.compression == "gzip":
+                with open(file, "rb") as source, gzip.open(file + ".gz", "wb") as destination:
+                    shutil.copyfileobj(source, destination)
+            else:
+                with open(file, "rb") as source, open(file + ".zst", "wb") as destination:
+                    zstandard.ZstdCompressor().copy_stream(source, destination)
+            os.remove(file)
+        except Exception as e:
+            self._log.error(f"Failed to compress {file}: {e}")
+
+    def close(self):
+        """Write buffered NDJSON records and close the file"""
+        if self.writer_thread is not None and self.writer_thread.is_alive():
+            self.write_queue.put(None)
+            self.writer_thread.join(timeout=10)
+
     def init_bridge(self, from_transport: transport_base):
         """Initialize bridge - not needed for JSON output"""
         pass
 
     def __del__(self):
         """Cleanup file handle on destruction"""
-        if self.file_handle and self.output_file.lower() != "stdout":
+        if self.writer_thread is not None:
+            self.close()
+        elif self.file_handle and self.output_file.lower() != "stdout":
             try:
                 self.file_handle.close()
             except:
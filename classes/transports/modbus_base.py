@@ -1,9 +1,10 @@
+import asyncio
 import glob
 import json
 import os
 import re
 import time
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Generator
 
 from pymodbus.exceptions import ModbusIOException
 
@@ -16,6 +17,7 @@ from ..protocol_settings import (
     protocol_settings,
     registry_map_entry,
 )
+from ..registry_image import registry_image
 from .transport_base import TransportWriteMode, transport_base
 
 if TYPE_CHECKING:
@@ -33,6 +35,15 @@ class modbus_base(transport_base):
     clients : dict[str, "BaseModbusClient"] = {}
     ''' str is identifier, dict of clients when multiple transports use the same ports '''
 
+    async_clients : dict[int, object] = {}
+    ''' asyncio run mode; async clients keyed by id of the blocking client, so transports on the same port share them '''
+
+    bus_locks : dict[int, asyncio.Lock] = {}
+    ''' asyncio run mode; one lock per port, keyed by id of the blocking client '''
+
+    async_client = None
+    ''' asyncio run mode; None if the transport has no async client, blocking client is then run in a worker thread '''
+
     #non-static here for reference, type hinting, python bs ect...
     modbus_delay_increament : float = 0.05
     ''' delay adjustment every error. todo: add a setting for this '''
@@ -50,6 +61,26 @@ class modbus_base(transport_base):
     send_holding_register : bool = True
     send_input_register : bool = True
 
+    ILLEGAL_ADDRESS : int = 0x02
+    ''' modbus exception code; the device does not have the requested register '''
+
+    learn_holes : bool = True
+    ''' remember registers the device rejects, and plan reads around them '''
+
+    holes_path : str = "modbus_holes"
+    ''' folder to persist learned holes in; one json file per protocol and device '''
+
+    holes : dict[Registry_Type, set[int]] = None
+    ''' registers the device rejected with illegal address '''
+
+    holes_file : str = ""
+    ''' file the current holes belong to; holes are reloaded when the protocol or device identifier changes '''
+
+    holes_changed : bool = False
+
+    next_read_timestamps : dict[int, int] = None
+    ''' unix timestamp in ms of the next read per registry_map_entry, keyed by id(entry); per transport, protocol settings are shared '''
+
     def __init__(self, settings : "SectionProxy", protocolSettings : "protocol_settings" = None):
         super().__init__(settings)
 
@@ -72,6 +103,10 @@ class modbus_base(transport_base):
         self.modbus_delay = settings.getfloat(["batch_delay", "modbus_delay"], fallback=self.modbus_delay)
         self.modbus_delay_setting = self.modbus_delay
 
+        self.learn_holes = settings.getboolean("learn_holes", fallback=self.learn_holes)
+        self.holes_path = settings.get("holes_path", fallback=self.holes_path)
+        self.next_read_timestamps = {}
+
         # Note: Connection and analyze_protocol will be called after subclass initialization is complete
 
     def init_after_connect(self):
@@ -168,39 +203,92 @@ class modbus_base(transport_base):
         if not self.write_enabled:
             return
 
-        registry_map = self.protocolSettings.get_registry_map(Registry_Type.HOLDING)
-
         for key, value in data.items():
-            for entry in registry_map:
-                if entry.variable_name == key:
-                    self.write_variable(entry, value, Registry_Type.HOLDING)
-                    break
+            entry = self.protocolSettings.get_registry_entry_by_variable(key, Registry_Type.HOLDING)
+            if entry is not None:
+                self.write_variable(entry, value, Registry_Type.HOLDING)
 
         time.sleep(self.modbus_delay) #sleep inbetween requests so modbus can rest
 
-    def read_data(self) -> dict[str, str]:
-        info = {}
-        #modbus - only read input/holding registries
-        for registry_type in (Registry_Type.INPUT, Registry_Type.HOLDING):
+    def get_read_registry_types(self) -> list[Registry_Type]:
+        ''' modbus - only read input/holding registries '''
+        registry_types : list[Registry_Type] = []
 
-            #enable / disable input/holding register
-            if registry_type == Registry_Type.INPUT and not self.send_input_register:
-                continue
+        #enable / disable input/holding register
+        if self.send_input_register:
+            registry_types.append(Registry_Type.INPUT)
 
-            if registry_type == Registry_Type.HOLDING and not self.send_holding_register:
-                continue
+        if self.send_holding_register:
+            registry_types.append(Registry_Type.HOLDING)
+
+        return registry_types
+
+    #region - holes
+    def get_holes(self, registry_type : Registry_Type) -> set[int]:
+        ''' registers of registry_type the device is known to reject '''
+        if not self.learn_holes:
+            return set()
+
+        file = self.get_holes_file()
+        if file != self.holes_file:
+            self.load_holes(file)
+
+        if registry_type not in self.holes:
+            self.holes[registry_type] = set()
 
+        return self.holes[registry_type]
+
+    def get_holes_file(self) -> str:
+        name = self.protocol_version + "_" + (self.device_identifier or "unknown")
+        name = re.sub(r"[^a-zA-Z0-9_.-]", "_", name)
+        return os.path.join(self.holes_path, name + ".json")
+
+    def load_holes(self, file : str):
+        self.holes = {}
+        self.holes_file = file
+        self.holes_changed = False
+
+        if not os.path.exists(file):
+            return
+
+        try:
+            with open(file, "r") as f:
+                data : dict[str, list[int]] = json.load(f)
+
+            for name, registers in data.items():
+                self.holes[Registry_Type[name.upper()]] = set(registers)
+
+            self._log.info("loaded holes from " + file + ": " + str({k.name : len(v) for k, v in self.holes.items()}))
+        except Exception as e:
+            self._log.error("failed to load holes from " + file + ": " + str(e))
+
+    def save_holes(self):
+        if not self.holes_changed:
+            return
+
+        self.holes_changed = False
+        try:
+            os.makedirs(os.path.dirname(self.holes_file) or ".", exist_ok=True)
+            data = {registry_type.name.lower() : sorted(registers) for registry_type, registers in self.holes.items()}
+            with open(self.holes_file, "w") as f:
+                json.dump(data, f)
+        except Exception as e:
+            self._log.error("failed to save holes to " + self.holes_file + ": " + str(e))
+    #endregion
+
+    def read_data(self) -> dict[str, str]:
+        info = {}
+        for registry_type in self.get_read_registry_types():
             #calculate ranges dynamically -- for variable read timing
             ranges = self.protocolSettings.calculate_registry_ranges(self.protocolSettings.registry_map[registry_type],
                                                                      self.protocolSettings.registry_map_size[registry_type],
-                                                                     timestamp=self.last_read_time)
+                                                                     timestamp=self.last_read_time,
+                                                                     holes=self.get_holes(registry_type),
+                                                                     schedule=self.next_read_timestamps)
 
             registry = self.read_modbus_registers(ranges=ranges, registry_type=registry_type)
             new_info = self.protocolSettings.process_registery(registry, self.protocolSettings.get_registry_map(registry_type))
 
-            if False:
-                new_info = {self.__input_register_prefix + key: value for key, value in new_info.items()}
-
             info.update(new_info)
 
         if not info:
@@ -208,6 +296,109 @@ class modbus_base(transport_base):
 
         return info
 
+    #region - asyncio
+    def create_async_client(self):
+        ''' override to return a pymodbus async client; None runs the blocking client in a worker thread '''
+        return None
+
+    def get_bus_lock(self) -> asyncio.Lock:
+        key = id(self.client)
+        if key not in modbus_base.bus_locks:
+            modbus_base.bus_locks[key] = asyncio.Lock()
+        return modbus_base.bus_locks[key]
+
+    async def async_connect(self):
+        async with self.get_bus_lock():
+            key = id(self.client)
+            self.async_client = modbus_base.async_clients.get(key)
+
+            if self.first_connect:
+                #first connect runs the blocking init; serial number, write validation
+                if self.async_client is not None and self.async_client.connected:
+                    self.async_client.close() #one handle on the port at a time, ie: serial
+                await asyncio.to_thread(self.connect)
+                if not self.connected:
+                    return
+
+                if key not in modbus_base.async_clients:
+                    modbus_base.async_clients[key] = self.create_async_client()
+
+                self.async_client = modbus_base.async_clients[key]
+                if self.async_client is not None:
+                    self.client.close()
+            elif self.async_client is None: #no async client; reconnect the blocking client
+                await asyncio.to_thread(self.connect)
+                return
+
+            #reconnect only the async client; the blocking client stays closed
+            if self.async_client is not None and not self.async_client.connected:
+                self.connected = await self.async_client.connect()
+
+    async def async_read_data(self) -> dict[str, str]:
+        info = {}
+        async with self.get_bus_lock():
+            for registry_type in self.get_read_registry_types():
+                ranges = self.protocolSettings.calculate_registry_ranges(self.protocolSettings.registry_map[registry_type],
+                                                                         self.protocolSettings.registry_map_size[registry_type],
+                                                                         timestamp=self.last_read_time,
+                                                                         holes=self.get_holes(registry_type),
+                                                                         schedule=self.next_read_timestamps)
+
+                registry = await self.async_read_modbus_registers(ranges=ranges, registry_type=registry_type)
+                new_info = self.protocolSettings.process_registery(registry, self.protocolSettings.get_registry_map(registry_type))
+
+                info.update(new_info)
+
+        if not info:
+            self._log.info("Register is Empty; transport busy?")
+
+        return info
+
+    async def async_write_data(self, data : dict[str, str], from_transport : transport_base) -> None:
+        if not self.write_enabled:
+            return
+
+        async with self.get_bus_lock():
+            for key, value in data.items():
+                entry = self.protocolSettings.get_registry_entry_by_variable(key, Registry_Type.HOLDING)
+                if entry is not None:
+                    await self.async_write_variable(entry, value, Registry_Type.HOLDING)
+
+            await asyncio.sleep(self.modbus_delay) #sleep inbetween requests so modbus can rest
+
+    async def async_write_variable(self, entry : registry_map_entry, value : str, registry_type : Registry_Type = Registry_Type.HOLDING):
+        ranges = self.protocolSettings.calculate_registry_ranges([entry], self.protocolSettings.registry_map_size[registry_type], init=True) #init=True to bypass timechecks
+        registry = await self.async_read_modbus_registers(ranges=ranges, registry_type=registry_type)
+
+        ushortValue = self.encode_variable(entry, value, registry)
+        if ushortValue is not None:
+            await self.async_write_register(entry.register, ushortValue)
+
+    async def async_read_registers(self, start, count=1, registry_type : Registry_Type = Registry_Type.INPUT, **kwargs):
+        return await asyncio.to_thread(self.read_registers, start, count, registry_type=registry_type, **kwargs)
+
+    async def async_write_register(self, register : int, value : int, **kwargs):
+        return await asyncio.to_thread(self.write_register, register, value, **kwargs)
+
+    async def async_read_modbus_registers(self, ranges : list[tuple] = None, start : int = 0, end : int = None, batch_size : int = None, registry_type : Registry_Type = Registry_Type.INPUT ) -> registry_image:
+        reader = self._read_modbus_registers_steps(ranges, start, end, batch_size, registry_type)
+        try:
+            request = next(reader)
+            while True:
+                await asyncio.sleep(self.modbus_delay) #give bus a rest
+                try:
+                    response = await self.async_read_registers(request[0], request[1], registry_type=registry_type)
+                except ModbusIOException as e:
+                    self._log.error("ModbusIOException: " + str(e))
+                    response = None
+
+                request = reader.send(response)
+        except StopIteration as result:
+            if self.holes_changed: #file io off the event loop
+                await asyncio.to_thread(self.save_holes)
+            return result.value
+    #endregion
+
     def validate_protocol(self, protocolSettings : "protocol_settings") -> float:
         score_percent = self.validate_registry(Registry_Type.HOLDING)
         return score_percent
@@ -288,10 +479,10 @@ class modbus_base(transport_base):
 
             if self.analyze_protocol_save_load: #save results if enabled
                 with open(input_save_path, "w") as file:
-                    json.dump(input_registry, file)
+                    json.dump(dict(input_registry.items()), file)
 
                 with open(holding_save_path, "w") as file:
-                    json.dump(holding_registry, file)
+                    json.dump(dict(holding_registry.items()), file)
 
         #print results for debug
         self._log.debug("=== START INPUT REGISTER ===")
@@ -393,12 +584,21 @@ class modbus_base(transport_base):
     def write_variable(self, entry : registry_map_entry, value : str, registry_type : Registry_Type = Registry_Type.HOLDING):
         """ writes a value to a ModBus register; todo: registry_type to handle other write functions"""
 
-        value = value.strip().lower()
-
         temp_map = [entry]
         ranges = self.protocolSettings.calculate_registry_ranges(temp_map, self.protocolSettings.registry_map_size[registry_type], init=True) #init=True to bypass timechecks
         registry = self.read_modbus_registers( ranges=ranges, registry_type=registry_type)
-        info = self.protocolSettings.process_registery(registry, temp_map)
+
+        ushortValue = self.encode_variable(entry, value, registry)
+        if ushortValue is not None:
+            self.write_register(entry.register, ushortValue)
+        #entry.next_read_timestamp = 0 #ensure is read next interval
+
+    def encode_variable(self, entry : registry_map_entry, value : str, registry : dict[int, int]) -> int:
+        """ validates value against the current registry, and returns the ushort to write. None if unsafe to write """
+
+        value = value.strip().lower()
+
+        info = self.protocolSettings.process_registery(registry, [entry])
         #read current value
         #current_registers = self.read_modbus_registers(start=entry.register, end=entry.register, registry_type=registry_type)
         #current_value = current_registers[entry.register]
@@ -486,8 +686,7 @@ class modbus_base(transport_base):
             raise ValueError("Invalid value - None")
 
         self._log.info(f"WRITE: {current_value} => {value} ( {registry[entry.register]} => {ushortValue} ) to Register {entry.register}")
-        self.write_register(entry.register, ushortValue)
-        #entry.next_read_timestamp = 0 #ensure is read next interval
+        return ushortValue
 
 
     def read_variable(self, variable_name : str, registry_type : Registry_Type, entry : registry_map_entry = None):
@@ -495,13 +694,8 @@ class modbus_base(transport_base):
         if variable_name:
             variable_name = variable_name.strip().lower().replace(" ", "_")
 
-        registry_map = self.protocolSettings.get_registry_map(registry_type)
-
         if entry is None:
-            for e in registry_map:
-                if e.variable_name == variable_name:
-                    entry = e
-                    break
+            entry = self.protocolSettings.get_registry_entry_by_variable(variable_name, registry_type)
 
         if entry:
             start : int = 0
@@ -514,11 +708,32 @@ class modbus_base(transport_base):
                 end = max(entry.concatenate_registers)
 
             registers = self.read_modbus_registers(start=start, end=end, registry_type=registry_type)
-            results = self.protocolSettings.process_registery(registers, registry_map)
+            #only the entries on the read registers; not the whole map
+            results = self.protocolSettings.process_registery(registers, self.protocolSettings.get_registry_entries_by_register(start, end, registry_type))
             return results[entry.variable_name]
 
-    def read_modbus_registers(self, ranges : list[tuple] = None, start : int = 0, end : int = None, batch_size : int = None, registry_type : Registry_Type = Registry_Type.INPUT ) -> dict:
+    def read_modbus_registers(self, ranges : list[tuple] = None, start : int = 0, end : int = None, batch_size : int = None, registry_type : Registry_Type = Registry_Type.INPUT ) -> registry_image:
         ''' maybe move this to transport_base ?'''
+        reader = self._read_modbus_registers_steps(ranges, start, end, batch_size, registry_type)
+        try:
+            request = next(reader)
+            while True:
+                time.sleep(self.modbus_delay) #sleep for 1ms to give bus a rest #manual recommends 1s between commands
+                try:
+                    response = self.read_registers(request[0], request[1], registry_type=registry_type)
+                except ModbusIOException as e:
+                    self._log.error("ModbusIOException: " + str(e))
+                    # In pymodbus 3.7+, ModbusIOException doesn't have error_code attribute
+                    # Treat all ModbusIOException as retryable errors
+                    response = None
+
+                request = reader.send(response)
+        except StopIteration as result:
+            self.save_holes()
+            return result.value
+
+    def _read_modbus_registers_steps(self, ranges : list[tuple], start : int, end : int, batch_size : int, registry_type : Registry_Type) -> Generator[tuple, object, registry_image]:
+        ''' read / retry loop shared by the blocking and asyncio readers. yields (start, count) to read, is sent the response; returns the registry. callers save learned holes '''
 
         # Get batch_size from protocol settings if not provided
         if batch_size is None:
@@ -533,7 +748,7 @@ class modbus_base(transport_base):
 
         if not ranges: #ranges is empty, use min max
             if start == 0 and end is None:
-                return {} #empty
+                return registry_image() #empty
 
             end = end + 1
             ranges = []
@@ -544,7 +759,9 @@ class modbus_base(transport_base):
                     count = end - start + 1
                 ranges.append((start, count)) ##APPEND TUPLE
 
-        registry : dict[int,] = {}
+        ranges = list(ranges) #ranges may be split around holes; dont modify the callers list
+
+        registry : registry_image = registry_image()
         retries = 7
         retry = 0
         total_retries = 0
@@ -554,21 +771,22 @@ class modbus_base(transport_base):
             range = ranges[index]
 
             self._log.info("get registers ("+str(index)+"): " +str(registry_type)+ " - " + str(range[0]) + " to " + str(range[0]+range[1]-1) + " ("+str(range[1])+")")
-            time.sleep(self.modbus_delay) #sleep for 1ms to give bus a rest #manual recommends 1s between commands
 
-            isError = False
-            register = None  # Initialize register variable
-            try:
-                register = self.read_registers(range[0], range[1], registry_type=registry_type)
-
-            except ModbusIOException as e:
-                self._log.error("ModbusIOException: " + str(e))
-                # In pymodbus 3.7+, ModbusIOException doesn't have error_code attribute
-                # Treat all ModbusIOException as retryable errors
-                isError = True
+            register = yield range
 
+            if self.learn_holes and getattr(register, "exception_code", None) == self.ILLEGAL_ADDRESS:
+                #not a busy bus; the device does not have one or more of these registers. no delay, no retry
+                if range[1] > 1: #bisect to find the rejected register(s)
+                    half = range[1] // 2
+                    ranges[index:index+1] = [(range[0], half), (range[0] + half, range[1] - half)]
+                    index = index - 1
+                else:
+                    self._log.warning("register " + str(range[0]) + " (" + str(registry_type) + ") rejected by device; will no longer be read")
+                    self.get_holes(registry_type).add(range[0])
+                    self.holes_changed = True
+                continue
 
-            if register is None or isinstance(register, bytes) or (hasattr(register, 'isError') and register.isError()) or isError: #sometimes weird errors are handled incorrectly and response is a ascii error string
+            if register is None or isinstance(register, bytes) or (hasattr(register, 'isError') and register.isError()): #sometimes weird errors are handled incorrectly and response is a ascii error string
                 if register is None:
                     self._log.error("No response received from modbus device")
                 elif isinstance(register, bytes):
@@ -602,10 +820,7 @@ class modbus_base(transport_base):
             # Only process registers if we have a valid response
             if register is not None and hasattr(register, 'registers') and register.registers is not None:
                 #combine registers into "registry"
-                i = -1
-                while(i := i + 1 ) < range[1]:
-                    #print(str(i) + " => " + str(i+range[0]))
-                    registry[i+range[0]] = register.registers[i]
+                registry.set_range(range[0], register.registers[:range[1]])
 
         return registry
 
@@ -7,6 +7,11 @@ try:
 except ImportError:
     from pymodbus.client import ModbusSerialClient
 
+try:
+    from pymodbus.client import AsyncModbusSerialClient
+except ImportError:
+    AsyncModbusSerialClient = None
+
 
 from configparser import SectionProxy
 
@@ -106,3 +111,44 @@ class modbus_rtu(modbus_base):
         self.connected = self.client.connect()
         self._log.debug(f"Modbus rtu connected: {self.connected}")
         super().connect()
+
+    def create_async_client(self):
+        if AsyncModbusSerialClient is None:
+            return None
+
+        return AsyncModbusSerialClient(port=self.port,
+                                       baudrate=int(self.baudrate),
+                                       stopbits=1, parity="N", bytesize=8, timeout=2
+                                       )
+
+    async def async_read_registers(self, start, count=1, registry_type : Registry_Type = Registry_Type.INPUT, **kwargs):
+        if self.async_client is None:
+            return await super().async_read_registers(start, count, registry_type=registry_type, **kwargs)
+
+        if "unit" not in kwargs:
+            kwargs = {"unit": int(self.addresses[0]), **kwargs}
+
+        #compatability
+        if self.pymodbus_slave_arg != "unit":
+            kwargs["slave"] = kwargs.pop("unit")
+
+        if registry_type == Registry_Type.INPUT:
+            return await self.async_client.read_input_registers(address=start, count=count, **kwargs)
+        elif registry_type == Registry_Type.HOLDING:
+            return await self.async_client.read_holding_registers(address=start, count=count, **kwargs)
+
+    async def async_write_register(self, register : int, value : int, **kwargs):
+        if self.async_client is None:
+            return await super().async_write_register(register, value, **kwargs)
+
+        if not self.write_enabled:
+            return
+
+        if "unit" not in kwargs:
+            kwargs = {"unit": self.addresses[0], **kwargs}
+
+        #compatability
+        if self.pymodbus_slave_arg != "unit":
+            kwargs["slave"] = kwargs.pop("unit")
+
+        await self.async_client.write_register(register, value, **kwargs) #function code 0x06 writes to holding register
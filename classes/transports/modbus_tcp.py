@@ -8,6 +8,11 @@ try:
 except ImportError:
     from pymodbus.client import ModbusTcpClient
 
+try:
+    from pymodbus.client import AsyncModbusTcpClient
+except ImportError:
+    AsyncModbusTcpClient = None
+
 from configparser import SectionProxy
 
 from .modbus_base import modbus_base
@@ -73,3 +78,41 @@ class modbus_tcp(modbus_base):
     def connect(self):
         self.connected = self.client.connect()
         super().connect()
+
+    def create_async_client(self):
+        if AsyncModbusTcpClient is None:
+            return None
+
+        return AsyncModbusTcpClient(host=self.host, port=self.port, timeout=7, retries=3)
+
+    async def async_write_register(self, register : int, value : int, **kwargs):
+        if self.async_client is None:
+            return await super().async_write_register(register, value, **kwargs)
+
+        if not self.write_enabled:
+            return
+
+        if "unit" not in kwargs:
+            kwargs = {"unit": 1, **kwargs}
+
+        #compatability
+        if self.pymodbus_slave_arg != "unit":
+            kwargs["slave"] = kwargs.pop("unit")
+
+        await self.async_client.write_register(register, value, **kwargs) #function code 0x06 writes to holding register
+
+    async def async_read_registers(self, start, count=1, registry_type : Registry_Type = Registry_Type.INPUT, **kwargs):
+        if self.async_client is None:
+            return await super().async_read_registers(start, count, registry_type=registry_type, **kwargs)
+
+        if "unit" not in kwargs:
+            kwargs = {"unit": 1, **kwargs}
+
+        #compatability
+        if self.pymodbus_slave_arg != "unit":
+            kwargs["slave"] = kwargs.pop("unit")
+
+        if registry_type == Registry_Type.INPUT:
+            return await self.async_client.read_input_registers(start, count=count, **kwargs)
+        elif registry_type == Registry_Type.HOLDING:
+            return await self.async_client.read_holding_registers(start, count=count, **kwargs)
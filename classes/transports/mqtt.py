@@ -1,16 +1,33 @@
 import atexit
+import decimal
+import hashlib
 import json
+import os
 import random
+import re
+import threading
 import time
 import warnings
+from collections import OrderedDict, deque
 from configparser import SectionProxy
+from typing import Union
 
 import paho.mqtt.client
 import paho.mqtt.packettypes
 import paho.mqtt.properties
-from paho.mqtt.client import MQTT_ERR_NO_CONN
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
 from paho.mqtt.client import Client as MQTTClient
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from defs.common import strtobool
 
 from ..protocol_settings import Registry_Type, WriteMode, registry_map_entry
@@ -26,6 +43,33 @@ class mqtt(transport_base):
     discovery_topic : str = "homeassistant"
     discovery_enabled : bool = False
     json : bool = False
+    json_compact : bool = False
+    ''' json without indentation or spaces '''
+
+    json_encoder : str = "json"
+    ''' json, orjson or msgpack. orjson and msgpack are optional dependencies '''
+
+    discovery_cache : bool = True
+    ''' skip discovery configs that are unchanged since they were last acknowledged by the broker '''
+
+    discovery_cache_path : str = "mqtt_discovery"
+    ''' folder to persist discovery config hashes in; one json file per transport and device '''
+
+    discovery_inflight : int = 20
+    ''' discovery configs awaiting acknowledgement before publishing waits '''
+
+    discovery_timeout : float = 10
+    ''' seconds to wait for a discovery config to be acknowledged '''
+
+    discovery_retained_wait : float = 1
+    ''' seconds of quiet after which the broker is assumed to have sent all retained discovery configs '''
+
+    discovery_transports : dict[str, transport_base] = None
+    ''' transports whose discovery completed, or is waiting for the broker; (re)published on connect, in case the broker lost its retained configs '''
+
+    connected_event : threading.Event = None
+    ''' set while connected to the broker '''
+
     reconnect_delay : int = 7
     """ seconds """
 
@@ -38,6 +82,20 @@ class mqtt(transport_base):
     client : MQTTClient = None
     mqtt_properties : paho.mqtt.properties.Properties = None
 
+    publish_queue_size : int = 1000
+    ''' max topics waiting to be published; when full, the oldest is dropped. 0 = publish on the calling thread '''
+
+    publish_queue : OrderedDict[str, tuple] = None
+    ''' topic => (payload, qos, retain, properties); a newer value for a queued topic replaces the old one '''
+
+    publish_condition : threading.Condition = None
+
+    publish_stats : dict[str, int] = None
+    ''' published, coalesced, dropped, failed, requeued; totals since start '''
+
+    stats_interval : float = 300
+    ''' seconds between publish queue stats in the log '''
+
     __first_connection : bool = True
     __reconnecting : bool = False
     connected : bool = False
@@ -52,7 +110,24 @@ class mqtt(transport_base):
         self.error_topic = settings.get("error_topic", fallback=self.error_topic).rstrip("/")
         self.discovery_topic = settings.get("discovery_topic", fallback=self.discovery_topic)
         self.discovery_enabled = strtobool(settings.get("discovery_enabled", self.discovery_enabled))
+        self.discovery_cache = settings.getboolean("discovery_cache", fallback=self.discovery_cache)
+        self.discovery_cache_path = settings.get("discovery_cache_path", fallback=self.discovery_cache_path)
+        self.discovery_inflight = max(1, settings.getint("discovery_inflight", fallback=self.discovery_inflight))
+        self.discovery_timeout = settings.getfloat("discovery_timeout", fallback=self.discovery_timeout)
+        self.discovery_transports = {}
+        self.connected_event = threading.Event()
         self.json = strtobool(settings.get("json", self.json))
+        self.json_compact = strtobool(settings.get("json_compact", self.json_compact))
+        self.json_encoder = settings.get("json_encoder", fallback=self.json_encoder).strip().lower()
+        if self.json_encoder == "orjson" and orjson is None:
+            warnings.warn("json_encoder = orjson requires orjson; falling back to json", RuntimeWarning)
+            self.json_encoder = "json"
+        elif self.json_encoder == "msgpack" and msgpack is None:
+            warnings.warn("json_encoder = msgpack requires msgpack; falling back to json", RuntimeWarning)
+            self.json_encoder = "json"
+        elif self.json_encoder not in ("json", "orjson", "msgpack"):
+            raise ValueError("Unknown json_encoder: " + self.json_encoder)
+
         self.reconnect_delay = settings.getint("reconnect_delay", fallback=7)
         #self.max_precision = settings.getint('max_precision', fallback=self.max_precision)
 
@@ -63,6 +138,12 @@ class mqtt(transport_base):
         if not isinstance( self.reconnect_attempts , int) or self.reconnect_attempts < 0: #minimum 0
             self.reconnect_attempts = 0
 
+        self.publish_queue_size = settings.getint("publish_queue_size", fallback=self.publish_queue_size)
+        self.publish_queue = OrderedDict()
+        self.publish_condition = threading.Condition()
+        self.publish_stats = {"published" : 0, "coalesced" : 0, "dropped" : 0, "failed" : 0, "requeued" : 0}
+        self.__topics = {}
+
         self.holding_register_prefix = settings.get("holding_register_prefix", fallback="")
         self.input_register_prefix = settings.get("input_register_prefix", fallback="")
 
@@ -102,6 +183,10 @@ class mqtt(transport_base):
             self.client.connect(str(self.host), int(self.port), 60)
             self.client.loop_start()
             atexit.register(self.exit_handler)
+
+            if self.publish_queue_size > 0:
+                thread = threading.Thread(target=self.publish_loop, name="mqtt-publish["+self.transport_name+"]", daemon=True)
+                thread.start()
         else:
             self.mqtt_reconnect() #special reconnect function
 
@@ -143,11 +228,147 @@ class mqtt(transport_base):
 
     def on_disconnect(self, client, userdata, rc):
        self.connected = False
+       self.connected_event.clear()
 
     def on_connect(self, client, userdata, flags, rc):
         """ The callback for when the client receives a CONNACK response from the server. """
         self._log.info("Connected with result code %s\n",str(rc))
         self.connected = True
+        self.connected_event.set()
+
+        for name in list(self.discovery_transports): #broker may have restarted without persistence
+            from_transport = self.discovery_transports.pop(name, None)
+            if from_transport:
+                self.mqtt_discovery(from_transport)
+
+    #region publish queue
+    def publish(self, topic : str, payload : str, qos : int = 0, retain : bool = False, properties : paho.mqtt.properties.Properties = None):
+        ''' queue a publish for the publish thread; thread safe. publishes directly if the queue is disabled '''
+        if self.publish_queue_size <= 0:
+            info = self.client.publish(topic, payload, qos, retain=retain, properties=properties)
+            if info.rc == MQTT_ERR_NO_CONN:
+                self.connected = False
+            return
+
+        with self.publish_condition:
+            if topic in self.publish_queue: #superseded; keep queue position, send the newest value
+                self.publish_stats["coalesced"] += 1
+            elif len(self.publish_queue) >= self.publish_queue_size: #backpressure; drop the oldest
+                self.publish_queue.popitem(last=False)
+                self.publish_stats["dropped"] += 1
+
+            self.publish_queue[topic] = (payload, qos, retain, properties)
+            self.publish_condition.notify()
+
+    def publish_loop(self):
+        ''' publish thread; drains the publish queue while connected '''
+        last_stats = time.monotonic()
+        last_dropped = 0
+        while True:
+            with self.publish_condition:
+                while not self.publish_queue or not self.connected:
+                    self.publish_condition.wait(1) #connection state has no notify; poll
+                    if not self.connected:
+                        self.connected = self.client.is_connected()
+
+                batch = self.publish_queue
+                self.publish_queue = OrderedDict()
+
+            published : int = 0
+            failed : int = 0
+            rc : int = MQTT_ERR_SUCCESS
+            while batch:
+                topic, (payload, qos, retain, properties) = next(iter(batch.items()))
+                try:
+                    info = self.client.publish(topic, payload, qos, retain=retain, properties=properties)
+                except Exception as e: #ie: ValueError for wildcards in the topic or an oversize payload; keep the thread alive
+                    self._log.error("failed to publish " + str(topic) + ": " + str(e))
+                    failed += 1
+                    del batch[topic]
+                    continue
+
+                rc = info.rc
+                if rc != MQTT_ERR_SUCCESS: #not sent; requeue it and the rest of the batch
+                    break
+                published += 1
+                del batch[topic]
+
+            with self.publish_condition:
+                self.publish_stats["published"] += published
+                self.publish_stats["failed"] += failed
+                if batch:
+                    self.requeue(batch)
+
+            if rc == MQTT_ERR_NO_CONN:
+                self.connected = False #wait for the reconnect
+            elif rc != MQTT_ERR_SUCCESS:
+                self._log.warning("publish failed, rc " + str(rc) + "; retrying")
+                time.sleep(1)
+
+            if time.monotonic() - last_stats > self.stats_interval:
+                last_stats = time.monotonic()
+                stats = "publish queue: " + str(len(self.publish_queue)) + " queued, " + ", ".join(key + " " + str(value) for key, value in self.publish_stats.items())
+                if self.publish_stats["dropped"] > last_dropped:
+                    self._log.warning(stats)
+                else:
+                    self._log.info(stats)
+                last_dropped = self.publish_stats["dropped"]
+
+    def requeue(self, batch : OrderedDict[str, tuple]):
+        ''' put unsent messages back at the front of the queue; a newer queued value for the same topic is kept. call with publish_condition held '''
+        queue = OrderedDict((topic, message) for topic, message in batch.items() if topic not in self.publish_queue)
+        self.publish_stats["requeued"] += len(queue)
+        queue.update(self.publish_queue)
+        while len(queue) > self.publish_queue_size: #backpressure; drop the oldest
+            queue.popitem(last=False)
+            self.publish_stats["dropped"] += 1
+        self.publish_queue = queue
+
+    def get_publish_queue_depth(self) -> int:
+        return len(self.publish_queue)
+    #endregion
+
+    #region topics
+    __topics : dict[str, dict[str, tuple[str, int]]] = None
+    ''' device_identifier => variable name => (topic, precision) '''
+
+    def get_precision(self, entry : registry_map_entry) -> int:
+        ''' decimals worth publishing; max_precision, or fewer when unit_mod has fewer. -1 = no rounding '''
+        if self.max_precision < 0:
+            return -1
+
+        exponent = decimal.Decimal(str(entry.unit_mod)).normalize().as_tuple().exponent
+        return min(self.max_precision, max(0, -exponent))
+
+    def build_topic_table(self, from_transport : transport_base) -> dict[str, tuple[str, int]]:
+        ''' topic and precision per variable of from_transport's protocol, so write_data doesnt rebuild them every read '''
+        table : dict[str, tuple[str, int]] = {}
+        if not getattr(from_transport, "protocolSettings", None):
+            return table
+
+        for entries in from_transport.protocolSettings.registry_map.values():
+            for entry in entries:
+                if entry.variable_name not in table:
+                    topic = str(self.base_topic+"/"+from_transport.device_identifier+"/"+entry.variable_name).lower()
+                    table[entry.variable_name] = (topic, self.get_precision(entry))
+
+        return table
+
+    def get_topics(self, from_transport : transport_base) -> dict[str, tuple[str, int]]:
+        topics = self.__topics.get(from_transport.device_identifier)
+        if topics is None:
+            topics = self.__topics[from_transport.device_identifier] = self.build_topic_table(from_transport)
+        return topics
+
+    def encode_json(self, data : dict[str, str]) -> Union[str, bytes]:
+        if self.json_encoder == "orjson":
+            return orjson.dumps(data) if self.json_compact else orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        if self.json_encoder == "msgpack":
+            return msgpack.packb(data)
+        if self.json_compact:
+            return json.dumps(data, separators=(",", ":"))
+        return json.dumps(data, indent=4)
+    #endregion
 
     __write_topics : dict[str, registry_map_entry] = {}
 
@@ -161,20 +382,31 @@ class mqtt(transport_base):
         self._log.info(f"write data from [{from_transport.transport_name}] to mqtt transport")
         self._log.info(data)
         #have to send this every loop, because mqtt doesnt disconnect when HA restarts. HA bug.
-        info = self.client.publish(self.base_topic + "/" + from_transport.device_identifier + "/availability","online", qos=0,retain=True)
-        if info.rc == MQTT_ERR_NO_CONN:
-            self.connected = False
+        self.publish(self.base_topic + "/" + from_transport.device_identifier + "/availability","online", qos=0,retain=True)
+
+        topics = self.get_topics(from_transport)
+        values = {}
+        for entry, val in data.items():
+            topic = topics.get(entry)
+            if topic is None: #not in the protocol, ie: added by the transport
+                topic = topics[entry] = (str(self.base_topic+"/"+from_transport.device_identifier+"/"+entry).lower(), self.max_precision)
+
+            if isinstance(val, float) and topic[1] >= 0: #apply max_precision on mqtt transport
+                val = round(val, topic[1])
+
+            values[entry] = val
 
         if(self.json):
             # Serializing json
-            json_object = json.dumps(data, indent=4)
-            self.client.publish(self.base_topic+"/"+from_transport.device_identifier, json_object, 0, properties=self.mqtt_properties)
+            json_object = self.encode_json(values)
+            self.publish(self.base_topic+"/"+from_transport.device_identifier, json_object, 0, properties=self.mqtt_properties)
         else:
-            for entry, val in data.items():
-                if isinstance(val, float) and self.max_precision >= 0: #apply max_precision on mqtt transport
-                    val = round(val, self.max_precision)
+            for entry, val in values.items():
+                self.publish(topics[entry][0], str(val))
 
-                self.client.publish(str(self.base_topic+"/"+from_transport.device_identifier+"/"+entry).lower(), str(val))
+    async def async_write_data(self, data : dict[str, str], from_transport : transport_base):
+        ''' publish only queues messages for paho's network thread, so it is safe to call on the event loop '''
+        self.write_data(data, from_transport)
 
     def client_on_message(self, client, userdata, msg):
         """ The callback for when a PUBLISH message is received from the server. """
@@ -187,6 +419,7 @@ class mqtt(transport_base):
             #self.write_variable(entry, value=str(msg.payload.decode('utf-8')))
 
     def init_bridge(self, from_transport : transport_base):
+        self.__topics[from_transport.device_identifier] = self.build_topic_table(from_transport)
 
         if from_transport.write_enabled:
             self.__write_topics = {}
@@ -201,9 +434,102 @@ class mqtt(transport_base):
         if self.discovery_enabled:
             self.mqtt_discovery(from_transport)
 
+    #region discovery
+    def get_discovery_cache_file(self, from_transport : transport_base) -> str:
+        name = self.transport_name + "_" + (from_transport.device_identifier or "unknown")
+        name = re.sub(r"[^a-zA-Z0-9_.-]", "_", name)
+        return os.path.join(self.discovery_cache_path, name + ".json")
+
+    def load_discovery_cache(self, file : str) -> dict[str, str]:
+        if not self.discovery_cache or not os.path.exists(file):
+            return {}
+
+        try:
+            with open(file, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            self._log.error("failed to load discovery cache from " + file + ": " + str(e))
+            return {}
+
+    def save_discovery_cache(self, file : str, cache : dict[str, str]):
+        if not self.discovery_cache:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+            with open(file, "w") as f:
+                json.dump(cache, f)
+        except Exception as e:
+            self._log.error("failed to save discovery cache to " + file + ": " + str(e))
+
+    def wait_for_discovery(self, topic : str, digest : str, info : paho.mqtt.client.MQTTMessageInfo, cache : dict[str, str]):
+        ''' wait for the broker to acknowledge a discovery config; only acknowledged configs are cached '''
+        try:
+            info.wait_for_publish(self.discovery_timeout)
+        except (ValueError, RuntimeError) as e:
+            self._log.warning("discovery publish failed for " + topic + ": " + str(e))
+
+        if info.is_published():
+            cache[topic] = digest
+        else:
+            cache.pop(topic, None)
+
+    def get_retained_discovery(self, topic_filter : str) -> dict[str, str]:
+        ''' sha256 of the discovery configs the broker currently retains; topic => digest '''
+        retained : dict[str, str] = {}
+        received = threading.Event()
+
+        def on_retained(client, userdata, msg):
+            if msg.retain:
+                retained[msg.topic] = hashlib.sha256(msg.payload).hexdigest()
+            received.set()
+
+        self.client.message_callback_add(topic_filter, on_retained)
+        try:
+            self.client.subscribe(topic_filter)
+            deadline = time.time() + self.discovery_timeout
+            while received.wait(self.discovery_retained_wait) and time.time() < deadline: #until the retained configs stop arriving
+                received.clear()
+            self.client.unsubscribe(topic_filter)
+        finally:
+            self.client.message_callback_remove(topic_filter)
+
+        return retained
+
     def mqtt_discovery(self, from_transport : transport_base):
+        ''' publish discovery on a background thread, so reads dont wait on it '''
+        thread = threading.Thread(target=self.publish_discovery, args=(from_transport,), name="mqtt-discovery["+from_transport.transport_name+"]", daemon=True)
+        thread.start()
+
+    def get_discovery_topic(self, from_transport : transport_base, name : str) -> str:
+        ''' config topic of a variable; name "+" gives the subscription filter for all of the device's configs '''
+        return self.discovery_topic + "/sensor/HN-" + from_transport.device_serial_number + "/" + name + "/config"
+
+    def wait_for_connection(self, from_transport : transport_base) -> bool:
+        ''' wait up to discovery_timeout for the broker; otherwise on_connect publishes discovery once it connects '''
+        if self.client.is_connected() or (self.connected_event.wait(self.discovery_timeout) and self.client.is_connected()):
+            return True
+
+        self._log.warning("not connected to the broker; discovery is published once it connects")
+        self.discovery_transports[from_transport.transport_name] = from_transport
+        #connected meanwhile; continue, unless on_connect already took it
+        return self.client.is_connected() and self.discovery_transports.pop(from_transport.transport_name, None) is not None
+
+    def publish_discovery(self, from_transport : transport_base):
+        if not self.wait_for_connection(from_transport): #qos 1 publishes fail without a connection
+            return
+
         self._log.info("Publishing HA Discovery Topics...")
 
+        cache_file = self.get_discovery_cache_file(from_transport)
+        cache = self.load_discovery_cache(cache_file)
+        if cache: #only skip configs the broker still retains; it may have restarted without persistence
+            retained = self.get_retained_discovery(self.get_discovery_topic(from_transport, "+"))
+            cache = {topic : digest for topic, digest in cache.items() if retained.get(topic) == digest}
+        topics : set[str] = set()
+        #(topic, digest, info); bounded by discovery_inflight, so configs go out as fast as the broker acknowledges them
+        inflight : deque[tuple[str, str, paho.mqtt.client.MQTTMessageInfo]] = deque()
+
         disc_payload = {}
         disc_payload["availability_topic"] = self.base_topic + "/" + from_transport.device_identifier + "/availability"
 
@@ -217,11 +543,9 @@ class mqtt(transport_base):
         for entries in from_transport.protocolSettings.registry_map.values():
             registry_map.extend(entries)
 
-        length = len(registry_map)
         count = 0
+        skipped = 0
         for item in registry_map:
-            count = count + 1
-
             if item.concatenate and item.register != item.concatenate_registers[0]:
                 continue #skip all except the first register so no duplicates
 
@@ -240,9 +564,6 @@ class mqtt(transport_base):
                 if self.__holding_register_prefix and item.registry_type == Registry_Type.HOLDING:
                     clean_name = self.__holding_register_prefix + clean_name
 
-
-            print(("#Publishing Topic "+str(count)+" of " + str(length) + ' "'+str(clean_name)+'"').ljust(100)+"#", end="\r", flush=True)
-
             #device['sw_version'] = bms_version
             disc_payload = {}
             disc_payload["availability_topic"] = self.base_topic + "/" + from_transport.device_identifier + "/availability"
@@ -260,17 +581,35 @@ class mqtt(transport_base):
                 disc_payload["unit_of_measurement"] = item.unit
 
 
-            discovery_topic = self.discovery_topic+"/sensor/HN-" + from_transport.device_serial_number  + writePrefix + "/" + disc_payload["name"].replace(" ", "_") + "/config"
+            discovery_topic = self.get_discovery_topic(from_transport, disc_payload["name"].replace(" ", "_"))
+
+            payload = json.dumps(disc_payload)
+            digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+            topics.add(discovery_topic)
+            count = count + 1
 
-            self.client.publish(discovery_topic,
-                                       json.dumps(disc_payload),qos=1, retain=True)
+            if cache.get(discovery_topic) == digest: #retained config is unchanged and still on the broker
+                skipped = skipped + 1
+            else:
+                info = self.client.publish(discovery_topic, payload, qos=1, retain=True)
+                inflight.append((discovery_topic, digest, info))
+                if len(inflight) >= self.discovery_inflight:
+                    self.wait_for_discovery(*inflight.popleft(), cache)
 
             #send WO message to indicate topic is write only
             if item.write_mode == WriteMode.WRITEONLY:
-                self.client.publish(disc_payload["state_topic"], "WRITEONLY")
+                self.publish(disc_payload["state_topic"], "WRITEONLY")
+
+        while inflight:
+            self.wait_for_discovery(*inflight.popleft(), cache)
+
+        for topic in list(cache): #forget configs no longer in the protocol
+            if topic not in topics:
+                del cache[topic]
 
-            time.sleep(0.07) #slow down for better reliability
+        self.save_discovery_cache(cache_file, cache)
 
-        self.client.publish(disc_payload["availability_topic"],"online",qos=0, retain=True)
-        print()
-        self._log.info("Published HA "+str(count)+"x Discovery Topics")
+        self.publish(disc_payload["availability_topic"],"online",qos=0, retain=True)
+        self._log.info("Published HA "+str(count - skipped)+"x Discovery Topics, "+str(skipped)+"x unchanged")
+        self.discovery_transports[from_transport.transport_name] = from_transport
+    #endregion
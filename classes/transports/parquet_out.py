@@ -0,0 +1,259 @@
+import atexit
+import os
+import threading
+import time
+from configparser import SectionProxy
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from ..protocol_settings import (
+    Data_Type,
+    Registry_Type,
+    protocol_settings,
+    registry_map_entry,
+)
+from .transport_base import transport_base
+
+
+class parquet_buffer:
+    ''' rows of one device waiting to be written to a parquet file '''
+
+    schema : "pyarrow.Schema"
+    rows : list[dict]
+    ''' rows not yet converted to a record batch '''
+    batches : list["pyarrow.RecordBatch"]
+    count : int = 0
+    ''' rows in rows and batches '''
+    partition : str = ""
+    ''' partition folder of the buffered rows, ie: date=2024-01-15 '''
+    created : float = 0
+
+    def __init__(self, schema : "pyarrow.Schema", partition : str):
+        self.schema = schema
+        self.rows = []
+        self.batches = []
+        self.partition = partition
+        self.created = time.time()
+
+
+class parquet_out(transport_base):
+    ''' Parquet output transport; writes rows per device to time partitioned parquet files. requires pyarrow '''
+    output_path: str = "parquet"
+    partition: str = "day"  # day or hour
+    batch_rows: int = 1000  # Rows converted to an arrow record batch at a time
+    max_rows: int = 86400  # Rows per file
+    flush_interval: float = 300.0  # Max seconds rows are kept in memory before they are written
+    flush_check: float = 10.0  # Seconds between checks of every buffer's age, also of devices that stopped sending
+    compression: str = "zstd"  # snappy, gzip, zstd, lz4 or none
+
+    schemas: dict = None  # Source transport name => (schema, variable name => converter)
+    buffers: dict = None  # Device identifier => parquet_buffer
+    files_written: int = 0
+    lock: threading.RLock = None  # Buffers are written by write_data and the flush thread
+    flush_thread: threading.Thread = None
+    stop_event: threading.Event = None
+
+    def __init__(self, settings: SectionProxy):
+        self.output_path = settings.get("output_path", fallback=self.output_path)
+        self.partition = settings.get("partition", fallback=self.partition).strip().lower()
+        self.batch_rows = max(1, settings.getint("batch_rows", fallback=self.batch_rows))
+        self.max_rows = max(1, settings.getint("max_rows", fallback=self.max_rows))
+        self.flush_interval = max(0.1, settings.getfloat("flush_interval", fallback=self.flush_interval))
+        self.flush_check = max(0.1, settings.getfloat("flush_check", fallback=self.flush_check))
+        self.compression = settings.get("compression", fallback=self.compression).strip().lower()
+
+        if self.partition not in ("day", "hour"):
+            raise ValueError("Unknown parquet_out partition: " + self.partition)
+        if pyarrow is None:
+            raise ValueError("parquet_out requires pyarrow; pip install pyarrow")
+
+        self.schemas = {}
+        self.buffers = {}
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+
+        self.write_enabled = True  # Parquet output is always write-enabled
+        super().__init__(settings)
+
+    def connect(self):
+        """Create the output folder"""
+        self._log.info("parquet_out connect")
+        try:
+            os.makedirs(self.output_path, exist_ok=True)
+        except Exception as e:
+            self._log.error(f"Failed to create output path {self.output_path}: {e}")
+            self.connected = False
+            return
+
+        self.flush_thread = threading.Thread(target=self.flush_loop, name="parquet_out-flush[" + self.transport_name + "]", daemon=True)
+        self.flush_thread.start()
+        atexit.register(self.close)
+        self.connected = True
+
+    @staticmethod
+    def _to_float(value):
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _to_int(value):
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _to_string(value):
+        return None if value is None else str(value)
+
+    def _get_field(self, entry: registry_map_entry, protocol_settings: "protocol_settings") -> tuple:
+        """(arrow field, converter) for a registry entry; the unit is kept as field metadata"""
+        metadata = {"unit": entry.unit} if entry.unit else None
+
+        if (entry.concatenate
+            or entry.data_type in (Data_Type.ASCII, Data_Type.HEX, Data_Type._8BIT_FLAGS, Data_Type._16BIT_FLAGS, Data_Type._32BIT_FLAGS)
+            or protocol_settings.get_codes(entry) is not None):
+            return (pyarrow.field(entry.variable_name, pyarrow.string(), metadata=metadata), self._to_string)
+
+        # Scaled values, and ushort / uint which are decoded as floats
+        if entry.unit_mod != 1.0 or entry.data_type in (Data_Type.USHORT, Data_Type.UINT):
+            return (pyarrow.field(entry.variable_name, pyarrow.float64(), metadata=metadata), self._to_float)
+
+        return (pyarrow.field(entry.variable_name, pyarrow.int64(), metadata=metadata), self._to_int)
+
+    def _build_schema(self, from_transport: transport_base) -> tuple:
+        """Arrow schema and converters from the source transport's protocol"""
+        fields = [pyarrow.field("timestamp", pyarrow.timestamp("ms", tz="UTC"))]
+        converters = {}
+
+        protocol_settings = getattr(from_transport, "protocolSettings", None)
+        if protocol_settings:
+            for registry_type in [Registry_Type.INPUT, Registry_Type.HOLDING]:
+                for entry in protocol_settings.get_registry_map(registry_type):
+                    if entry.variable_name in converters or entry.variable_name == "timestamp":
+                        continue
+                    if entry.concatenate and entry.register != entry.concatenate_registers[0]:
+                        continue
+
+                    field, converter = self._get_field(entry, protocol_settings)
+                    fields.append(field)
+                    converters[entry.variable_name] = converter
+
+        return (pyarrow.schema(fields), converters)
+
+    def _get_schema(self, from_transport: transport_base, data: dict[str, str]) -> tuple:
+        schema, converters = self.schemas.get(from_transport.transport_name) or self._build_schema(from_transport)
+
+        # Variables not in the protocol are written as strings
+        missing = [key for key in data if key not in converters and key != "timestamp"]
+        if missing:
+            for key in missing:
+                schema = schema.append(pyarrow.field(key, pyarrow.string()))
+            converters = {**converters, **dict.fromkeys(missing, self._to_string)}
+
+        self.schemas[from_transport.transport_name] = (schema, converters)
+        return (schema, converters)
+
+    def get_partition(self, timestamp: float) -> str:
+        if self.partition == "hour":
+            return time.strftime("date=%Y-%m-%d/hour=%H", time.gmtime(timestamp))
+        return time.strftime("date=%Y-%m-%d", time.gmtime(timestamp))
+
+    def write_data(self, data: dict[str, str], from_transport: transport_base):
+        """Buffer a row; rows are written once a file is full, the partition changes or flush_interval passes"""
+        if not self.write_enabled or not self.connected:
+            return
+
+        self._log.debug(f"write data from [{from_transport.transport_name}] to parquet_out transport")
+
+        with self.lock:
+            self._buffer_row(data, from_transport)
+
+    def _buffer_row(self, data: dict[str, str], from_transport: transport_base):
+        timestamp = time.time()
+        schema, converters = self._get_schema(from_transport, data)
+        partition = self.get_partition(timestamp)
+        device = from_transport.device_identifier or from_transport.transport_name
+
+        buffer: parquet_buffer = self.buffers.get(device)
+        if buffer is not None and (buffer.schema is not schema or buffer.partition != partition):
+            self.flush(device)
+            buffer = None
+
+        if buffer is None:
+            buffer = self.buffers[device] = parquet_buffer(schema, partition)
+
+        row = {key: converters[key](value) for key, value in data.items() if key != "timestamp"}
+        row["timestamp"] = int(timestamp * 1000)
+        buffer.rows.append(row)
+        buffer.count += 1
+
+        # Convert to columnar record batches as rows come in; python dicts are far larger
+        if len(buffer.rows) >= self.batch_rows:
+            buffer.batches.append(pyarrow.RecordBatch.from_pylist(buffer.rows, schema=buffer.schema))
+            buffer.rows = []
+
+        if buffer.count >= self.max_rows or timestamp - buffer.created >= self.flush_interval:
+            self.flush(device)
+
+    def flush(self, device: str):
+        """Write the buffered rows of a device to a new parquet file"""
+        buffer: parquet_buffer = self.buffers.pop(device, None)
+        if buffer is None or not buffer.count:
+            return
+
+        if buffer.rows:
+            buffer.batches.append(pyarrow.RecordBatch.from_pylist(buffer.rows, schema=buffer.schema))
+
+        folder = os.path.join(self.output_path, device, buffer.partition)
+        file = os.path.join(folder, time.strftime("part-%Y%m%d-%H%M%S", time.gmtime(buffer.created)) + f"-{self.files_written}.parquet")
+        try:
+            os.makedirs(folder, exist_ok=True)
+            table = pyarrow.Table.from_batches(buffer.batches, schema=buffer.schema)
+            pyarrow.parquet.write_table(table, file, compression=self.compression)
+            self.files_written += 1
+            self._log.info(f"Wrote {buffer.count} rows to {file}")
+        except Exception as e:
+            self._log.error(f"Failed to write {file}: {e}")
+
+    def flush_all(self):
+        with self.lock:
+            for device in list(self.buffers):
+                self.flush(device)
+
+    def flush_expired(self):
+        """Write every buffer older than flush_interval"""
+        with self.lock:
+            now = time.time()
+            for device in [device for device, buffer in self.buffers.items() if now - buffer.created >= self.flush_interval]:
+                self.flush(device)
+
+    def flush_loop(self):
+        """Flush thread; buffers of devices that stopped sending are written too"""
+        while not self.stop_event.wait(min(self.flush_check, self.flush_interval)):
+            try:
+                self.flush_expired()
+            except Exception as e:
+                self._log.error(f"Failed to flush: {e}")
+
+    def close(self):
+        """Stop the flush thread and write every buffered row"""
+        self.stop_event.set()
+        if self.flush_thread is not None and self.flush_thread is not threading.current_thread():
+            self.flush_thread.join(timeout=10)
+        self.flush_all()
+
+    def init_bridge(self, from_transport: transport_base):
+        """Build the arrow schema for the source transport"""
+        self.schemas[from_transport.transport_name] = self._build_schema(from_transport)
+
+    def __del__(self):
+        """Write buffered rows on destruction"""
+        if self.buffers:
+            self.close()
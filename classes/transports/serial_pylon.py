@@ -7,6 +7,7 @@ import serial
 from defs.common import find_usb_serial_port, get_usb_serial_port_info
 
 from ..Object import Object
+from ..protocol_settings import Registry_Type
 from .serial_frame_client import serial_frame_client
 from .transport_base import transport_base
 
@@ -130,13 +131,8 @@ class serial_pylon(transport_base):
         if variable_name:
             variable_name = variable_name.strip().lower().replace(" ", "_")
 
-        registry_map = self.protocolSettings.get_registry_map()
-
         if entry is None:
-            for e in registry_map:
-                if e.variable_name == variable_name:
-                    entry = e
-                    break
+            entry = self.protocolSettings.get_registry_entry_by_variable(variable_name, Registry_Type.ZERO)
 
 
         if entry:
@@ -148,7 +144,7 @@ class serial_pylon(transport_base):
                 raw = getattr(self.decode_frame(frame), attribute)
                 if raw and attribute == "info":
                     raw = bytes.fromhex(raw.decode("utf8")) #because protocol is in "ascii"
-                    raw = self.protocolSettings.process_registery({entry.register : raw}, map=registry_map)
+                    raw = self.protocolSettings.process_registery({entry.register : raw}, map=self.protocolSettings.get_registry_entries_by_register(entry.register, entry.register, Registry_Type.ZERO))
                 return raw
 
 
@@ -0,0 +1,239 @@
+import atexit
+import sqlite3
+import threading
+import time
+from configparser import SectionProxy
+
+from ..protocol_settings import Registry_Type
+from .transport_base import transport_base
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    identifier TEXT NOT NULL UNIQUE,
+    name TEXT,
+    manufacturer TEXT,
+    model TEXT,
+    serial_number TEXT,
+    transport TEXT
+);
+CREATE TABLE IF NOT EXISTS variables (
+    id INTEGER PRIMARY KEY,
+    device_id INTEGER NOT NULL REFERENCES devices (id),
+    name TEXT NOT NULL,
+    unit TEXT,
+    UNIQUE (device_id, name)
+);
+CREATE TABLE IF NOT EXISTS readings (
+    time INTEGER NOT NULL,
+    variable_id INTEGER NOT NULL,
+    value REAL,
+    text TEXT,
+    PRIMARY KEY (time, variable_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS readings_variable ON readings (variable_id, time);
+CREATE TABLE IF NOT EXISTS rollups (
+    period INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    variable_id INTEGER NOT NULL,
+    min REAL,
+    max REAL,
+    avg REAL,
+    count INTEGER,
+    PRIMARY KEY (period, time, variable_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollups_variable ON rollups (period, variable_id, time);
+CREATE TABLE IF NOT EXISTS rollup_state (
+    period INTEGER PRIMARY KEY,
+    time INTEGER NOT NULL
+);
+CREATE VIEW IF NOT EXISTS history AS
+    SELECT devices.identifier AS device, variables.name AS variable, variables.unit AS unit, readings.time AS time, readings.value AS value, readings.text AS text
+    FROM readings
+    JOIN variables ON variables.id = readings.variable_id
+    JOIN devices ON devices.id = variables.device_id;
+"""
+# times are unix timestamps in ms. numeric readings are stored in value, everything else in text.
+# rollups hold 1 minute (period 60000) and 1 hour (period 3600000) min / max / avg per variable
+
+MINUTE = 60 * 1000
+HOUR = 60 * MINUTE
+
+
+class sqlite_out(transport_base):
+    ''' SQLite output transport; local history with 1 minute / 1 hour rollups and retention '''
+    database: str = "protocol_gateway.db"
+    batch_size: int = 1000  # Readings per transaction
+    batch_timeout: float = 10.0  # Max seconds readings wait before they are committed
+    rollup_interval: float = 60.0  # Seconds between rollup and retention runs
+    retention_raw: float = 7 * 86400  # Seconds readings are kept; 0 = forever
+    retention_1m: float = 30 * 86400  # Seconds 1 minute rollups are kept; 0 = forever
+    retention_1h: float = 0  # Seconds 1 hour rollups are kept; 0 = forever
+
+    connection: sqlite3.Connection = None
+    lock: threading.Lock = None  # async_write_data writes from a thread pool
+    device_ids: dict = None  # Device identifier => id
+    variable_ids: dict = None  # (device id, variable name) => id
+    pending: list = None  # (time, variable id, value, text) waiting to be committed
+    last_commit: float = 0
+    last_rollup: float = 0
+
+    def __init__(self, settings: SectionProxy):
+        self.database = settings.get("database", fallback=self.database)
+        self.batch_size = max(1, settings.getint("batch_size", fallback=self.batch_size))
+        self.batch_timeout = settings.getfloat("batch_timeout", fallback=self.batch_timeout)
+        self.rollup_interval = settings.getfloat("rollup_interval", fallback=self.rollup_interval)
+        self.retention_raw = settings.getfloat("retention_raw", fallback=self.retention_raw)
+        self.retention_1m = settings.getfloat("retention_1m", fallback=self.retention_1m)
+        self.retention_1h = settings.getfloat("retention_1h", fallback=self.retention_1h)
+
+        self.lock = threading.Lock()
+        self.device_ids = {}
+        self.variable_ids = {}
+        self.pending = []
+
+        self.write_enabled = True  # SQLite output is always write-enabled
+        super().__init__(settings)
+
+    def connect(self):
+        """Open the database in WAL mode and create the schema"""
+        self._log.info("sqlite_out connect")
+        try:
+            self.connection = sqlite3.connect(self.database, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")  # WAL is durable on commit, except on power loss
+            self.connection.executescript(SCHEMA)
+            self.connection.commit()
+        except Exception as e:
+            self._log.error(f"Failed to open database {self.database}: {e}")
+            self.connected = False
+            return
+
+        self.last_commit = time.time()
+        atexit.register(self.close)
+        self.connected = True
+
+    def get_device_id(self, from_transport: transport_base) -> int:
+        identifier = from_transport.device_identifier or from_transport.transport_name
+        device_id = self.device_ids.get(identifier)
+        if device_id is None:
+            self.connection.execute(
+                "INSERT INTO devices (identifier, name, manufacturer, model, serial_number, transport) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (identifier) DO UPDATE SET name = excluded.name, manufacturer = excluded.manufacturer, "
+                "model = excluded.model, serial_number = excluded.serial_number, transport = excluded.transport",
+                (identifier, from_transport.device_name, from_transport.device_manufacturer, from_transport.device_model,
+                 from_transport.device_serial_number, from_transport.transport_name))
+            device_id = self.device_ids[identifier] = self.connection.execute("SELECT id FROM devices WHERE identifier = ?", (identifier,)).fetchone()[0]
+        return device_id
+
+    def get_variable_id(self, device_id: int, name: str, unit: str = None) -> int:
+        variable_id = self.variable_ids.get((device_id, name))
+        if variable_id is None:
+            self.connection.execute("INSERT OR IGNORE INTO variables (device_id, name, unit) VALUES (?, ?, ?)", (device_id, name, unit))
+            variable_id = self.connection.execute("SELECT id FROM variables WHERE device_id = ? AND name = ?", (device_id, name)).fetchone()[0]
+            self.variable_ids[(device_id, name)] = variable_id
+        return variable_id
+
+    def write_data(self, data: dict[str, str], from_transport: transport_base):
+        """Queue readings; they are committed in batches"""
+        if not self.write_enabled or not self.connected:
+            return
+
+        self._log.debug(f"write data from [{from_transport.transport_name}] to sqlite_out transport")
+
+        now = int(time.time() * 1000)
+        with self.lock:
+            try:
+                device_id = self.get_device_id(from_transport)
+                for key, value in data.items():
+                    variable_id = self.get_variable_id(device_id, key)
+                    try:
+                        self.pending.append((now, variable_id, float(value), None))
+                    except (ValueError, TypeError):
+                        self.pending.append((now, variable_id, None, str(value)))
+
+                if len(self.pending) >= self.batch_size or time.time() - self.last_commit >= self.batch_timeout:
+                    self.commit()
+
+                if time.time() - self.last_rollup >= self.rollup_interval:
+                    self.last_rollup = time.time()
+                    self.commit()  # rollups only see committed readings
+                    self.rollup()
+                    self.prune()
+            except Exception as e:
+                self._log.error(f"Failed to write to {self.database}: {e}")
+
+    def commit(self):
+        """Insert pending readings in one transaction"""
+        if self.pending:
+            self.connection.executemany("INSERT OR REPLACE INTO readings (time, variable_id, value, text) VALUES (?, ?, ?, ?)", self.pending)
+            self.pending = []
+        self.connection.commit()
+        self.last_commit = time.time()
+
+    def rollup(self, now: int = None):
+        """Roll complete minutes of readings up into 1 minute rollups, and complete hours of those into 1 hour rollups"""
+        now = int(time.time() * 1000) if now is None else now
+        sources = (
+            (MINUTE, "SELECT MIN(time) FROM readings",
+             "SELECT ?1, (time / ?1) * ?1, variable_id, MIN(value), MAX(value), AVG(value), COUNT(value) "
+             "FROM readings WHERE time >= ?2 AND time < ?3 AND value IS NOT NULL GROUP BY time / ?1, variable_id"),
+            (HOUR, "SELECT MIN(time) FROM rollups WHERE period = 60000",
+             "SELECT ?1, (time / ?1) * ?1, variable_id, MIN(min), MAX(max), SUM(avg * count) / SUM(count), SUM(count) "
+             "FROM rollups WHERE period = 60000 AND time >= ?2 AND time < ?3 GROUP BY time / ?1, variable_id"),
+        )
+
+        for period, first, select in sources:
+            state = self.connection.execute("SELECT time FROM rollup_state WHERE period = ?", (period,)).fetchone()
+            start = state[0] if state else self.connection.execute(first).fetchone()[0]
+            end = (now // period) * period  # only complete periods
+            if start is None or start >= end:
+                continue
+
+            start = (start // period) * period
+            self.connection.execute("INSERT OR REPLACE INTO rollups (period, time, variable_id, min, max, avg, count) " + select, (period, start, end))
+            self.connection.execute("INSERT OR REPLACE INTO rollup_state (period, time) VALUES (?, ?)", (period, end))
+
+        self.connection.commit()
+
+    def prune(self, now: int = None):
+        """Delete readings and rollups past their retention"""
+        now = int(time.time() * 1000) if now is None else now
+        if self.retention_raw > 0:
+            self.connection.execute("DELETE FROM readings WHERE time < ?", (now - int(self.retention_raw * 1000),))
+        for period, retention in ((MINUTE, self.retention_1m), (HOUR, self.retention_1h)):
+            if retention > 0:
+                self.connection.execute("DELETE FROM rollups WHERE period = ? AND time < ?", (period, now - int(retention * 1000)))
+        self.connection.commit()
+
+    def close(self):
+        """Commit pending readings and close the database"""
+        with self.lock:
+            if self.connection is None:
+                return
+            try:
+                self.commit()
+                self.connection.close()
+            except Exception as e:
+                self._log.error(f"Failed to close {self.database}: {e}")
+            self.connection = None
+            self.connected = False
+
+    def init_bridge(self, from_transport: transport_base):
+        """Register the source transport's device and variables, with their units"""
+        if not self.connected:
+            return
+
+        with self.lock:
+            device_id = self.get_device_id(from_transport)
+            protocol_settings = getattr(from_transport, "protocolSettings", None)
+            if protocol_settings:
+                for registry_type in [Registry_Type.INPUT, Registry_Type.HOLDING]:
+                    for entry in protocol_settings.get_registry_map(registry_type):
+                        self.get_variable_id(device_id, entry.variable_name, entry.unit or None)
+            self.connection.commit()
+
+    def __del__(self):
+        """Commit pending readings on destruction"""
+        if self.connection is not None:
+            self.close()
@@ -1,7 +1,9 @@
+import asyncio
 import logging
 from enum import Enum
 from typing import TYPE_CHECKING, Callable
 
+from classes.change_filter import change_filter
 from classes.protocol_settings import (
     Registry_Type,
     protocol_settings,
@@ -62,6 +64,10 @@ class transport_base:
     device_model : str = "hotnoob"
     device_identifier : str = "hotnoob"
     bridge : str = ""
+    ''' csv of transport names to forward reads to; "broadcast" for every other transport '''
+
+    bridges : list[str] = []
+    ''' bridge, split '''
 
     write_enabled : bool = False
     ''' deprecated -- use / move to write_mode'''
@@ -74,6 +80,9 @@ class transport_base:
 
     connected : bool = False
 
+    change_filter : change_filter = None
+    ''' drops unchanged values before they are bridged; None if not configured '''
+
     on_message : Callable[["transport_base", registry_map_entry, str], None] = None
     ''' callback, on message recieved '''
 
@@ -97,6 +106,7 @@ class transport_base:
             self.device_manufacturer = settings.get(["device_manufacturer", "manufacturer"], self.device_manufacturer)
             self.device_name = settings.get(["device_name", "name"], fallback=self.device_manufacturer+"_"+self.device_serial_number)
             self.bridge = settings.get("bridge", self.bridge)
+            self.bridges = [name.strip() for name in self.bridge.split(",") if name.strip()]
             self.read_interval = settings.getfloat("read_interval", self.read_interval)
             self.max_precision = settings.getint(["max_precision", "precision"], fallback=self.max_precision)
             if "write_enabled" in settings or "enable_write" in settings:
@@ -112,16 +122,35 @@ class transport_base:
             #must load after settings
             self.protocol_version = settings.get("protocol_version", fallback='')
             if self.protocol_version:
-                self.protocolSettings = protocol_settings(self.protocol_version, transport_settings=settings)
+                self.protocolSettings = protocol_settings.get(self.protocol_version, transport_settings=settings) #shared by transports using the same protocol
 
                 if self.protocolSettings:
                     self.protocol_version = self.protocolSettings.protocol
 
             #todo, reimplement default settings from protocolsettings
 
+            self.init_change_filter(settings)
+
         self.update_identifier()
 
 
+    def init_change_filter(self, settings : "SectionProxy"):
+        ''' enabled by deadband / max_silence in the transport config, or a deadband column in the registry map '''
+        entries : list[registry_map_entry] = []
+        if self.protocol_version and self.protocolSettings:
+            for registry_map in self.protocolSettings.registry_map.values():
+                entries.extend(entry for entry in registry_map if entry.deadband >= 0)
+
+        deadband = settings.get("deadband", fallback="")
+        max_silence = settings.getfloat("max_silence", fallback=0)
+        if not deadband and not max_silence and not entries:
+            return
+
+        try:
+            self.change_filter = change_filter(deadband, max_silence, entries)
+        except ValueError:
+            self._log.error("Invalid deadband : " + deadband)
+
     def update_identifier(self):
         self.device_identifier = self.device_serial_number.strip().lower()
 
@@ -138,6 +167,10 @@ class transport_base:
     def connect(self):
         pass
 
+    def close(self):
+        ''' called on gateway shutdown; write buffered data and release resources '''
+        pass
+
     def write_data(self, data : dict[str, registry_map_entry], from_transport : "transport_base"):
         ''' general purpose write function for between transports'''
         pass
@@ -156,6 +189,18 @@ class transport_base:
         ''' required for sensitive / manually defined protocols '''
         pass
 
+    #region - asyncio
+    #used by run_mode = asyncio. defaults run the blocking methods in a worker thread; override for native async io
+    async def async_connect(self):
+        await asyncio.to_thread(self.connect)
+
+    async def async_read_data(self) -> dict[str,str]:
+        return await asyncio.to_thread(self.read_data)
+
+    async def async_write_data(self, data : dict[str, str], from_transport : "transport_base"):
+        await asyncio.to_thread(self.write_data, data, from_transport)
+    #endregion
+
     #region - modbus
     #might limit to modbus_base only. not sure; might also apply to future protocols
     def read_registers(self, start, count=1, registry_type : Registry_Type = Registry_Type.INPUT, **kwargs):
@@ -0,0 +1,206 @@
+import json
+import os
+import struct
+import time
+
+import msgpack
+
+
+class write_ahead_log:
+    '''
+    append only log of msgpack records, split into segment files.
+    records are read from a durable cursor and acknowledged once handled; fully acknowledged segments are deleted.
+    a record is a 4 byte little endian length, followed by the msgpack payload
+    '''
+
+    HEADER = struct.Struct("<I")
+
+    path : str
+    ''' folder holding the segments and the cursor '''
+
+    segment_size : int = 4 * 1024 * 1024
+    ''' bytes; a new segment is started once the current one is this large '''
+
+    segment_age : float = 3600
+    ''' seconds; a new segment is started once the current one is this old, so old records can be expired a segment at a time '''
+
+    fsync_interval : float = 5
+    ''' seconds between fsyncs. appends in between are flushed to the os, but can be lost on power loss. 0 = fsync every append '''
+
+    cursor : tuple[int, int]
+    ''' (segment, offset) of the first unacknowledged record '''
+
+    pending : int = 0
+    ''' records after the cursor '''
+
+    def __init__(self, path : str, segment_size : int = segment_size, segment_age : float = segment_age, fsync_interval : float = fsync_interval):
+        self.path = path
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.fsync_interval = fsync_interval
+
+        self.__file = None
+        self.__file_size = 0
+        self.__file_time = 0
+        self.__last_sync = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        self.cursor = self.load_cursor()
+
+        segments = self.get_segments()
+        self.__segment = segments[-1] + 1 if segments else self.cursor[0] #never append to a segment from a previous run; its tail may be torn
+        self.pending = self.read(decode=False)[1]
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def get_segments(self) -> list[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".wal") and name[:-4].isdigit())
+
+    def get_segment_file(self, segment : int) -> str:
+        return os.path.join(self.path, f"{segment:010d}.wal")
+
+    def load_cursor(self) -> tuple[int, int]:
+        file = os.path.join(self.path, "cursor.json")
+        if not os.path.exists(file):
+            return (0, 0)
+
+        with open(file, "r") as f:
+            data = json.load(f)
+        return (data["segment"], data["offset"])
+
+    def save_cursor(self):
+        file = os.path.join(self.path, "cursor.json")
+        with open(file + ".tmp", "w") as f:
+            json.dump({"segment" : self.cursor[0], "offset" : self.cursor[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file + ".tmp", file)
+
+    def append(self, record : dict):
+        data = msgpack.packb(record)
+        now = time.time()
+        if self.__file is None or self.__file_size >= self.segment_size or now - self.__file_time >= self.segment_age:
+            self.rotate()
+
+        self.__file.write(self.HEADER.pack(len(data)) + data)
+        self.__file.flush()
+        self.__file_size += self.HEADER.size + len(data)
+        self.pending += 1
+
+        if now - self.__last_sync >= self.fsync_interval:
+            os.fsync(self.__file.fileno())
+            self.__last_sync = now
+
+    def rotate(self):
+        ''' start a new segment '''
+        if self.__file is not None:
+            self.close()
+            self.__segment += 1
+
+        self.__file = open(self.get_segment_file(self.__segment), "ab")
+        self.__file_size = self.__file.tell()
+        self.__file_time = time.time()
+
+    def sync(self):
+        if self.__file is not None:
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__last_sync = time.time()
+
+    def close(self):
+        if self.__file is not None:
+            self.sync()
+            self.__file.close()
+            self.__file = None
+
+    def scan(self, segment : int, offset : int, count : int = -1, decode : bool = True) -> tuple[list[dict], int, int]:
+        ''' read up to count records of a segment from offset; returns the records, how many were read, and the offset after them '''
+        records = []
+        read = 0
+        with open(self.get_segment_file(segment), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(offset)
+            while count < 0 or read < count:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+
+                length = self.HEADER.unpack(header)[0]
+                if f.tell() + length > size: #torn write
+                    break
+
+                if decode:
+                    try:
+                        records.append(msgpack.unpackb(f.read(length)))
+                    except ValueError:
+                        break
+                else:
+                    f.seek(length, os.SEEK_CUR)
+
+                read += 1
+                offset = f.tell()
+
+        return (records, read, offset)
+
+    def read(self, count : int = -1, decode : bool = True) -> tuple[list[dict], int, tuple[int, int]]:
+        '''
+        read up to count records from the cursor; -1 = all.
+        returns the records ( empty if not decode ), how many were read, and the position after them; pass both to ack() once the records are handled
+        '''
+        records = []
+        read = 0
+        position = self.cursor
+        for segment in self.get_segments():
+            if segment < self.cursor[0]:
+                continue
+
+            offset = self.cursor[1] if segment == self.cursor[0] else 0
+            segment_records, segment_read, offset = self.scan(segment, offset, count - read if count >= 0 else -1, decode)
+            records.extend(segment_records)
+            read += segment_read
+            position = (segment, offset)
+
+            if 0 <= count <= read:
+                break
+
+            if segment != self.__segment: #finished with this segment; continue on the next
+                position = (segment + 1, 0)
+
+        return (records, read, position)
+
+    def ack(self, read : int, position : tuple[int, int]):
+        ''' mark the read records before position as handled '''
+        self.cursor = position
+        self.pending = max(0, self.pending - read)
+        self.save_cursor()
+
+        for segment in self.get_segments():
+            if segment >= self.cursor[0]:
+                break
+            os.remove(self.get_segment_file(segment))
+
+    def skip(self, count : int):
+        ''' drop the count oldest records '''
+        _, read, position = self.read(count, decode=False)
+        self.ack(read, position)
+
+    def expire(self, max_age : float) -> int:
+        ''' drop segments last written more than max_age seconds ago; returns the number of records dropped '''
+        now = time.time()
+        cursor = self.cursor
+        dropped = 0
+        for segment in self.get_segments():
+            if segment < self.cursor[0]:
+                continue
+
+            if segment == self.__segment or now - os.path.getmtime(self.get_segment_file(segment)) < max_age:
+                break
+
+            offset = self.cursor[1] if segment == self.cursor[0] else 0
+            dropped += self.scan(segment, offset, decode=False)[1]
+            self.cursor = (segment + 1, 0)
+
+        if self.cursor != cursor:
+            self.ack(dropped, self.cursor)
+        return dropped
@@ -19,13 +19,19 @@ if sys.version_info < (3, 9):
 
 
 import argparse
+import asyncio
 import logging
 import os
+import queue
+import signal
 import sys
+import threading
 import traceback
 from configparser import ConfigParser, NoOptionError
+from types import MappingProxyType
 
 from classes.protocol_settings import protocol_settings, registry_map_entry
+from classes.read_scheduler import read_scheduler
 from classes.transports.transport_base import transport_base
 from defs.common import strtobool
 
@@ -115,6 +121,30 @@ class Protocol_Gateway:
     __transports : list[transport_base] = []
     ''' transport_base is for type hinting. this can be any transport'''
 
+    __run_mode : str = "sequential"
+    ''' sequential | threaded | asyncio '''
+
+    __schedulers : dict[str, read_scheduler] = {}
+    ''' scheduler owning each transport, by transport name. sleeps until the next read is due; bridge writes wake it early '''
+
+    __main_scheduler : read_scheduler = None
+    ''' sequential mode; reads every transport with a read_interval, on the main thread '''
+
+    __results : queue.Queue = None
+    ''' threaded mode; (transport, info) reads waiting to be bridged '''
+
+    __loop : asyncio.AbstractEventLoop = None
+    ''' asyncio mode; the gateway's event loop '''
+
+    __write_queues : dict[str, asyncio.Queue] = {}
+    ''' asyncio mode; pending (data, from_transport) writes per transport name '''
+
+    __bridges : dict[str, list[transport_base]] = {}
+    ''' destinations for reads, by source transport name '''
+
+    __links : dict[str, list[transport_base]] = {}
+    ''' destinations for messages, by source transport name; bridges in both directions '''
+
     config_file : str
 
     def __init__(self, config_file : str):
@@ -147,6 +177,8 @@ class Protocol_Gateway:
         self.__log.setLevel(log_level)
         logging.basicConfig(level=log_level)
 
+        self.__run_mode = self.__settings.get("general", "run_mode", fallback=self.__run_mode).lower()
+
         for section in self.__settings.sections():
             transport_cfg = self.__settings[section]
             transport_type      = transport_cfg.get("transport", fallback="")
@@ -159,7 +191,7 @@ class Protocol_Gateway:
 
                 if not transport_type and protocol_version: #get transport from protocol settings...  todo need to make a quick function instead of this
 
-                    protocolSettings : protocol_settings = protocol_settings(protocol_version)
+                    protocolSettings : protocol_settings = protocol_settings.get(protocol_version, transport_settings=transport_cfg) #shared with the transport
 
                     if not transport_type and not protocolSettings.transport:
                         raise ValueError("Missing Transport")
@@ -177,27 +209,87 @@ class Protocol_Gateway:
                 transport.on_message = self.on_message
                 self.__transports.append(transport)
 
+        if self.__run_mode == "asyncio": #connect and bridge on the event loop, see async_run
+            return
+
         #connect first
         for transport in self.__transports:
             self.__log.info("Connecting to "+str(transport.type)+":" +str(transport.transport_name)+"...")
             transport.connect()
 
         time.sleep(0.7)
+        self.init_bridges()
+
+        self.__schedulers = {}
+        if self.__run_mode == "threaded":
+            #one scheduler thread per physical port; transports sharing a client ( see modbus_base.clients ) are read sequentially
+            #write only transports get their own thread, so a slow destination does not hold up reads or other destinations
+            self.__results = queue.Queue()
+            port_schedulers : dict[int, read_scheduler] = {}
+            for transport in self.__transports:
+                client = getattr(transport, "client", None)
+                key = id(client) if client is not None else id(transport)
+                if key not in port_schedulers:
+                    port_schedulers[key] = read_scheduler(on_read=lambda transport, info: self.__results.put((transport, info)))
+
+                port_schedulers[key].add(transport)
+                self.__schedulers[transport.transport_name] = port_schedulers[key]
+        else:
+            #sequential; transports are read one after another on the main thread
+            #write only transports get their own thread, so a slow destination does not hold up reads or other destinations
+            self.__main_scheduler = read_scheduler(on_read=self.on_read)
+            for transport in self.__transports:
+                scheduler = self.__main_scheduler if transport.read_interval > 0 else read_scheduler()
+                scheduler.add(transport)
+                self.__schedulers[transport.transport_name] = scheduler
+
+    def init_bridges(self):
         #apply links
-        for to_transport in self.__transports:
-            for from_transport in self.__transports:
-                if to_transport.bridge == from_transport.transport_name:
+        self.__bridges = {transport.transport_name : [] for transport in self.__transports}
+        self.__links = {transport.transport_name : [] for transport in self.__transports}
+
+        for from_transport in self.__transports:
+            for to_transport in self.__transports:
+                if to_transport is from_transport:
+                    continue
+
+                if "broadcast" in from_transport.bridges or to_transport.transport_name in from_transport.bridges:
+                    self.__bridges[from_transport.transport_name].append(to_transport)
                     to_transport.init_bridge(from_transport)
                     from_transport.init_bridge(to_transport)
 
+                    for a, b in ((from_transport, to_transport), (to_transport, from_transport)):
+                        if b not in self.__links[a.transport_name]:
+                            self.__links[a.transport_name].append(b)
+
 
     def on_message(self, transport : transport_base, entry : registry_map_entry, data : str):
         ''' message recieved from a transport! '''
-        for to_transport in self.__transports:
-            if to_transport.transport_name != transport.transport_name:
-                if to_transport.transport_name == transport.bridge or transport.transport_name == to_transport.bridge:
-                    to_transport.write_data({entry.variable_name : data}, transport)
-                    break
+        for to_transport in self.__links.get(transport.transport_name, []):
+            #queue write, so it happens on the read loop instead of concurrently with a read
+            self.queue_write(to_transport, {entry.variable_name : data}, transport)
+
+    def queue_write(self, to_transport : transport_base, data : dict[str, str], from_transport : transport_base):
+        ''' thread safe; queues a write for the scheduler / event loop that owns to_transport '''
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__write_queues[to_transport.transport_name].put_nowait, (data, from_transport))
+        else:
+            self.__schedulers[to_transport.transport_name].queue_write(to_transport, data, from_transport)
+
+    def on_read(self, transport : transport_base, info : dict[str, str]):
+        ''' data read from a transport; forward to bridges. every destination gets the same read only view of info '''
+        if transport.change_filter is not None:
+            info = transport.change_filter.filter(transport.device_identifier, info)
+            if not info:
+                return
+
+        info = MappingProxyType(info) #destinations write concurrently; none can modify what the others see
+
+        for to_transport in self.__bridges.get(transport.transport_name, []):
+            if self.__loop is not None: #asyncio; written by the transport's writer task
+                self.__write_queues[to_transport.transport_name].put_nowait((info, transport))
+            else: #written by the destination's scheduler thread; a slow destination does not hold up the others
+                self.__schedulers[to_transport.transport_name].queue_write(to_transport, info, transport)
 
     def run(self):
         """
@@ -205,38 +297,109 @@ class Protocol_Gateway:
         """
 
         self.__running = True
+        try:
+            self.__run()
+        finally:
+            self.close()
+
+    def __run(self):
+        if self.__run_mode == "asyncio":
+            asyncio.run(self.async_run())
+            return
+
+        #unique schedulers, in order
+        schedulers = list(dict.fromkeys(self.__schedulers.values()))
+
+        for scheduler in schedulers:
+            if scheduler is self.__main_scheduler: #sequential; reads and bridges on this thread, below
+                continue
+            names = ",".join(transport.transport_name for transport in scheduler.transports)
+            thread = threading.Thread(target=scheduler.run, name="read["+names+"]", daemon=True)
+            thread.start()
+
+        if self.__main_scheduler is not None:
+            self.__main_scheduler.run()
+            return
+
+        #bridge results on the main thread, total cycle time is the slowest bus instead of the sum of all buses
+        while self.__running:
+            transport, info = self.__results.get()
+            try:
+                self.on_read(transport, info)
+            except Exception as err:
+                traceback.print_exc()
+                self.__log.error(err)
 
-        if False:
-            self.enable_write()
+    def close(self):
+        ''' shutdown; stops reading and lets every transport write what it has buffered '''
+        self.__running = False
+        for scheduler in dict.fromkeys(self.__schedulers.values()):
+            scheduler.stop()
 
+        for transport in self.__transports:
+            try:
+                transport.close()
+            except Exception as err:
+                traceback.print_exc()
+                self.__log.error(err)
+
+    async def async_run(self):
+        ''' asyncio run mode; every transport gets a read task and a writer task on a single event loop '''
+        self.__loop = asyncio.get_running_loop()
+        self.__write_queues = {transport.transport_name : asyncio.Queue() for transport in self.__transports}
+
+        #connect first
+        for transport in self.__transports:
+            self.__log.info("Connecting to "+str(transport.type)+":" +str(transport.transport_name)+"...")
+
+        await asyncio.gather(*(transport.async_connect() for transport in self.__transports), return_exceptions=True)
+
+        await asyncio.sleep(0.7)
+        self.init_bridges()
+
+        tasks = []
+        for transport in self.__transports:
+            tasks.append(asyncio.create_task(self.__async_write_loop(transport)))
+            if transport.read_interval > 0:
+                tasks.append(asyncio.create_task(self.__async_read_loop(transport)))
+
+        await asyncio.gather(*tasks)
+
+    async def __async_read_loop(self, transport : transport_base):
+        deadline = self.__loop.time()
         while self.__running:
+            delay = deadline - self.__loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
             try:
-                now = time.time()
-                for transport in self.__transports:
-                    if transport.read_interval > 0 and now - transport.last_read_time  > transport.read_interval:
-                        transport.last_read_time = now
-                        #preform read
-                        if not transport.connected:
-                            transport.connect() #reconnect
-                        else: #transport is connected
-
-                            info = transport.read_data()
-
-                            if not info:
-                                continue
-
-                            #todo. broadcast option
-                            if transport.bridge:
-                                for to_transport in self.__transports:
-                                    if to_transport.transport_name == transport.bridge:
-                                        to_transport.write_data(info, transport)
-                                        break
+                transport.last_read_time = time.time()
+                if not transport.connected:
+                    await transport.async_connect() #reconnect
+                else:
+                    info = await transport.async_read_data()
+                    if info:
+                        self.on_read(transport, info)
+            except Exception as err:
+                traceback.print_exc()
+                self.__log.error(err)
+
+            #keep cadence from the deadline; skip missed slots instead of bursting
+            deadline = deadline + transport.read_interval
+            now = self.__loop.time()
+            if deadline <= now:
+                deadline = now + transport.read_interval
 
+    async def __async_write_loop(self, transport : transport_base):
+        write_queue = self.__write_queues[transport.transport_name]
+        while self.__running:
+            data, from_transport = await write_queue.get()
+            try:
+                await transport.async_write_data(data, from_transport)
             except Exception as err:
                 traceback.print_exc()
                 self.__log.error(err)
 
-            time.sleep(0.07) #change this in future. probably reduce to allow faster reads.
 
 
 
@@ -265,6 +428,14 @@ def main(args=None):
 
     print(__logo)
 
+    #service managers and docker stop with SIGTERM; exit through the shutdown path, so buffered data is written
+    def on_signal(signum, frame):
+        raise SystemExit(128 + signum)
+
+    for name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, name): #not on windows
+            signal.signal(getattr(signal, name), on_signal)
+
     ppg = Protocol_Gateway(args.config)
     ppg.run()
 
@@ -0,0 +1,69 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.protocol_settings import (  # noqa: E402
+    Data_Type,
+    Registry_Type,
+    WriteMode,
+    protocol_settings,
+    registry_map_entry,
+)
+from classes.registry_image import registry_image  # noqa: E402
+from protocol_gateway import CustomConfigParser as ConfigParser  # noqa: E402
+
+
+@pytest.fixture
+def make_config():
+    ''' **settings => transport section, as read from the config file '''
+    def make_config(section : str = "transport.test", **settings):
+        config = ConfigParser()
+        config.read_dict({section : settings})
+        return config[section]
+    return make_config
+
+
+@pytest.fixture
+def make_transport(make_config):
+    ''' transport_class, **settings => transport; section transport.<class name> '''
+    def make_transport(transport_class : type, **settings):
+        name = transport_class.__name__
+        return transport_class(make_config("transport." + name, **{"transport" : name, **settings}))
+    return make_transport
+
+
+@pytest.fixture
+def make_source():
+    ''' a reading transport, as seen by the output transports '''
+    def make_source(**attributes) -> SimpleNamespace:
+        return SimpleNamespace(**{"transport_name" : "modbus", "device_identifier" : "abc", "device_name" : "inverter",
+                                  "device_manufacturer" : "growatt", "device_model" : "spf", "device_serial_number" : "abc",
+                                  "write_enabled" : False, "protocolSettings" : protocol_settings("v0.14"), **attributes})
+    return make_source
+
+
+@pytest.fixture
+def make_entry():
+    ''' register => input registry_map_entry named reg_<register> '''
+    def make_entry(register : int, data_type : Data_Type = Data_Type.USHORT, write_mode : WriteMode = WriteMode.READ, **attributes) -> registry_map_entry:
+        return registry_map_entry(**{"registry_type" : Registry_Type.INPUT, "register" : register, "register_bit" : 0, "register_byte" : 0,
+                                     "variable_name" : "reg_"+str(register), "documented_name" : "reg_"+str(register),
+                                     "unit" : "", "unit_mod" : 1, "concatenate" : False, "concatenate_registers" : [], "values" : [],
+                                     "data_type" : data_type, "write_mode" : write_mode, **attributes})
+    return make_entry
+
+
+@pytest.fixture
+def make_image():
+    ''' dict[register, value] => registry_image '''
+    def make_image(registry : dict[int, int]) -> registry_image:
+        image = registry_image()
+        for register, value in registry.items():
+            image.set(register, value)
+        return image
+    return make_image
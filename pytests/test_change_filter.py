@@ -0,0 +1,47 @@
+import os
+import sys
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.change_filter import change_filter
+from classes.protocol_settings import Registry_Type, registry_map_entry
+
+
+def make_entry(name : str, deadband : float, percent : bool = False) -> registry_map_entry:
+    return registry_map_entry(registry_type=Registry_Type.INPUT, register=0, register_bit=0, register_byte=0,
+                              variable_name=name, documented_name=name, unit="", unit_mod=1,
+                              concatenate=False, concatenate_registers=[], values=[],
+                              deadband=deadband, deadband_percent=percent)
+
+
+def test_forwards_changes_only():
+    changes = change_filter()
+    assert changes.filter("sn1", {"a" : 1.0, "b" : "on"}) == {"a" : 1.0, "b" : "on"}
+    assert changes.filter("sn1", {"a" : 1.0, "b" : "on"}) == {}
+    assert changes.filter("sn1", {"a" : 1.5, "b" : "on"}) == {"a" : 1.5}
+    #keyed by device
+    assert changes.filter("sn2", {"a" : 1.5}) == {"a" : 1.5}
+
+
+def test_deadbands():
+    changes = change_filter("0.5", entries=[make_entry("soc", 10, percent=True)])
+    changes.filter("sn", {"voltage" : 50.0, "soc" : 80.0})
+
+    assert changes.filter("sn", {"voltage" : 50.4, "soc" : 87.0}) == {}
+    #compared to the last forwarded value, so slow drift is still forwarded
+    assert changes.filter("sn", {"voltage" : 50.8, "soc" : 89.0}) == {"voltage" : 50.8, "soc" : 89.0}
+
+
+def test_max_silence_forces_forward():
+    changes = change_filter(max_silence=60)
+    changes.filter("sn", {"a" : 1})
+    assert changes.filter("sn", {"a" : 1}) == {}
+
+    changes.last[("sn", "a")] = (1, changes.last[("sn", "a")][1] - 61)
+    assert changes.filter("sn", {"a" : 1}) == {"a" : 1}
+
+
+def test_parse_deadband():
+    assert change_filter.parse_deadband("0.5") == (0.5, False)
+    assert change_filter.parse_deadband(" 2% ") == (2.0, True)
@@ -0,0 +1,81 @@
+import glob
+import json
+import os
+import random
+import sys
+
+import pytest
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.protocol_settings import Registry_Type, protocol_settings
+
+search_pattern = os.path.join("protocols", "**", "*.json")
+files = glob.glob(search_pattern, recursive=True)
+protocols = [os.path.splitext(os.path.basename(f))[0] for f in files]
+
+fixtures_file = os.path.join(os.path.dirname(__file__), "fixtures", "decoded_registries.json")
+''' recorded process_registery results; values are repr()s, so bytes, floats and ints compare exactly. re-record with: python pytests/test_decoder_plan.py '''
+
+
+def make_registries(protocol : str, settings : protocol_settings) -> dict[str, tuple]:
+    ''' deterministic test registries per protocol; name => (map, registry) '''
+    rand = random.Random(protocol)
+    registries = {}
+    for registry_type in (Registry_Type.INPUT, Registry_Type.HOLDING):
+        map = settings.registry_map.get(registry_type)
+        if not map or isinstance(map[0].register, str):
+            continue
+
+        size = max(entry.register for entry in map) + 2
+        name = registry_type.name.lower()
+        #sign bits, codes and flags
+        registries[name + "/edges"] = (map, {register : rand.choice((0, 1, 2, 3, 0x8000, 0xFFFF)) for register in range(size)})
+        #missing registers and 32 bit values without their second register
+        registries[name + "/partial"] = (map, {register : rand.randrange(0, 0x10000) for register in range(size) if rand.random() < 0.7})
+
+    return registries
+
+
+def decode(settings : protocol_settings, map : list, registry) -> dict[str, str]:
+    return {name : repr(value) for name, value in settings.process_registery(registry, map).items()}
+
+
+def load_fixtures() -> dict[str, dict[str, dict[str, str]]]:
+    with open(fixtures_file) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("protocol", protocols)
+def test_decoded_registries_match_fixtures(protocol : str, make_image):
+    settings = protocol_settings(protocol)
+    expected = load_fixtures()[protocol]
+
+    registries = make_registries(protocol, settings)
+    assert set(registries) == set(expected)
+    for name, (map, registry) in registries.items():
+        assert decode(settings, map, registry) == expected[name]
+        assert decode(settings, map, make_image(registry)) == expected[name]
+
+
+@pytest.mark.parametrize("protocol", protocols)
+def test_vectorized_decoding_matches_fixtures(protocol : str, make_config, make_image):
+    pytest.importorskip("numpy")
+
+    vectorized = protocol_settings(protocol, transport_settings=make_config(vectorized_decoding="true"))
+    expected = load_fixtures()[protocol]
+
+    for name, (map, registry) in make_registries(protocol, vectorized).items():
+        assert decode(vectorized, map, registry) == expected[name]
+        assert decode(vectorized, map, make_image(registry)) == expected[name]
+
+
+if __name__ == "__main__": #record fixtures; only after a deliberate change to decoding
+    fixtures = {}
+    for protocol in sorted(protocols):
+        settings = protocol_settings(protocol)
+        fixtures[protocol] = {name : decode(settings, map, registry) for name, (map, registry) in make_registries(protocol, settings).items()}
+
+    with open(fixtures_file, "w") as f:
+        json.dump(fixtures, f, indent=0, sort_keys=True)
@@ -0,0 +1,109 @@
+import gzip
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.influxdb_http_client import influxdb_http_client
+from classes.transports.influxdb_out import influxdb_out
+from protocol_gateway import CustomConfigParser as ConfigParser
+
+
+class influxdb_stand_in(BaseHTTPRequestHandler):
+    ''' records requests; answers like influxdb '''
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status : int, body : bytes = b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path, dict(self.headers), b""))
+        if self.path.startswith("/query"):
+            self.reply(200, json.dumps({"results" : [{"series" : [{"values" : [["_internal"]]}]}]}).encode())
+        else:
+            self.reply(204)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        self.server.requests.append(("POST", self.path, dict(self.headers), body))
+        self.reply(self.server.status if self.path.startswith(("/write", "/api/v2/write")) else 200)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), influxdb_stand_in)
+    server.requests = []
+    server.status = 204
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_line_protocol_encoding():
+    client = influxdb_http_client("localhost", 8086, "solar")
+    point = {"measurement" : "device data", "tags" : {"serial" : "A,B=1", "model" : "spf 5000", "empty" : ""},
+             "fields" : {"voltage" : 48.5, "soc" : 80, "status" : 'say "hi"', "nan" : float("nan"), "on" : True},
+             "time" : 1700000000000000000}
+    assert client.encode_point(point) == 'device\\ data,model=spf\\ 5000,serial=A\\,B\\=1 voltage=48.5,soc=80i,status="say \\"hi\\"",on=true 1700000000000000000'
+    assert client.encode_point({"measurement" : "m", "tags" : {}, "fields" : {"nan" : float("nan")}}) is None
+
+    #escaped series is cached per measurement and tags
+    client.encode_point(point)
+    assert len(client.series) == 1
+
+
+def test_v1_write_with_gzip(server):
+    client = influxdb_http_client("127.0.0.1", server.server_port, "solar", username="user", password="pass", gzip=True)
+    client.ping()
+    assert client.get_list_database() == [{"name" : "_internal"}]
+    client.create_database("solar")
+    client.write_points([{"measurement" : "m", "tags" : {"device" : "abc"}, "fields" : {"v" : 1.5}, "time" : 1},
+                         {"measurement" : "m", "tags" : {"device" : "abc"}, "fields" : {"v" : 2.5}, "time" : 2}])
+
+    method, path, headers, body = server.requests[-1]
+    assert path == "/write?db=solar&precision=ns"
+    assert headers["Authorization"].startswith("Basic ")
+    assert body == b"m,device=abc v=1.5 1\nm,device=abc v=2.5 2"
+    assert server.requests[-2][1].startswith("/query?q=CREATE+DATABASE")
+
+
+def test_v2_write_and_errors(server):
+    client = influxdb_http_client("127.0.0.1", server.server_port, version=2, org="home", bucket="solar", token="secret")
+    client.write_points([{"measurement" : "m", "tags" : {}, "fields" : {"v" : 1}}])
+
+    method, path, headers, body = server.requests[-1]
+    assert path == "/api/v2/write?org=home&bucket=solar&precision=ns"
+    assert headers["Authorization"] == "Token secret"
+    assert body == b"m v=1i"
+
+    server.status = 400
+    with pytest.raises(RuntimeError):
+        client.write_points([{"measurement" : "m", "tags" : {}, "fields" : {"v" : 1}}])
+
+
+def test_influxdb_out_http_writer(server):
+    config = ConfigParser()
+    config.read_dict({"influxdb_output" : {"transport" : "influxdb_out", "host" : "127.0.0.1", "port" : str(server.server_port),
+                                           "writer" : "http", "enable_persistent_storage" : "false"}})
+    transport = influxdb_out(config["influxdb_output"])
+    transport.connect()
+    assert transport.connected
+
+    transport.batch_points = [{"measurement" : "device_data", "tags" : {"transport" : "modbus"}, "fields" : {"battery_voltage" : 48.5}, "time" : 5}]
+    transport._flush_batch()
+    assert server.requests[-1][3] == b"device_data,transport=modbus battery_voltage=48.5 5"
@@ -3,12 +3,14 @@
 Test for InfluxDB output transport
 """
 
+import tempfile
 import time
 import unittest
-from protocol_gateway import CustomConfigParser as ConfigParser
 from unittest.mock import MagicMock, Mock, patch
 
+from classes.protocol_settings import Registry_Type
 from classes.transports.influxdb_out import influxdb_out
+from protocol_gateway import CustomConfigParser as ConfigParser
 
 
 class TestInfluxDBOut(unittest.TestCase):
@@ -43,7 +45,8 @@ class TestInfluxDBOut(unittest.TestCase):
             username=None,
             password=None,
             database='test_db',
-            timeout=10
+            timeout=10,
+            gzip=False
         )
 
     @patch('classes.transports.influxdb_out.InfluxDBClient')
@@ -105,6 +108,95 @@ class TestInfluxDBOut(unittest.TestCase):
         self.assertEqual(point['fields']['battery_voltage'], 48.5)
         self.assertEqual(point['fields']['battery_current'], 10.2)
 
+    @patch('classes.transports.influxdb_out.InfluxDBClient')
+    def test_backlog_survives_restart(self, mock_influxdb_client):
+        """Test points stored while disconnected are written once after a restart"""
+        mock_client = Mock()
+        mock_influxdb_client.return_value = mock_client
+        mock_client.get_list_database.return_value = [{'name': 'test_db'}]
+
+        with tempfile.TemporaryDirectory() as path:
+            self.config.set('influxdb_output', 'persistent_storage_path', path)
+
+            transport = influxdb_out(self.config['influxdb_output'])
+            for i in range(5):
+                transport._add_to_backlog({'measurement': 'device_data', 'tags': {}, 'fields': {'value': float(i)}})
+            transport.backlog.close()
+
+            transport = influxdb_out(self.config['influxdb_output'])
+            self.assertEqual(len(transport.backlog), 5)
+            transport.connect()
+
+            points = mock_client.write_points.call_args.args[0]
+            self.assertEqual([point['fields']['value'] for point in points], [0.0, 1.0, 2.0, 3.0, 4.0])
+            self.assertNotIn('_backlog_time', points[0])
+            self.assertEqual(len(transport.backlog), 0)
+
+            transport = influxdb_out(self.config['influxdb_output'])
+            self.assertEqual(len(transport.backlog), 0)
+
+    @patch('classes.transports.influxdb_out.InfluxDBClient')
+    def test_backlog_replay_chunks(self, mock_influxdb_client):
+        """Test backlog replay is chunked, resumes after a failed chunk, and honours the replay interval"""
+        mock_client = Mock()
+        mock_influxdb_client.return_value = mock_client
+        mock_client.get_list_database.return_value = [{'name': 'test_db'}]
+
+        with tempfile.TemporaryDirectory() as path:
+            self.config.set('influxdb_output', 'persistent_storage_path', path)
+            self.config.set('influxdb_output', 'backlog_replay_chunk_size', '4')
+
+            transport = influxdb_out(self.config['influxdb_output'])
+            for i in range(10):
+                transport._add_to_backlog({'measurement': 'device_data', 'tags': {}, 'fields': {'value': float(i)}})
+
+            # second chunk fails; the first stays acknowledged
+            mock_client.write_points.side_effect = [None, Exception("timeout")]
+            transport.connect()
+            self.assertEqual(len(transport.backlog), 6)
+
+            mock_client.write_points.side_effect = None
+            mock_client.write_points.reset_mock()
+            transport._flush_backlog()
+            chunks = [[point['fields']['value'] for point in call.args[0]] for call in mock_client.write_points.call_args_list]
+            self.assertEqual(chunks, [[4.0, 5.0, 6.0, 7.0], [8.0, 9.0]])
+            self.assertEqual(len(transport.backlog), 0)
+
+            # rate limited; one chunk per interval
+            transport.backlog_replay_interval = 60
+            transport.last_backlog_replay = 0
+            for i in range(10):
+                transport._add_to_backlog({'measurement': 'device_data', 'tags': {}, 'fields': {'value': float(i)}})
+            mock_client.write_points.reset_mock()
+            transport._flush_backlog()
+            transport._flush_backlog()
+            self.assertEqual(mock_client.write_points.call_count, 1)
+            self.assertEqual(len(transport.backlog), 6)
+
+    def test_field_schema(self):
+        """Test field types and tags come from the schema built in init_bridge"""
+        self.config.set('influxdb_output', 'force_float', 'false')
+        self.config.set('influxdb_output', 'tag_variables', 'serial_number')
+        self.config.set('influxdb_output', 'enable_persistent_storage', 'false')
+        transport = influxdb_out(self.config['influxdb_output'])
+
+        source_transport = Mock()
+        source_transport.transport_name = 'test_source'
+        scaled = Mock(variable_name='battery_voltage', unit_mod=0.1)
+        whole = Mock(variable_name='battery_soc', unit_mod=1.0)
+        source_transport.protocolSettings.get_registry_map.side_effect = lambda registry_type: [scaled, whole] if registry_type == Registry_Type.INPUT else []
+        transport.init_bridge(source_transport)
+
+        point = transport._create_influxdb_point({'battery_voltage': 48.0, 'battery_soc': 80, 'serial_number': 'ABC', 'other': '1.5', 'status': 'Normal'}, source_transport)
+        self.assertEqual(point['fields'], {'battery_voltage': 48.0, 'battery_soc': 80, 'other': 1.5, 'status': 'Normal'})
+        self.assertIsInstance(point['fields']['battery_voltage'], float)
+        self.assertIsInstance(point['fields']['battery_soc'], int)
+        self.assertEqual(point['tags']['serial_number'], 'ABC')
+
+        # the registry maps are only scanned when the schema is built
+        transport._create_influxdb_point({'battery_voltage': 48.1}, source_transport)
+        self.assertEqual(source_transport.protocolSettings.get_registry_map.call_count, 2)
+
     def test_configuration_options(self):
         """Test configuration option parsing"""
         # Add more configuration options
@@ -0,0 +1,84 @@
+import glob
+import gzip
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.transports.json_out import json_out
+from protocol_gateway import CustomConfigParser as ConfigParser
+
+source = SimpleNamespace(transport_name="modbus", device_identifier="abc", device_name="inverter", device_manufacturer="growatt",
+                         device_model="spf", device_serial_number="abc")
+
+
+def make_transport(output_file : str, **settings) -> json_out:
+    config = ConfigParser()
+    config.read_dict({"transport.json" : {"transport" : "json_out", "output_file" : output_file, "ndjson" : "true", **settings}})
+    transport = json_out(config["transport.json"])
+    transport.connect()
+    return transport
+
+
+def read_lines(file : str) -> list[dict]:
+    opener = gzip.open if file.endswith(".gz") else open
+    with opener(file, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_ndjson_buffers_until_close(tmp_path):
+    file = str(tmp_path / "data.json")
+    transport = make_transport(file, include_device_info="false", flush_interval="60")
+    for i in range(5):
+        transport.write_data({"value" : i}, source)
+
+    transport.close()
+    records = read_lines(file)
+    assert [record["data"]["value"] for record in records] == [0, 1, 2, 3, 4]
+    assert "device" not in records[0]
+
+
+def test_ndjson_rotates_and_compresses(tmp_path):
+    file = str(tmp_path / "data.json")
+    transport = make_transport(file, buffer_size="1", rotate_size="200", compression="gzip")
+    for i in range(20):
+        transport.write_data({"value" : i}, source)
+    transport.close()
+
+    rotated = sorted(glob.glob(str(tmp_path / "data.*.json.gz")))
+    assert rotated
+    assert not glob.glob(str(tmp_path / "data.*.json"))
+
+    values = [record["data"]["value"] for rotated_file in rotated for record in read_lines(rotated_file)]
+    values += [record["data"]["value"] for record in read_lines(file)] if os.path.getsize(file) else []
+    assert sorted(values) == list(range(20))
+
+
+def test_ndjson_writer_survives_bad_records(tmp_path):
+    file = str(tmp_path / "data.json")
+    transport = make_transport(file, include_device_info="false", flush_interval="0")
+    assert transport.flush_interval > 0
+
+    transport.write_data({"value" : b"\xff"}, source) #ascii decode failures are bytes
+    transport.write_data({("not", "a", "key") : 1}, source)
+    transport.write_data({"value" : 2}, source)
+    transport.close()
+
+    assert [record["data"]["value"] for record in read_lines(file)] == ["b'\\xff'", 2]
+
+
+def test_ndjson_rotate_failure_keeps_writing(tmp_path, monkeypatch):
+    file = str(tmp_path / "data.json")
+    transport = make_transport(file, buffer_size="1", rotate_size="1")
+
+    def fail(*args):
+        raise OSError("read-only")
+    monkeypatch.setattr(os, "replace", fail)
+    transport.write_data({"value" : 1}, source)
+    transport.write_data({"value" : 2}, source)
+    transport.close()
+
+    assert [record["data"]["value"] for record in read_lines(file)] == [1, 2]
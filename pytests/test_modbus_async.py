@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock, Mock
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.transports.modbus_base import modbus_base
+from protocol_gateway import CustomConfigParser as ConfigParser
+
+
+class stub_modbus(modbus_base):
+    ''' modbus transport with a mock blocking client and a mock async client '''
+    def __init__(self, settings):
+        self.client = Mock()
+        self.client.connect.return_value = True
+        self.async_client_mock = Mock(connected=False)
+        self.async_client_mock.connect = AsyncMock(return_value=True)
+        super().__init__(settings)
+
+    def connect(self):
+        self.connected = self.client.connect()
+        super().connect()
+
+    def init_after_connect(self):
+        pass
+
+    def create_async_client(self):
+        return self.async_client_mock
+
+
+def make_transport() -> stub_modbus:
+    config = ConfigParser()
+    config.read_dict({"transport.modbus" : {"transport" : "modbus_rtu", "protocol_version" : "v0.14", "serial_number" : "ABC",
+                                            "batch_delay" : "0", "learn_holes" : "false"}})
+    return stub_modbus(config["transport.modbus"])
+
+
+def test_reconnect_only_reopens_the_async_client():
+    transport = make_transport()
+    try:
+        asyncio.run(transport.async_connect())
+        transport.client.connect.assert_called_once()
+        transport.client.close.assert_called_once() #async client holds the port
+        transport.async_client_mock.connect.assert_awaited_once()
+
+        #connection lost
+        transport.async_client_mock.connected = False
+        transport.connected = False
+        asyncio.run(transport.async_connect())
+        transport.client.connect.assert_called_once() #blocking client not reopened
+        assert transport.async_client_mock.connect.await_count == 2
+        assert transport.connected
+    finally:
+        modbus_base.async_clients.pop(id(transport.client), None)
+        modbus_base.bus_locks.pop(id(transport.client), None)
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.protocol_settings import Registry_Type
+from classes.transports.modbus_base import modbus_base
+
+HOLE = 5
+
+
+class stub_modbus(modbus_base):
+    ''' modbus device without register HOLE; rejects any read that includes it with illegal address '''
+    def __init__(self, settings):
+        self.requests : list[tuple[int, int]] = []
+        super().__init__(settings)
+
+    def read_registers(self, start, count=1, registry_type=Registry_Type.INPUT, **kwargs):
+        self.requests.append((start, count))
+        if start <= HOLE < start + count:
+            return SimpleNamespace(exception_code=self.ILLEGAL_ADDRESS, isError=lambda: True)
+        return SimpleNamespace(registers=[100 + register for register in range(start, start + count)], isError=lambda: False)
+
+
+@pytest.fixture
+def make_modbus(make_transport, tmp_path):
+    def make_modbus() -> stub_modbus:
+        transport = make_transport(stub_modbus, transport="modbus_rtu", protocol_version="v0.14", serial_number="ABC",
+                                   holes_path=str(tmp_path), batch_delay="0")
+        transport.update_identifier()
+        return transport
+    return make_modbus
+
+
+def test_hole_is_isolated_and_persisted(tmp_path, make_modbus):
+    transport = make_modbus()
+    registry = transport.read_modbus_registers(ranges=[(0, 8)])
+
+    #bisected down to the rejected register; its neighbours are still read
+    assert HOLE not in registry
+    assert dict(registry.items()) == {register : 100 + register for register in range(8) if register != HOLE}
+    assert (HOLE, 1) in transport.requests
+    assert transport.get_holes(Registry_Type.INPUT) == {HOLE}
+
+    #written to holes_path, and read back by a new transport
+    assert json.loads(open(transport.holes_file).read()) == {"input" : [HOLE]}
+    assert os.path.dirname(transport.holes_file) == str(tmp_path)
+
+    transport = make_modbus()
+    assert transport.get_holes(Registry_Type.INPUT) == {HOLE}
+    assert transport.get_holes(Registry_Type.HOLDING) == set()
+
+
+def test_async_reader_saves_holes_off_the_event_loop(make_modbus):
+    transport = make_modbus()
+    save_holes = transport.save_holes
+    threads = []
+    def record_save_holes():
+        threads.append(threading.current_thread())
+        save_holes()
+    transport.save_holes = record_save_holes
+
+    registry = asyncio.run(transport.async_read_modbus_registers(ranges=[(0, 8)]))
+    assert HOLE not in registry
+    assert threads and threading.main_thread() not in threads
+    assert json.loads(open(transport.holes_file).read()) == {"input" : [HOLE]}
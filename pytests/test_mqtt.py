@@ -0,0 +1,233 @@
+import json
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from paho.mqtt.client import MQTT_ERR_NO_CONN, topic_matches_sub
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.protocol_settings import protocol_settings
+from classes.transports.mqtt import mqtt
+from protocol_gateway import CustomConfigParser as ConfigParser
+
+
+def make_transport(queue_size : int, **settings) -> mqtt:
+    config = ConfigParser()
+    config.read_dict({"transport.mqtt" : {"transport" : "mqtt", "host" : "localhost", "user" : "test", "pass" : "test",
+                                          "base_topic" : "home", "publish_queue_size" : str(queue_size), **settings}})
+    transport = mqtt(config["transport.mqtt"])
+    transport.client = Mock()
+    transport.client.publish.return_value.rc = 0
+    return transport
+
+
+def test_publish_queue_coalesces_and_drops_oldest():
+    transport = make_transport(2)
+
+    transport.publish("home/a", "1")
+    transport.publish("home/b", "1")
+    transport.publish("home/a", "2")
+    assert list(transport.publish_queue.items()) == [("home/a", ("2", 0, False, None)), ("home/b", ("1", 0, False, None))]
+    assert transport.publish_stats["coalesced"] == 1
+
+    transport.publish("home/c", "1")
+    assert list(transport.publish_queue) == ["home/b", "home/c"]
+    assert transport.publish_stats["dropped"] == 1
+    transport.client.publish.assert_not_called()
+
+
+def test_publish_loop_drains_queue():
+    transport = make_transport(100)
+    transport.connected = True
+    transport.client.is_connected.return_value = True
+
+    transport.publish("home/a", "1", retain=True)
+    transport.publish("home/b", "2")
+    threading.Thread(target=transport.publish_loop, daemon=True).start()
+
+    for _ in range(100):
+        if transport.publish_stats["published"] == 2:
+            break
+        time.sleep(0.01)
+
+    assert transport.publish_stats["published"] == 2
+    assert transport.get_publish_queue_depth() == 0
+    transport.client.publish.assert_any_call("home/a", "1", 0, retain=True, properties=None)
+    transport.client.publish.assert_any_call("home/b", "2", 0, retain=False, properties=None)
+
+
+def test_publish_loop_survives_publish_errors():
+    transport = make_transport(100)
+    transport.connected = True
+    transport.client.is_connected.return_value = True
+
+    def publish(topic, *args, **kwargs):
+        if "#" in topic:
+            raise ValueError("Publish topic cannot contain wildcards.")
+        return Mock(rc=0)
+    transport.client.publish.side_effect = publish
+
+    transport.publish("home/#", "1")
+    transport.publish("home/b", "2")
+    threading.Thread(target=transport.publish_loop, daemon=True).start()
+
+    for _ in range(100):
+        if transport.publish_stats["published"] == 1:
+            break
+        time.sleep(0.01)
+    assert transport.publish_stats["failed"] == 1
+
+    #still running
+    transport.publish("home/c", "3")
+    for _ in range(100):
+        if transport.publish_stats["published"] == 2:
+            break
+        time.sleep(0.01)
+    assert transport.publish_stats["published"] == 2
+
+
+def test_publish_loop_requeues_when_disconnected():
+    transport = make_transport(100)
+    transport.connected = True
+    transport.client.is_connected.return_value = False
+
+    sent = []
+    def publish(topic, payload, *args, **kwargs):
+        if not transport.client.is_connected.return_value:
+            return Mock(rc=MQTT_ERR_NO_CONN)
+        sent.append((topic, payload))
+        return Mock(rc=0)
+    transport.client.publish.side_effect = publish
+
+    transport.publish("home/a", "1")
+    transport.publish("home/b", "2")
+    threading.Thread(target=transport.publish_loop, daemon=True).start()
+
+    for _ in range(100):
+        if not transport.connected:
+            break
+        time.sleep(0.01)
+    assert transport.publish_stats["published"] == 0
+    assert transport.publish_stats["requeued"] == 2
+
+    transport.publish("home/a", "3") #newer value while requeued
+    transport.client.is_connected.return_value = True
+    for _ in range(300):
+        if transport.publish_stats["published"] == 2:
+            break
+        time.sleep(0.01)
+    assert sent == [("home/a", "3"), ("home/b", "2")]
+    assert transport.get_publish_queue_depth() == 0
+
+
+def test_publish_queue_disabled_publishes_directly():
+    transport = make_transport(0)
+    transport.publish("home/a", "1")
+    transport.client.publish.assert_called_once_with("home/a", "1", 0, retain=False, properties=None)
+    assert not transport.publish_queue
+
+
+def test_write_data_uses_topic_table_and_field_precision():
+    transport = make_transport(0)
+    source = SimpleNamespace(transport_name="modbus", device_identifier="ABC", write_enabled=False, protocolSettings=protocol_settings("v0.14"))
+    transport.init_bridge(source)
+
+    transport.write_data({"pv1_voltage" : 230.10000000000002, "grid_hz" : 50.019999999999996, "battery_soc" : 80, "Extra" : 1.23456}, source)
+    transport.client.publish.assert_any_call("home/abc/pv1_voltage", "230.1", 0, retain=False, properties=None)
+    transport.client.publish.assert_any_call("home/abc/grid_hz", "50.02", 0, retain=False, properties=None)
+    transport.client.publish.assert_any_call("home/abc/battery_soc", "80", 0, retain=False, properties=None)
+    transport.client.publish.assert_any_call("home/abc/extra", "1.23", 0, retain=False, properties=None)
+
+
+def test_write_data_compact_json():
+    transport = make_transport(0, json="true", json_compact="true")
+    source = SimpleNamespace(transport_name="modbus", device_identifier="ABC", write_enabled=False, protocolSettings=protocol_settings("v0.14"))
+    transport.init_bridge(source)
+
+    transport.write_data({"pv1_voltage" : 230.10000000000002, "battery_soc" : 80}, source)
+    payload = transport.client.publish.call_args.args[1]
+    assert payload == '{"pv1_voltage":230.1,"battery_soc":80}'
+    assert json.loads(payload) == {"pv1_voltage" : 230.1, "battery_soc" : 80}
+
+
+def test_discovery_skips_unchanged_configs(tmp_path):
+    transport = make_transport(0, discovery_cache_path=str(tmp_path), discovery_inflight="4")
+    transport.discovery_retained_wait = 0.01
+    transport.client.is_connected.return_value = True
+    transport.client.publish.return_value.is_published.return_value = True
+    source = SimpleNamespace(transport_name="modbus", device_identifier="ABC", write_enabled=False, protocolSettings=protocol_settings("v0.14"),
+                             device_manufacturer="growatt", device_model="spf", device_serial_number="ABC", device_name="inverter")
+
+    #broker holding the retained configs; delivered to the discovery callback on subscribe
+    broker : dict[str, bytes] = {}
+    def publish(topic, payload, qos=0, retain=False, properties=None):
+        if retain:
+            broker[topic] = payload.encode("utf-8")
+        return transport.client.publish.return_value
+    def subscribe(topic_filter):
+        assert transport.client.message_callback_add.call_args.args[0] == topic_filter
+        callback = transport.client.message_callback_add.call_args.args[1]
+        for topic, payload in broker.items():
+            if not topic_matches_sub(topic_filter, topic):
+                continue
+            callback(transport.client, None, SimpleNamespace(topic=topic, payload=payload, retain=True))
+    transport.client.publish.side_effect = publish
+    transport.client.subscribe.side_effect = subscribe
+
+    def published_configs():
+        return [call for call in transport.client.publish.call_args_list if call.args[0].endswith("/config")]
+
+    transport.publish_discovery(source)
+    configs = published_configs()
+    assert configs
+    assert len(json.loads((tmp_path / "transport.mqtt_ABC.json").read_text())) == len(configs)
+    transport.client.subscribe.assert_not_called() #nothing cached yet
+
+    transport.client.publish.reset_mock()
+    transport.publish_discovery(source)
+    assert not published_configs()
+    transport.client.message_callback_remove.assert_called_once()
+
+    broker.clear() #broker restarted without persistence
+    transport.client.publish.reset_mock()
+    transport.publish_discovery(source)
+    assert len(published_configs()) == len(configs)
+
+    source.device_name = "renamed"
+    transport.client.publish.reset_mock()
+    transport.publish_discovery(source)
+    assert len(published_configs()) == len(configs)
+
+
+def test_discovery_rechecked_on_reconnect():
+    transport = make_transport(0)
+    transport.mqtt_discovery = Mock()
+    source = SimpleNamespace(transport_name="modbus")
+
+    transport.on_connect(transport.client, None, None, 0)
+    transport.mqtt_discovery.assert_not_called() #discovery not published yet
+
+    transport.discovery_transports[source.transport_name] = source
+    transport.on_connect(transport.client, None, None, 0)
+    transport.mqtt_discovery.assert_called_once_with(source)
+    assert not transport.discovery_transports #re-added once discovery completes
+
+
+def test_discovery_waits_for_connection():
+    transport = make_transport(0, discovery_timeout="0.01")
+    transport.client.is_connected.return_value = False
+    transport.mqtt_discovery = Mock()
+    source = SimpleNamespace(transport_name="modbus", device_serial_number="ABC")
+
+    transport.publish_discovery(source) #gives up instead of waiting forever
+    transport.client.publish.assert_not_called()
+    assert transport.discovery_transports == {"modbus" : source}
+
+    transport.client.is_connected.return_value = True
+    transport.on_connect(transport.client, None, None, 0)
+    transport.mqtt_discovery.assert_called_once_with(source)
@@ -0,0 +1,73 @@
+import glob
+import os
+import sys
+import time
+
+import pytest
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+pyarrow = pytest.importorskip("pyarrow")
+parquet = pytest.importorskip("pyarrow.parquet")
+
+from classes.protocol_settings import protocol_settings  # noqa: E402
+from classes.transports import parquet_out as parquet_out_module  # noqa: E402
+from classes.transports.parquet_out import parquet_out  # noqa: E402
+
+
+def test_rows_are_written_with_the_protocol_schema(tmp_path, make_transport, make_source):
+    transport = make_transport(parquet_out, output_path=str(tmp_path), batch_rows="2", max_rows="5")
+    transport.connect()
+
+    source = make_source()
+    transport.init_bridge(source)
+
+    for i in range(7):
+        transport.write_data({"pv1_voltage" : 230.1 + i, "battery_soc" : 80.0, "system_status" : "Normal", "extra" : i}, source)
+    transport.flush_all()
+
+    files = sorted(glob.glob(str(tmp_path / "abc" / "date=*" / "*.parquet")))
+    assert len(files) == 2
+
+    table = parquet.read_table(files[0])
+    assert table.num_rows == 5
+    assert table.schema.field("pv1_voltage").type == pyarrow.float64()
+    assert table.schema.field("pv1_voltage").metadata == {b"unit" : b"V"}
+    assert table.schema.field("extra").type == pyarrow.string()
+    assert table.column("pv1_voltage").to_pylist() == [230.1 + i for i in range(5)]
+    assert parquet.read_table(files[1]).num_rows == 2
+
+
+def test_missing_pyarrow_is_reported(monkeypatch, make_transport):
+    monkeypatch.setattr(parquet_out_module, "pyarrow", None)
+    with pytest.raises(ValueError, match="pip install pyarrow"):
+        make_transport(parquet_out)
+
+
+def test_coded_variables_are_strings(make_transport, make_source):
+    transport = make_transport(parquet_out)
+    settings = protocol_settings("v0.14")
+    settings.codes["vpv1_codes"] = {"0" : "Off"} #by documented name, like the decoders
+    settings.compile_codes()
+
+    schema, converters = transport._build_schema(make_source(protocolSettings=settings))
+    assert schema.field("pv1_voltage").type == pyarrow.string()
+
+
+def test_quiet_devices_are_flushed(tmp_path, make_transport, make_source):
+    transport = make_transport(parquet_out, output_path=str(tmp_path), flush_interval="0.2", flush_check="0.05")
+    transport.connect()
+
+    source = make_source()
+    transport.write_data({"pv1_voltage" : 230.1}, source) #no further writes from this device
+
+    deadline = time.time() + 5
+    while not glob.glob(str(tmp_path / "abc" / "date=*" / "*.parquet")) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not transport.buffers
+
+    transport.write_data({"pv1_voltage" : 231.1}, source)
+    transport.close() #shutdown writes what is buffered
+    assert len(glob.glob(str(tmp_path / "abc" / "date=*" / "*.parquet"))) == 2
+    assert not transport.flush_thread.is_alive()
@@ -1,5 +1,7 @@
+import dataclasses
 import glob
 import os
+import shutil
 import sys
 
 import pytest
@@ -7,7 +9,13 @@ import pytest
 #move up a folder for tests
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from classes.protocol_settings import protocol_settings
+from classes.protocol_settings import (
+    Data_Type,
+    Registry_Type,
+    protocol_settings,
+    registry_map_entry,
+)
+from protocol_gateway import CustomConfigParser as ConfigParser
 
 # List of protocols to test
 # Create the search pattern to find .json files recursively
@@ -23,3 +31,104 @@ protocols = [os.path.splitext(os.path.basename(f))[0] for f in files]
 def test_protocol_setting(protocol : str):
     print(protocol)
     protocolSettings : protocol_settings = protocol_settings(protocol)  # noqa: F841
+
+
+def test_protocol_cache(tmp_path, monkeypatch):
+    settings_dir = tmp_path / "protocols"
+    settings_dir.mkdir()
+    for file in glob.glob(os.path.join("protocols", "growatt", "v0.14.*")):
+        shutil.copy(file, settings_dir)
+
+    config = ConfigParser()
+    config.read_dict({"transport.test" : {"protocol_cache" : "true", "protocol_cache_path" : str(tmp_path / "cache")}})
+    transport_settings = config["transport.test"]
+
+    parsed = protocol_settings("v0.14", transport_settings=transport_settings, settings_dir=str(settings_dir))
+    assert len(glob.glob(str(tmp_path / "cache" / "v0.14.*.pickle"))) == 1
+
+    #cached; no csv is parsed
+    with monkeypatch.context() as m:
+        m.setattr(protocol_settings, "load__registry", lambda *args, **kwargs: pytest.fail("registry map parsed"))
+        cached = protocol_settings("v0.14", transport_settings=transport_settings, settings_dir=str(settings_dir))
+
+    for registry_type in parsed.registry_map:
+        assert [dataclasses.astuple(entry) for entry in cached.registry_map[registry_type]] == [dataclasses.astuple(entry) for entry in parsed.registry_map[registry_type]]
+        assert cached.registry_map_ranges[registry_type] == parsed.registry_map_ranges[registry_type]
+        assert cached.decoder_plans[id(cached.registry_map[registry_type])]
+    assert cached.codes == parsed.codes
+
+    #an edited override invalidates the cache
+    override = settings_dir / "v0.14.input_registry_map.override.csv"
+    override.write_text(override.read_text(encoding="latin-1") + "\n", encoding="latin-1")
+    with monkeypatch.context() as m:
+        calls = []
+        load__registry = protocol_settings.load__registry
+        m.setattr(protocol_settings, "load__registry", lambda self, *args, **kwargs: calls.append(args) or load__registry(self, *args, **kwargs))
+        protocol_settings("v0.14", transport_settings=transport_settings, settings_dir=str(settings_dir))
+    assert calls
+
+
+def test_protocol_cache_is_optional(tmp_path):
+    #off by default
+    config = ConfigParser()
+    config.read_dict({"transport.test" : {"protocol_cache_path" : str(tmp_path / "cache")}})
+    protocol_settings("v0.14", transport_settings=config["transport.test"])
+    assert not (tmp_path / "cache").exists()
+
+    #unwritable cache folder; loads without a cache
+    (tmp_path / "file").write_text("")
+    config.read_dict({"transport.test" : {"protocol_cache" : "true", "protocol_cache_path" : str(tmp_path / "file" / "cache")}})
+    assert protocol_settings("v0.14", transport_settings=config["transport.test"]).registry_map
+
+
+def test_registry_entries_are_compact():
+    settings = protocol_settings("growatt_2020_v1.24")
+    entries = [entry for registry_map in settings.registry_map.values() for entry in registry_map]
+    assert not hasattr(entries[0], "__dict__")
+
+    #identical values and names are shared, not copied per entry
+    shared = {}
+    for entry in entries:
+        assert isinstance(entry.values, tuple) and isinstance(entry.concatenate_registers, tuple)
+        assert shared.setdefault(entry.values, entry.values) is entry.values
+    assert len(shared) < len(entries)
+
+
+def test_registry_indexes_match_map():
+    settings = protocol_settings("growatt_2020_v1.24")
+    for registry_type, registry_map in settings.registry_map.items():
+        for entry in registry_map:
+            assert settings.get_registry_entry_by_variable(entry.variable_name, registry_type) is next(e for e in registry_map if e.variable_name == entry.variable_name)
+            assert settings.get_registry_entry(entry.documented_name, registry_type) is next(e for e in registry_map if e.documented_name == entry.documented_name)
+            assert entry in settings.get_registry_entries_by_register(entry.register, entry.register, registry_type)
+
+    assert settings.get_registry_entry("Serial No 1", Registry_Type.HOLDING) is not None
+    assert settings.get_registry_entry_by_variable("not_a_variable", Registry_Type.HOLDING) is None
+    assert settings.get_registry_entry("anything", Registry_Type.ZERO) is None
+
+    #concatenated ranges; every register of the range, also reversed ranges
+    settings = protocol_settings("v0.14")
+    entry = settings.get_registry_entry_by_variable("fw_version", Registry_Type.HOLDING)
+    entries = settings.get_registry_entries_by_register(entry.register, max(entry.concatenate_registers), Registry_Type.HOLDING)
+    assert {e.register for e in entries if e.variable_name == entry.variable_name} == set(entry.concatenate_registers)
+
+
+def test_code_tables():
+    settings = protocol_settings("v0.14")
+    settings.codes["test_flags_codes"] = {"b0" : "Grid", "b1" : "Battery", "b0&b1" : "Hybrid", "b2&x" : "Invalid"}
+    settings.codes["test_mode_codes"] = {"0" : "Off", "1" : "On", "2" : "on"}
+    settings.compile_codes()
+
+    entry = registry_map_entry(registry_type=Registry_Type.ZERO, register=1, register_bit=0, register_byte=0,
+                               variable_name="test_mode", documented_name="test_mode", unit="", unit_mod=1,
+                               concatenate=False, concatenate_registers=(), values=())
+    assert settings.get_code_by_value(entry, " ON ") == "1" #first code wins
+    assert settings.get_code_by_value(entry, "standby", fallback="standby") == "standby"
+    assert settings.validate_registry_entry(entry, "2") == 1
+
+    #multibit flags
+    entry.documented_name = entry.variable_name = "test_flags"
+    entry.data_type = Data_Type._16BIT_FLAGS
+    assert settings.multibit_flags["test_flags"] == ((0b11, "Hybrid"),)
+    assert settings.process_register_bytes({1 : bytes([0b011, 0])}, entry) == "Grid,Battery,Hybrid"
+    assert settings.process_register_bytes({1 : bytes([0b010, 0])}, entry) == "Battery"
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.registry_image import registry_image
+
+
+def test_set_range_reads_like_a_dict():
+    image = registry_image()
+    assert not image
+    assert len(image) == 0
+
+    image.set_range(10, [1, 2, 3])
+    image.set_range(2, [7])
+
+    assert dict(image.items()) == {2 : 7, 10 : 1, 11 : 2, 12 : 3}
+    assert list(image.keys()) == [2, 10, 11, 12]
+    assert list(image.values()) == [7, 1, 2, 3]
+    assert len(image) == 4
+    assert 11 in image
+    assert 3 not in image
+    assert 100 not in image
+    assert image[12] == 3
+    assert image.get(5, -1) == -1
+
+
+def test_set_range_overwrites():
+    image = registry_image()
+    image.set_range(0, [1, 2, 3, 4])
+    image.set_range(1, [0xFFFF, 0])
+    assert dict(image) == {0 : 1, 1 : 0xFFFF, 2 : 0, 3 : 4}
+
+
+def test_unread_register_raises_key_error():
+    image = registry_image()
+    image.set_range(63700, [1, 2])
+    with pytest.raises(KeyError):
+        image[63699]
+    assert image.get(63702) is None
+
+
+def test_ranges_are_stored_per_range():
+    image = registry_image()
+    image.set_range(0x000A, [1, 2])
+    image.set_range(0xF900, [3])
+    image.set_range(0x000C, [4]) #touching; appended
+    image.set_range(0x0008, [5, 6, 7]) #overlapping; merged
+    assert image.starts == [0x0008, 0xF900]
+    assert [len(buffer) for buffer in image.buffers] == [5, 1]
+    assert dict(image) == {0x0008 : 5, 0x0009 : 6, 0x000A : 7, 0x000B : 2, 0x000C : 4, 0xF900 : 3}
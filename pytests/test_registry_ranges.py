@@ -0,0 +1,74 @@
+import os
+import sys
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.protocol_settings import (
+    Data_Type,
+    Registry_Type,
+    WriteMode,
+    protocol_settings,
+)
+
+
+def make_settings(batch_size : int = 45, max_gap : int = -1) -> protocol_settings:
+    settings = protocol_settings("v0.14")
+    settings.max_batch_size = batch_size
+    settings.max_batch_gap = batch_size if max_gap < 0 else max_gap
+    return settings
+
+
+def test_merges_across_window_boundary(make_entry):
+    settings = make_settings()
+    entries = [make_entry(r) for r in range(40, 51)]
+    assert settings.calculate_registry_ranges(entries, 50, init=True) == [(40, 11)]
+
+
+def test_respects_batch_size(make_entry):
+    settings = make_settings(batch_size=10)
+    entries = [make_entry(r) for r in range(0, 25)]
+    assert settings.calculate_registry_ranges(entries, 24, init=True) == [(0, 10), (10, 10), (20, 5)]
+
+
+def test_splits_large_gaps(make_entry):
+    settings = make_settings(max_gap=5)
+    entries = [make_entry(0), make_entry(6), make_entry(20)]
+    assert settings.calculate_registry_ranges(entries, 20, init=True) == [(0, 7), (20, 1)]
+
+
+def test_32bit_entries_are_not_split(make_entry):
+    settings = make_settings(batch_size=10)
+    entries = [make_entry(0), make_entry(9, Data_Type.UINT)]
+    assert settings.calculate_registry_ranges(entries, 9, init=True) == [(0, 1), (9, 2)]
+
+
+def test_skips_disabled_and_not_due(make_entry):
+    settings = make_settings()
+    entries = [make_entry(0), make_entry(1, write_mode=WriteMode.READDISABLED), make_entry(2, write_mode=WriteMode.WRITEONLY), make_entry(3)]
+    entries[3].next_read_timestamp = 2000 * 1000
+    assert settings.calculate_registry_ranges(entries, 3, timestamp=1000) == [(0, 1)]
+    assert entries[0].next_read_timestamp == 1000 * 1000 + entries[0].read_interval
+
+
+def test_ranges_avoid_holes(make_entry):
+    settings = make_settings()
+    entries = [make_entry(r) for r in range(0, 10)] + [make_entry(12, Data_Type.UINT)]
+    assert settings.calculate_registry_ranges(entries, 13, init=True, holes={4, 13}) == [(0, 4), (5, 5)]
+
+
+def test_shared_settings_with_per_transport_schedule(make_config):
+    shared = protocol_settings.get("v0.14", transport_settings=make_config("transport.a"))
+    assert protocol_settings.get("v0.14", transport_settings=make_config("transport.b")) is shared
+    assert protocol_settings.get("v0.14", transport_settings=make_config("transport.c", read_interval="30")) is not shared
+
+    registry_map = shared.get_registry_map(Registry_Type.INPUT)
+    size = shared.registry_map_size[Registry_Type.INPUT]
+    schedule_a : dict[int, int] = {}
+    schedule_b : dict[int, int] = {}
+    assert shared.calculate_registry_ranges(registry_map, size, timestamp=1000, schedule=schedule_a)
+    assert not shared.calculate_registry_ranges(registry_map, size, timestamp=1000, schedule=schedule_a)
+
+    #the other transport is still due; shared entries are not modified
+    assert shared.calculate_registry_ranges(registry_map, size, timestamp=1000, schedule=schedule_b)
+    assert all(entry.next_read_timestamp == 0 for entry in registry_map)
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import sys
+import time
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.transports.sqlite_out import HOUR, MINUTE, sqlite_out
+
+
+def test_batched_writes(tmp_path, make_transport, make_source):
+    database = str(tmp_path / "history.db")
+    transport = make_transport(sqlite_out, database=database, batch_size="4", batch_timeout="3600", rollup_interval="3600")
+    transport.connect()
+    source = make_source()
+    transport.last_rollup = float("inf")
+    transport.write_data({"battery_voltage" : "48.5", "status" : "Normal"}, source)
+    assert len(transport.pending) == 2
+
+    time.sleep(0.01)
+    transport.write_data({"battery_voltage" : "48.6", "status" : "Normal"}, source)
+    assert not transport.pending
+
+    db = sqlite3.connect(database)
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.execute("SELECT COUNT(*) FROM variables").fetchone()[0] == 2
+    rows = db.execute("SELECT variable, value, text FROM history ORDER BY time, variable").fetchall()
+    assert ("battery_voltage", 48.5, None) in rows
+    assert ("status", None, "Normal") in rows
+    transport.close()
+
+
+def test_rollups_and_retention(tmp_path, make_transport, make_source):
+    transport = make_transport(sqlite_out, database=str(tmp_path / "history.db"), retention_raw="3600", retention_1m="7200")
+    transport.connect()
+    variable_id = transport.get_variable_id(transport.get_device_id(make_source()), "power", "W")
+
+    # two hours of readings, every 30 seconds; value = minute of the reading
+    transport.pending = [(i * 30000, variable_id, float(i // 2), None) for i in range(240)]
+    transport.commit()
+
+    transport.rollup(now=2 * HOUR + 1)
+    db = transport.connection
+    minutes = db.execute("SELECT time, min, max, avg, count FROM rollups WHERE period = ? ORDER BY time", (MINUTE,)).fetchall()
+    assert len(minutes) == 120
+    assert minutes[3] == (3 * MINUTE, 3.0, 3.0, 3.0, 2)
+
+    hours = db.execute("SELECT time, min, max, avg, count FROM rollups WHERE period = ? ORDER BY time", (HOUR,)).fetchall()
+    assert hours == [(0, 0.0, 59.0, 29.5, 120), (HOUR, 60.0, 119.0, 89.5, 120)]
+
+    # only new complete buckets are rolled up
+    transport.pending = [(2 * HOUR + 5000, variable_id, 500.0, None)]
+    transport.commit()
+    transport.rollup(now=2 * HOUR + MINUTE)
+    assert db.execute("SELECT COUNT(*) FROM rollups WHERE period = ?", (MINUTE,)).fetchone()[0] == 121
+    assert db.execute("SELECT COUNT(*) FROM rollups WHERE period = ?", (HOUR,)).fetchone()[0] == 2
+
+    transport.prune(now=3 * HOUR)
+    assert db.execute("SELECT MIN(time) FROM readings").fetchone()[0] == 2 * HOUR + 5000
+    assert db.execute("SELECT MIN(time) FROM rollups WHERE period = ?", (MINUTE,)).fetchone()[0] == HOUR
+    assert db.execute("SELECT COUNT(*) FROM rollups WHERE period = ?", (HOUR,)).fetchone()[0] == 2
+    transport.close()
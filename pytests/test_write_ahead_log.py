@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+
+#move up a folder for tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from classes.write_ahead_log import write_ahead_log
+
+
+def test_append_read_ack_across_segments(tmp_path):
+    log = write_ahead_log(str(tmp_path), segment_size=100)
+    for i in range(30):
+        log.append({"i" : i, "fields" : {"value" : i * 0.5}})
+
+    assert len(log) == 30
+    assert len(log.get_segments()) > 1
+
+    records, read, position = log.read(10)
+    assert [record["i"] for record in records] == list(range(10))
+    log.ack(read, position)
+    assert len(log) == 20
+
+    #unacknowledged records are read again
+    records, read, position = log.read(5)
+    assert [record["i"] for record in records] == list(range(10, 15))
+
+    records, read, position = log.read()
+    assert [record["i"] for record in records] == list(range(10, 30))
+    log.ack(read, position)
+    assert len(log) == 0
+    assert len(log.get_segments()) <= 1
+
+
+def test_reopen_resumes_from_cursor(tmp_path):
+    log = write_ahead_log(str(tmp_path))
+    for i in range(10):
+        log.append({"i" : i})
+    log.ack(*log.read(4)[1:])
+    log.close()
+
+    #torn write from a power loss
+    segment = log.get_segment_file(log.get_segments()[-1])
+    with open(segment, "ab") as f:
+        f.write(write_ahead_log.HEADER.pack(50) + b"partial")
+
+    log = write_ahead_log(str(tmp_path))
+    assert len(log) == 6
+
+    log.append({"i" : 10})
+    records, read, position = log.read()
+    assert [record["i"] for record in records] == [4, 5, 6, 7, 8, 9, 10]
+
+
+def test_skip_and_expire(tmp_path):
+    log = write_ahead_log(str(tmp_path), segment_size=50)
+    for i in range(20):
+        log.append({"i" : i})
+
+    log.skip(5)
+    assert len(log) == 15
+    assert log.read(1)[0][0]["i"] == 5
+
+    old = time.time() - 1000
+    for segment in log.get_segments()[:-1]:
+        os.utime(log.get_segment_file(segment), (old, old))
+
+    dropped = log.expire(500)
+    assert dropped > 0
+    assert len(log) == 15 - dropped
+    assert len(log.get_segments()) == 1
+    assert [record["i"] for record in log.read()[0]] == list(range(20 - len(log), 20))